@@ -0,0 +1,132 @@
+'''
+Compares the calculation backends of the Simulation API ('cpp' and
+'numpy') on the ODEON example room (data/legacy/odeon_ex): ray tracing
+throughput (rays/s, all sources) and agreement of T30, EDT and C80
+(median over sources and receivers, robust to the odd failed decay fit).
+The scattering makes each run a different random sample, so the 'numpy'
+results are also compared with a second 'numpy' run (different seed) to
+show the run to run spread.
+
+Run from the repository root:
+    PYTHONPATH=. python example/bench_backends.py [n_rays]
+'''
+import sys
+import time
+
+import numpy as np
+import scipy.io as spio
+import toml
+
+from ra import backends
+from ra.absorption_database import load_matdata_from_mat, get_alpha_s
+from ra.results import process_results
+from ra.simulation_api import Simulation
+
+CFG_DIR = 'data/legacy/odeon_ex/'
+
+
+def load_legacy(sim_toml, mat_toml, room=None):
+    '''configurations and geometry dictionaries of a legacy room (.mat),
+    optionally replacing the configuration's room file'''
+    sim_cfg = toml.load(sim_toml)
+    mat_cfg = toml.load(mat_toml)
+    if room is not None:
+        sim_cfg['geometry']['room'] = room
+    alpha_list = load_matdata_from_mat(sim_cfg['material'])
+    alpha, s = get_alpha_s(sim_cfg['geometry'], mat_cfg['material'],
+        alpha_list)
+    # planes as in room.GeometryMat
+    mat = spio.loadmat(sim_cfg['geometry']['room'], struct_as_record=True)
+    vertcoord = np.array(mat['geometry']['vertcoord'][0][0])
+    geom_dict = []
+    for jp, p in enumerate(mat['geometry']['plane'][0][0][0]):
+        geom_dict.append({'name': 'plane {}'.format(jp), 'bbox': False,
+            'vertices': np.array([vertcoord[v - 1] for v in p[0][0]]),
+            'normal': np.float32(p[1][0]), 'area': float(p[2][0][0]),
+            'alpha': np.float32(alpha[jp]), 's': float(s[jp])})
+    return sim_cfg, geom_dict
+
+
+def load_odeon_ex():
+    '''configurations and geometry dictionaries of the ODEON example'''
+    return load_legacy(CFG_DIR + 'simulation.toml',
+        CFG_DIR + 'surface_mat_id.toml')
+
+
+def setup(backend, sim_cfg, geom_dict, nrays, seed):
+    '''a Simulation of the ODEON example, ready to run'''
+    ctls = sim_cfg['controls']
+    sim = Simulation()
+    sim.set_backend(backend)
+    sim.set_configs({'freq': ctls['freq'], 'n_rays': nrays,
+        'ht_length': ctls['ht_length'], 'dt': ctls['Dt'],
+        'allow_scattering': ctls['allow_scattering'],
+        'transition_order': ctls['transition_order'],
+        'rec_radius_init': ctls['rec_radius_init'],
+        'allow_growth': ctls.get('allow_growth', 1),
+        'rec_radius_final': ctls['rec_radius_final']})
+    sim.set_air(sim_cfg['air'])
+    sim.set_geometry(geom_dict)
+    np.random.seed(seed)
+    sim.set_raydir()
+    sim.set_receivers([{'coord': r['position'],
+        'orientation': r['orientation']} for r in sim_cfg['receivers']])
+    sim.set_memory_init()
+    sim.set_sources([{'coord': s['position'],
+        'orientation': s['orientation'], 'power_dB': s['power_dB'],
+        'eq_dB': s['eq_dB'], 'delay': s['delay']}
+        for s in sim_cfg['sources']])
+    return sim
+
+
+def run(backend, sim_cfg, geom_dict, nrays, seed, workers=1):
+    '''runs the simulation and returns the tracing time and the results'''
+    sim = setup(backend, sim_cfg, geom_dict, nrays, seed)
+    sim.sources = sim.backend.direct_sound(sim)
+    start = time.time()
+    sim.sources = sim.backend.raytracer(sim, workers)
+    elapsed = time.time() - start
+    sim.sources = sim.backend.intensity(sim)
+    sr_results = process_results(sim.Dt, sim.ht_length, sim.freq,
+        sim.sources, sim.receivers)
+    return elapsed, sim.rays_v.Nrays * len(sim.sources), sr_results
+
+
+def parameters(sr_results):
+    '''T30, EDT and C80 (n_pairs x n_bands)'''
+    pairs = [rec for sou in sr_results for rec in sou.rec]
+    return {par: np.array([getattr(rec, par) for rec in pairs])
+        for par in ('T30', 'EDT', 'C80')}
+
+
+def compare(name, ref, par):
+    for key in ('T30', 'EDT', 'C80'):
+        diff = np.abs(np.median(par[key], axis=0) -
+            np.median(ref[key], axis=0))
+        print('  {:>3s} {:<16s} |diff| per band: {}'.format(key, name,
+            np.array2string(diff, precision=3, suppress_small=True)))
+
+
+def main():
+    nrays = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    sim_cfg, geom_dict = load_odeon_ex()
+    names = ['numpy'] if backends.ra_cpp is None else ['cpp', 'numpy']
+    if backends.ra_cpp is None:
+        print("ra_cpp is not installed, timing the 'numpy' backend only.")
+    results = {}
+    for name in names:
+        elapsed, ntraced, sr_results = run(name, sim_cfg, geom_dict, nrays,
+            seed=0)
+        results[name] = parameters(sr_results)
+        print('{:>6s}: {:.2f} s tracing, {:.0f} rays/s'.format(name, elapsed,
+            ntraced / elapsed))
+    _, _, sr_results = run('numpy', sim_cfg, geom_dict, nrays, seed=1)
+    print('Median over source-receiver pairs, bands {}:'.format(
+        sim_cfg['controls']['freq']))
+    if 'cpp' in results:
+        compare('cpp - numpy', results['cpp'], results['numpy'])
+    compare('numpy - numpy', results['numpy'], parameters(sr_results))
+
+
+if __name__ == '__main__':
+    main()
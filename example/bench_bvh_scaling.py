@@ -0,0 +1,87 @@
+'''
+Scaling of the nearest plane query with the number of triangles: the linear
+scan of `rtrace.nearest_polygons()` against the bounding volume hierarchy of
+`ra.bvh.BVH`. The closed `simple.dae` room is subdivided (every triangle split
+in four) to get rooms of growing triangle count with the same shape; the
+Blender exported rooms are also timed when given in the command line.
+
+Run from the repository root:
+    PYTHONPATH=. python example/bench_bvh_scaling.py [room.dae ...]
+'''
+import sys
+import time
+
+import collada as co
+import numpy as np
+
+import ra.rtrace as rt
+from ra.bvh import BVH
+
+
+def load_dae(path):
+    '''triangles and normals of a collada file, as in `room.Geometry`'''
+    triangles, normals = [], []
+    mesh = co.Collada(path)
+    for obj in mesh.scene.objects('geometry'):
+        for triset in obj.primitives():
+            if type(triset) != co.triangleset.BoundTriangleSet:
+                continue
+            for tri in triset:
+                triangles.append(np.array(tri.vertices, np.float32))
+                normals.append(tri.normals[0] / np.linalg.norm(tri.normals[0]))
+    return np.array(triangles, np.float32), np.array(normals, np.float32)
+
+
+def subdivide(triangles, normals):
+    '''splits every triangle in four through its edges' middle points'''
+    a, b, c = triangles[:, 0], triangles[:, 1], triangles[:, 2]
+    ab, bc, ca = (a + b) / 2, (b + c) / 2, (c + a) / 2
+    triangles = np.concatenate([
+        np.stack(tri, axis=1) for tri in
+        ((a, ab, ca), (ab, b, bc), (ca, bc, c), (ab, bc, ca))
+    ])
+    return triangles, np.tile(normals, (4, 1))
+
+
+def random_rays(triangles, nrays, seed=0):
+    '''isotropic rays leaving from near the center of the geometry'''
+    rng = np.random.RandomState(seed)
+    center = triangles.reshape(-1, 3).mean(axis=0)
+    r0 = center + 0.1 * rng.randn(nrays, 3)
+    rd = rng.randn(nrays, 3)
+    rd /= np.linalg.norm(rd, axis=1)[:, None]
+    return r0.astype(np.float32), rd.astype(np.float32)
+
+
+def time_query(fun, *args):
+    time_start = time.time()
+    result = fun(*args)
+    return result, time.time() - time_start
+
+
+def bench(name, triangles, normals, nrays=2000):
+    r0, rd = random_rays(triangles, nrays)
+    (ids, ts, _), t_linear = time_query(rt.nearest_polygons, r0, rd,
+        triangles, normals, 256)
+    bvh, t_build = time_query(BVH, triangles, normals)
+    (bvh_ids, bvh_ts, _), t_bvh = time_query(bvh.nearest, r0, rd)
+    assert np.array_equal(ids, bvh_ids) and np.array_equal(ts, bvh_ts)
+    print('{:>28} {:>8} {:>12.2f} {:>12.2f} {:>9.1f}x {:>10.3f}'.format(
+        name, len(triangles), 1e6 * t_linear / nrays, 1e6 * t_bvh / nrays,
+        t_linear / t_bvh, t_build))
+
+
+def main():
+    print('{:>28} {:>8} {:>12} {:>12} {:>10} {:>10}'.format('room',
+        'planes', 'linear us/ray', 'bvh us/ray', 'speedup', 'build s'))
+    triangles, normals = load_dae('data/rooms/simple/simple.dae')
+    for level in range(6):
+        bench('simple.dae x 4^{}'.format(level), triangles, normals)
+        triangles, normals = subdivide(triangles, normals)
+    for path in sys.argv[1:]:
+        triangles, normals = load_dae(path)
+        bench(path.split('/')[-1], triangles, normals)
+
+
+if __name__ == '__main__':
+    main()
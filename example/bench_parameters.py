@@ -0,0 +1,92 @@
+'''
+Batched parameters (ra.results.batch_parameters): EDT, T20, T30, C80, D50,
+Ts, G, LF and LFC of a source of the ODEON example room
+(data/legacy/odeon_ex) with 50 receivers at random positions in the room's
+bounding box (the ones with direct sound), one pair and band at a time
+(the per band functions, results.edt(), t20(), ...) or all pairs and bands
+at once (as RecResults.set_parameters). Both agree where the per band
+functions can calculate a parameter; the batched ones are NaN where they
+cannot.
+
+Run from the repository root:
+    PYTHONPATH=. python example/bench_parameters.py [n_rays]
+'''
+import sys
+import time
+
+import numpy as np
+
+from bench_backends import load_odeon_ex, setup
+from ra import results
+
+NRECS = 50
+REPEAT = 5
+PARAMETERS = ('EDT', 'T20', 'T30', 'C80', 'D50', 'Ts', 'G', 'LF', 'LFC')
+
+
+def per_band_parameters(reflectograms, time_bins, freq):
+    '''the parameters of a pair, one band at a time'''
+    reflectogram, reflecto_cos2, reflecto_cosabs = reflectograms
+    decay = results.decay_curve(reflectogram)
+    id_dir = np.nonzero(reflectogram[0, :])[0][0]
+    pars = {'EDT': results.edt(time_bins, decay, id_dir, freq),
+        'T20': results.t20(time_bins, decay, id_dir, freq),
+        'T30': results.t30(time_bins, decay, id_dir, freq),
+        'C80': results.c80(time_bins, reflectogram, id_dir, freq),
+        'D50': results.d50(time_bins, reflectogram, id_dir, freq),
+        'Ts': results.ts(time_bins, reflectogram, id_dir, freq),
+        'G': results.g_db(reflectogram, np.ones(freq.size), freq)}
+    pars['LF'], pars['LFC'] = results.lf_lfc(time_bins, reflectogram,
+        id_dir, freq, reflecto_cos2, reflecto_cosabs)
+    return pars
+
+
+def main():
+    nrays = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    sim_cfg, geom_dict = load_odeon_ex()
+    vertices = np.concatenate([np.asarray(p['vertices']) for p in geom_dict])
+    box_min, box_max = vertices.min(axis=0), vertices.max(axis=0)
+    rng = np.random.RandomState(0)
+    sim_cfg['receivers'] = [{'position': box_min + (box_max - box_min) *
+        rng.rand(3), 'orientation': [1.0, 0.0, 0.0]} for _ in range(NRECS)]
+    sim_cfg['sources'] = sim_cfg['sources'][:1]
+    sim = setup('numpy', sim_cfg, geom_dict, nrays, seed=0)
+    sim.sources = sim.backend.direct_sound(sim)
+    sim.sources = sim.backend.raytracer(sim)
+    sim.sources = sim.backend.intensity(sim)
+    s = sim.sources[0]
+    time_bins = np.arange(0.0, 1.2 * sim.ht_length, sim.Dt)
+    reflectograms = results.source_reflectograms(time_bins,
+        [results.concatenate_crossings(s, jrec) for jrec in range(NRECS)])
+    # the per pair parameters need the direct sound
+    reflectograms = [r for r in reflectograms if np.any(r[0][0] != 0)]
+    reflectogram, reflecto_cos2, reflecto_cosabs = [
+        results.stack_reflectograms([r[kind] for r in reflectograms])
+        for kind in range(3)]
+    loop_time, batch_time = np.inf, np.inf
+    for _ in range(REPEAT):
+        start = time.time()
+        recs = [per_band_parameters(r, time_bins, sim.freq)
+            for r in reflectograms]
+        loop_time = min(loop_time, time.time() - start)
+        start = time.time()
+        pars = results.batch_parameters(time_bins, reflectogram,
+            reflecto_cos2=reflecto_cos2, reflecto_cosabs=reflecto_cosabs)
+        batch_time = min(batch_time, time.time() - start)
+    print('{} rays, {} receivers with direct sound, {} bands, {} bins'.format(
+        nrays, *reflectogram.shape))
+    for par in PARAMETERS:
+        ref = np.array([r[par] for r in recs], dtype=np.float64)
+        # the pairs and bands the per band functions could calculate
+        valid = np.isfinite(ref) & (ref != 0) & (np.abs(ref) < 1e6)
+        error = np.abs(pars[par][valid] - ref[valid]) / \
+            np.maximum(np.abs(ref[valid]), 1e-6)
+        print('{:>4}: {:4d} values, max relative difference {:.1e}, '
+            '{} NaN'.format(par, int(valid.sum()),
+            error.max() if error.size else 0.0, int(np.isnan(pars[par]).sum())))
+    print('best of {}: per pair {:.3f} s, batched {:.3f} s, {:.1f}x'.format(
+        REPEAT, loop_time, batch_time, loop_time / batch_time))
+
+
+if __name__ == '__main__':
+    main()
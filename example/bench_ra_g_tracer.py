@@ -0,0 +1,73 @@
+'''
+Compares the ray by ray tracer of `ra_g.Simulation.start()` against the
+bounce-synchronous `ra_g.Simulation.start_vectorized()`: both are timed on the
+same room and the rays positions, directions and lengths are compared.
+
+Run from the repository root:
+    PYTHONPATH=. python example/bench_ra_g_tracer.py [room.dae]
+'''
+import sys
+import tempfile
+import time
+
+import numpy as np
+import toml
+
+from ra.ra_g import Simulation
+
+
+def write_cfg(room):
+    config = {
+        'sources': [{'position': [0.0, 0.0, 0.5]}],
+        'receivers': [{'position': [1.0, 1.0, 0.5]}],
+        'geometry': {
+            'room': room,
+            'bbox': 'data/rooms/simple/bbox.dae',
+        },
+    }
+    cfg = tempfile.NamedTemporaryFile('w', suffix='.toml', delete=False)
+    cfg.write(toml.dumps(config))
+    cfg.close()
+    return cfg.name
+
+
+def main():
+    room = sys.argv[1] if len(sys.argv) > 1 else 'data/rooms/simple/simple.dae'
+    cfgfile = write_cfg(room)
+
+    sim_loop = Simulation(cfgfile)
+    sim_vec = Simulation(cfgfile)
+    nrays = sum(r.nrays for r in sim_loop.rays)
+    print('room: {} ({} planes), {} rays, {} iterations'.format(
+        room, len(sim_loop.room), nrays, sim_loop.rays[0].niters))
+
+    time_start = time.time()
+    sim_loop.start()
+    time_loop = time.time() - time_start
+
+    time_start = time.time()
+    sim_vec.start_vectorized()
+    time_vec = time.time() - time_start
+
+    print('loop:       {:.3f} s'.format(time_loop))
+    print('vectorized: {:.3f} s ({:.1f}x)'.format(
+        time_vec, time_loop / time_vec))
+
+    # reflections are chaotic: float32 round off (np.dot against np.sum)
+    # may make long paths drift apart after many orders, so agreement is
+    # reported per ray rather than asserted
+    nsame = 0
+    for r_loop, r_vec in zip(sim_loop.rays, sim_vec.rays):
+        for jray in range(r_loop.nrays):
+            length = r_loop.length[jray]
+            nsame += (length == r_vec.length[jray] and
+                np.allclose(r_loop.ris[jray, :length],
+                    r_vec.ris[jray, :length], atol=1e-3) and
+                np.allclose(r_loop.rds[jray, :length],
+                    r_vec.rds[jray, :length], atol=1e-3))
+    print('rays with the same path: {}/{}'.format(nsame, nrays))
+    print('escaped rays: {} (loop), {} (vectorized)'.format(
+        sim_loop.n_escaped_rays, sim_vec.n_escaped_rays))
+
+if __name__ == '__main__':
+    main()
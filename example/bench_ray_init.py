@@ -0,0 +1,57 @@
+'''
+Ray allocation of the 'cpp' backend (ra.ray_initializer): one Raycpp per
+python call, each with its own planes history and reflection points arrays
+(the former loop), against the contiguous blocks of ray_blocks() turned
+into rays by a single c++ call (ray_initializer). Both give the same rays.
+
+Run from the repository root:
+    PYTHONPATH=. python example/bench_ray_init.py [n_rays ...]
+'''
+import sys
+import time
+
+import numpy as np
+
+from ra.ray_initializer import ra_cpp, ray_initializer, EMPTY_PLANE
+
+N_MAX_REF = 169
+TRANS_ORDER = 1
+
+
+class RaysDir():
+    def __init__(self, nrays):
+        self.Nrays = nrays
+
+
+def loop_initializer(rays_dir, N_max_ref, trans_order, reccross):
+    '''the former ray_initializer: a loop over the rays'''
+    rays = []
+    for jray in np.arange(rays_dir.Nrays):
+        planes = np.zeros(N_max_ref, dtype=np.uint16) + EMPTY_PLANE
+        reflection_points = np.zeros((trans_order + 2, 3), dtype=np.float32)
+        rays.append(ra_cpp.Raycpp(planes, reflection_points, reccross))
+    return rays
+
+
+def main():
+    if ra_cpp is None:
+        print('ra_cpp is not installed')
+        return
+    nrays_list = [int(n) for n in sys.argv[1:]] or [10000, 100000]
+    reccross = [ra_cpp.RecCrosscpp([], [], [], []) for _ in range(4)]
+    for nrays in nrays_list:
+        times = []
+        for initializer in (loop_initializer, ray_initializer):
+            start = time.time()
+            rays = initializer(RaysDir(nrays), N_MAX_REF, TRANS_ORDER,
+                reccross)
+            times.append(time.time() - start)
+        ray = rays[-1]
+        assert len(rays) == nrays and np.all(ray.planes_hist == EMPTY_PLANE)
+        assert ray.refpts_hist.shape == (TRANS_ORDER + 2, 3)
+        print('{:7d} rays: loop {:.3f} s, blocks {:.3f} s, {:.1f}x'.format(
+            nrays, times[0], times[1], times[0] / times[1]))
+
+
+if __name__ == '__main__':
+    main()
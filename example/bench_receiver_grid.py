@@ -0,0 +1,61 @@
+'''
+Receivers spatial index of the 'numpy' backend (ra.receiver_grid): ray
+tracing time of a source of the ODEON example room (data/legacy/odeon_ex)
+with 10, 100 and 1000 receivers at random positions in the room's bounding
+box, testing the ray segments against the receivers of a ReceiverGrid or
+against every receiver (brute force). Both give the same crossings.
+
+Run from the repository root:
+    PYTHONPATH=. python example/bench_receiver_grid.py [n_rays]
+'''
+import sys
+import time
+
+import numpy as np
+
+from bench_backends import load_odeon_ex, setup
+from ra import numpy_engine
+
+
+def trace(sim, rec_coords, use_grid):
+    '''traces the rays of the first source, returns the time and the
+    crossings'''
+    s = sim.sources[0]
+    fig8 = np.tile([1.0, 0.0, 0.0], (len(rec_coords), 1))
+    np.random.seed(0)
+    start = time.time()
+    _, _, cols, _ = numpy_engine.trace_source(np.asarray(s.coord),
+        rec_coords, fig8, sim.scene, sim.N_max_ref, sim.transition_order + 2,
+        sim.rays_v.vinit, sim.allow_scattering, sim.transition_order,
+        sim.rec_radius_init, sim.alow_growth, sim.rec_radius_final, sim.c0,
+        nrays_total=sim.rays_v.Nrays, use_grid=use_grid)
+    return time.time() - start, cols
+
+
+def same_crossings(a, b):
+    ka = np.lexsort((a['rec'], a['ray'], a['order']))
+    kb = np.lexsort((b['rec'], b['ray'], b['order']))
+    return all(np.array_equal(a[key][ka], b[key][kb]) for key in a)
+
+
+def main():
+    nrays = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    sim_cfg, geom_dict = load_odeon_ex()
+    sim = setup('numpy', sim_cfg, geom_dict, nrays, seed=0)
+    vertices = np.concatenate([np.asarray(p['vertices']) for p in geom_dict])
+    box_min, box_max = vertices.min(axis=0), vertices.max(axis=0)
+    rng = np.random.RandomState(0)
+    print('{} rays, {} reflections'.format(nrays, sim.N_max_ref))
+    print('{:>10s} {:>12s} {:>12s} {:>8s} {:>10s}'.format('receivers',
+        'brute [s]', 'grid [s]', 'speedup', 'crossings'))
+    for nrecs in (10, 100, 1000):
+        rec_coords = box_min + (box_max - box_min) * rng.rand(nrecs, 3)
+        brute_time, brute = trace(sim, rec_coords, use_grid=False)
+        grid_time, grid = trace(sim, rec_coords, use_grid=True)
+        assert same_crossings(brute, grid)
+        print('{:>10d} {:12.2f} {:12.2f} {:7.1f}x {:10d}'.format(nrecs,
+            brute_time, grid_time, brute_time / grid_time, grid['ray'].size))
+
+
+if __name__ == '__main__':
+    main()
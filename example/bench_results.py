@@ -0,0 +1,72 @@
+'''
+All receivers at once reflectograms (ra.results.source_reflectograms):
+binning time of the reflectograms (and the cos^2 and |cos| weighted ones
+of LF and LFC) of a source of the ODEON example room (data/legacy/odeon_ex)
+with 50 receivers at random positions in the room's bounding box, one
+receiver at a time (reflectogram_hist, as RecResults) or all together. Both
+give the same reflectograms, bit for bit.
+
+Run from the repository root:
+    PYTHONPATH=. python example/bench_results.py [n_rays]
+'''
+import sys
+import time
+
+import numpy as np
+
+from bench_backends import load_odeon_ex, setup
+from ra import results
+
+NRECS = 50
+REPEAT = 5
+
+
+def per_receiver(time_bins, crossings):
+    '''the reflectograms of reflectogram_hist, one receiver at a time'''
+    return [(results.reflectogram_hist(time_bins, time_cat, intensity_cat),
+        results.reflectogram_hist(time_bins, time_cat,
+            np.multiply(intensity_cat, cos_cat**2)),
+        results.reflectogram_hist(time_bins, time_cat,
+            np.multiply(intensity_cat, np.abs(cos_cat))))
+        for time_cat, intensity_cat, cos_cat in crossings]
+
+
+def main():
+    nrays = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    sim_cfg, geom_dict = load_odeon_ex()
+    vertices = np.concatenate([np.asarray(p['vertices']) for p in geom_dict])
+    box_min, box_max = vertices.min(axis=0), vertices.max(axis=0)
+    rng = np.random.RandomState(0)
+    sim_cfg['receivers'] = [{'position': box_min + (box_max - box_min) *
+        rng.rand(3), 'orientation': [1.0, 0.0, 0.0]} for _ in range(NRECS)]
+    sim_cfg['sources'] = sim_cfg['sources'][:1]
+    sim = setup('numpy', sim_cfg, geom_dict, nrays, seed=0)
+    sim.sources = sim.backend.direct_sound(sim)
+    sim.sources = sim.backend.raytracer(sim)
+    sim.sources = sim.backend.intensity(sim)
+    s = sim.sources[0]
+    time_bins = np.arange(0.0, 1.2 * sim.ht_length, sim.Dt)
+    start = time.time()
+    crossings = [results.concatenate_crossings(s, jrec)
+        for jrec in range(NRECS)]
+    cat_time = time.time() - start
+    loop_time, together_time = np.inf, np.inf
+    for _ in range(REPEAT):
+        start = time.time()
+        loop = per_receiver(time_bins, crossings)
+        loop_time = min(loop_time, time.time() - start)
+        start = time.time()
+        together = results.source_reflectograms(time_bins, crossings)
+        together_time = min(together_time, time.time() - start)
+    assert all(a.shape == b.shape and np.array_equal(a, b)
+        for rec_a, rec_b in zip(loop, together)
+        for a, b in zip(rec_a, rec_b))
+    print('{} rays, {} receivers, {} crossings (concatenated in {:.2f} s)'.format(
+        nrays, NRECS, sum(c[0].size for c in crossings), cat_time))
+    print('best of {}: per receiver {:.3f} s, all receivers {:.3f} s, '
+        '{:.1f}x'.format(REPEAT,
+        loop_time, together_time, loop_time / together_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+'''
+Energy aware ray termination on the legacy rooms ('numpy' backend):
+time saved by the wavefront mode with Russian roulette
+(`Simulation.set_wavefront(energy_floor_dB, roulette)`) against the change
+of T30 and EDT (median over source-receiver pairs, largest over the bands),
+compared with the full depth tracing (N_max_ref reflections). The plain
+termination at the same floor (biased) and a second full depth run with
+another seed (run to run spread) are shown for reference.
+
+Run from the repository root:
+    PYTHONPATH=. python example/bench_roulette.py [n_rays [floor_dB [p]]]
+'''
+import sys
+import time
+
+import numpy as np
+
+from bench_backends import load_legacy, setup, parameters
+
+ROOMS = [
+    ('odeon_ex', 'data/legacy/odeon_ex/simulation.toml',
+        'data/legacy/odeon_ex/surface_mat_id.toml', None),
+    ('ptb_studio_ph3 (closed)',
+        'data/legacy/ptb_studio_ph3/simulation_ptb_ph3.toml',
+        'data/legacy/ptb_studio_ph3/surface_mat_id_ptb_ph3_c.toml',
+        'data/legacy/ptb_studio_ph3/studioPTB_ph3_courtain_closed.mat'),
+    ('elmia', 'data/legacy/elmia/simulation_elmia.toml',
+        'data/legacy/elmia/surface_mat_id_elmia.toml', None),
+]
+
+
+def run(sim_cfg, geom_dict, nrays, seed, wavefront=None):
+    '''runs the simulation and returns its time and T30/EDT/C80'''
+    sim = setup('numpy', sim_cfg, geom_dict, nrays, seed)
+    if wavefront is not None:
+        sim.set_wavefront(**wavefront)
+    start = time.time()
+    sim.run_raytracing()
+    return time.time() - start, parameters(sim.sr_results)
+
+
+def max_diff(par, ref, key):
+    return np.nanmax(np.abs(np.median(par[key], axis=0) -
+        np.median(ref[key], axis=0)))
+
+
+def main():
+    nrays = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    floor = float(sys.argv[2]) if len(sys.argv) > 2 else -40.0
+    p = float(sys.argv[3]) if len(sys.argv) > 3 else 0.1
+    cases = [
+        ('full depth, seed 1', 1, None),
+        ('roulette', 0, {'energy_floor_dB': floor, 'roulette': p}),
+        ('termination', 0, {'energy_floor_dB': floor, 'roulette': 0.0}),
+    ]
+    print('{} rays, floor {} dB, survival probability {}'.format(nrays,
+        floor, p))
+    for name, sim_toml, mat_toml, room in ROOMS:
+        sim_cfg, geom_dict = load_legacy(sim_toml, mat_toml, room)
+        ref_time, ref = run(sim_cfg, geom_dict, nrays, seed=0)
+        print('{}: full depth {:.2f} s'.format(name, ref_time))
+        print('  {:<20s} {:>8s} {:>10s} {:>10s}'.format('', 'time',
+            'dT30 [s]', 'dEDT [s]'))
+        for case, seed, wavefront in cases:
+            elapsed, par = run(sim_cfg, geom_dict, nrays, seed, wavefront)
+            print('  {:<20s} {:7.0f}% {:10.3f} {:10.3f}'.format(case,
+                100 * elapsed / ref_time, max_diff(par, ref, 'T30'),
+                max_diff(par, ref, 'EDT')))
+
+
+if __name__ == '__main__':
+    main()
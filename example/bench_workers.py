@@ -0,0 +1,42 @@
+'''
+Scaling of the ray tracing stage ('numpy' backend) with the number of worker
+processes, `Simulation.run_raytracing(workers=N)`, on the ODEON example room
+(data/legacy/odeon_ex). The rays of each source are split in N shards; the
+speedup is relative to the first worker count (1 by default, the serial
+engine).
+
+Run from the repository root:
+    PYTHONPATH=. python example/bench_workers.py [n_rays [workers ...]]
+'''
+import multiprocessing
+import sys
+
+from bench_backends import load_odeon_ex, run
+
+
+def main():
+    nrays = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    if len(sys.argv) > 2:
+        workers_list = [int(w) for w in sys.argv[2:]]
+    else:
+        ncpu = multiprocessing.cpu_count()
+        workers_list = sorted(set([1] + [2**k for k in range(6)
+            if 2**k <= ncpu] + [ncpu]))
+    sim_cfg, geom_dict = load_odeon_ex()
+    print('{} rays per source, {} cpus'.format(nrays,
+        multiprocessing.cpu_count()))
+    print('workers   time [s]    rays/s   speedup  efficiency')
+    first = None
+    for workers in workers_list:
+        elapsed, ntraced, _ = run('numpy', sim_cfg, geom_dict, nrays,
+            seed=0, workers=workers)
+        if first is None:
+            first = (workers, elapsed)
+        speedup = first[1] / elapsed
+        print('{:7d} {:10.2f} {:9.0f} {:9.2f} {:11.2f}'.format(workers,
+            elapsed, ntraced / elapsed, speedup,
+            speedup * first[0] / workers))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+'''
+Compact crossing storage (`Simulation.set_compact()`, 'numpy' backend) on
+the legacy rooms: memory of the crossing tables (all sources) and peak
+memory of the ray tracing, intensity and results stages (tracemalloc),
+against the full precision tables, and the largest deviation of EDT, T30,
+C80 and LF over the source-receiver pairs and bands (the failed decay
+fits, e.g. EDT > 100 s, excluded). Both runs use the same seed, so they
+trace the same rays: the deviations are the ones of the quantization (time
+bins, int8 cosines and log uint16 intensities) alone. The rays' histories
+(planes and reflection points, the same in both runs) are shown too: the
+peak only drops as much as the tables weigh in it.
+
+Run from the repository root:
+    PYTHONPATH=. python example/study_compact.py [n_rays]
+'''
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from bench_backends import load_legacy, setup
+
+ROOMS = [
+    ('odeon_ex', 'data/legacy/odeon_ex/simulation.toml',
+        'data/legacy/odeon_ex/surface_mat_id.toml', None),
+    ('ptb_studio_ph3 (closed)',
+        'data/legacy/ptb_studio_ph3/simulation_ptb_ph3.toml',
+        'data/legacy/ptb_studio_ph3/surface_mat_id_ptb_ph3_c.toml',
+        'data/legacy/ptb_studio_ph3/studioPTB_ph3_courtain_closed.mat'),
+    ('elmia', 'data/legacy/elmia/simulation_elmia.toml',
+        'data/legacy/elmia/surface_mat_id_elmia.toml', None),
+]
+PARAMETERS = ('EDT', 'T30', 'C80', 'LF')
+# larger absolute values are failed fits
+VALID_MAX = 100.0
+
+
+def run(sim_cfg, geom_dict, nrays, compact):
+    '''runs the simulation and returns its time, peak memory, crossing
+    tables' and rays histories' memory and parameters (n_pairs x n_bands)'''
+    sim = setup('numpy', sim_cfg, geom_dict, nrays, seed=0)
+    sim.set_compact(compact)
+    tracemalloc.start()
+    start = time.time()
+    sim.run_raytracing()
+    elapsed = time.time() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    table = sum(s.crossings.nbytes for s in sim.sources)
+    history = sum(s.planes_hist.nbytes + s.refpts_hist.nbytes
+        for s in sim.sources)
+    pairs = [rec for sou in sim.sr_results for rec in sou.rec]
+    pars = {par: np.array([getattr(rec, par) for rec in pairs],
+        dtype=np.float64) for par in PARAMETERS}
+    return elapsed, peak, table, history, pars
+
+
+def max_deviation(par, ref):
+    '''largest deviation where both runs have a valid value'''
+    valid = np.isfinite(par) & np.isfinite(ref) & \
+        (np.abs(par) < VALID_MAX) & (np.abs(ref) < VALID_MAX)
+    return np.max(np.abs(par[valid] - ref[valid])) if valid.any() else 0.0
+
+
+def main():
+    nrays = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    print('{} rays'.format(nrays))
+    for name, sim_toml, mat_toml, room in ROOMS:
+        sim_cfg, geom_dict = load_legacy(sim_toml, mat_toml, room)
+        full = run(sim_cfg, geom_dict, nrays, False)
+        compact = run(sim_cfg, geom_dict, nrays, True)
+        print('{}:'.format(name))
+        for label, (elapsed, peak, table, history, _) in (('full', full),
+            ('compact', compact)):
+            print('  {:<8s} {:6.2f} s, tables {:7.2f} MB, rays histories '
+                '{:7.2f} MB, peak {:7.2f} MB'.format(label, elapsed,
+                table / 1e6, history / 1e6, peak / 1e6))
+        print('  memory: tables -{:.0f}%, peak -{:.0f}%'.format(
+            100 * (1 - compact[2] / full[2]),
+            100 * (1 - compact[1] / full[1])))
+        print('  max deviation: ' + ', '.join('{} {:.4f}'.format(par,
+            max_deviation(compact[4][par], full[4][par]))
+            for par in PARAMETERS))
+
+
+if __name__ == '__main__':
+    main()
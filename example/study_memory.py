@@ -0,0 +1,61 @@
+'''
+Memory budget planner (`Simulation.set_max_memory()`, ra.memory_plan) on
+the ODEON example room (data/legacy/odeon_ex), 'numpy' backend:
+1 - the predicted crossings and peak memory of the full precision runs
+against the measured ones (tracemalloc), for several numbers of rays;
+2 - a run with a budget below its full precision peak: the mode and chunk
+the plan chose, its measured peak and the change of T30, EDT and C80
+(median over the source-receiver pairs, largest over the bands) against
+the run without a budget. The streamed chunks draw the scattering random
+numbers in another order, so they are a different sample of the rays.
+
+Run from the repository root:
+    PYTHONPATH=. python example/study_memory.py [n_rays [budget_MB]]
+'''
+import sys
+import tracemalloc
+
+import numpy as np
+
+from bench_backends import load_odeon_ex, setup, parameters
+
+NRAYS = (1000, 4000, 16000)
+
+
+def run(sim_cfg, geom_dict, nrays, max_memory=None):
+    '''runs the simulation and returns its plan, measured peak memory,
+    mean crossings per source and T30/EDT/C80'''
+    sim = setup('numpy', sim_cfg, geom_dict, nrays, seed=0)
+    sim.set_max_memory(max_memory)
+    tracemalloc.start()
+    sim.run_raytracing()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    crossings = np.mean([len(s.crossings) for s in sim.sources
+        if getattr(s, 'crossings', None) is not None] or [0])
+    return sim.memory_plan, peak, crossings, parameters(sim.sr_results)
+
+
+def main():
+    nrays = int(sys.argv[1]) if len(sys.argv) > 1 else NRAYS[-1]
+    sim_cfg, geom_dict = load_odeon_ex()
+    print('{:>8s} {:>12s} {:>12s} {:>11s} {:>11s}'.format('rays',
+        'crossings', 'predicted', 'peak [MB]', 'predicted'))
+    for n in NRAYS:
+        plan, peak, crossings, _ = run(sim_cfg, geom_dict, n)
+        print('{:8d} {:12.0f} {:12.0f} {:11.1f} {:11.1f}'.format(n,
+            crossings, plan.crossings, peak / 1e6, plan.peak / 1e6))
+    ref_plan, ref_peak, _, ref = run(sim_cfg, geom_dict, nrays)
+    budget = float(sys.argv[2]) * 1e6 if len(sys.argv) > 2 else \
+        0.6 * ref_plan.peak
+    plan, peak, _, par = run(sim_cfg, geom_dict, nrays, budget)
+    print('{} rays, budget {:.1f} MB: {}'.format(nrays, budget / 1e6, plan))
+    print('measured peak {:.1f} MB (without a budget {:.1f} MB)'.format(
+        peak / 1e6, ref_peak / 1e6))
+    print('largest change of the median: ' + ', '.join('{} {:.3f}'.format(
+        key, np.nanmax(np.abs(np.median(par[key], axis=0) -
+        np.median(ref[key], axis=0)))) for key in ('T30', 'EDT', 'C80')))
+
+
+if __name__ == '__main__':
+    main()
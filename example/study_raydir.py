@@ -0,0 +1,77 @@
+'''
+Low discrepancy ray directions on the ODEON example room
+(data/legacy/odeon_ex): number of rays each direction generator of
+`Simulation.set_raydir` needs to match a reference T30 within 1%.
+
+For each generator and number of rays, `Simulation.run_replicas` runs
+independent randomized replicas (new random directions, Sobol scramble or
+rotation at each replica). The T30 of a replica is the median over the
+source-receiver pairs, per band; its error is the RMS over the replicas and
+the bands of the relative deviation from the reference. The replicas'
+standard error (RMS over the bands), the randomized QMC error estimate
+available without a reference, is shown next to it. The reference is the
+mean of replicas of scrambled Sobol directions with many more rays.
+
+The study runs the room as configured and with specular reflections only:
+the scattered reflections draw their own random numbers, a noise the
+initial directions do not change.
+
+Run from the repository root:
+    PYTHONPATH=. python example/study_raydir.py [n_replicas [n_ref]]
+'''
+import copy
+import sys
+
+import numpy as np
+
+from bench_backends import load_odeon_ex, setup
+
+METHODS = ('random', 'sobol', 'fibonacci', 'equal_area')
+NRAYS = (256, 512, 1024, 2048, 4096, 8192)
+
+
+def t30_replicas(sim_cfg, geom_dict, method, nrays, nreplicas, seed=0):
+    '''T30 of each replica (median over the pairs, Nreplicas x Nbands)'''
+    sim = setup('numpy', sim_cfg, geom_dict, nrays, seed)
+    sim.set_raydir(method)
+    sim.run_replicas(nreplicas)
+    return np.median(sim.replicas['T30'], axis=1)
+
+
+def study(sim_cfg, geom_dict, nreplicas, nref):
+    ref = np.mean(t30_replicas(sim_cfg, geom_dict, 'sobol', nref, nreplicas,
+        seed=1), axis=0)
+    print('Reference T30 ({} x {} Sobol rays): {}'.format(nreplicas, nref,
+        np.array2string(ref, precision=3)))
+    print('{:>10s} {:>7s} {:>10s} {:>12s}'.format('method', 'rays',
+        'error [%]', 'stderr [%]'))
+    for method in METHODS:
+        needed = None
+        for nrays in NRAYS:
+            t30 = t30_replicas(sim_cfg, geom_dict, method, nrays, nreplicas)
+            rel = (t30 - ref) / ref
+            error = 100 * np.sqrt(np.mean(rel**2))
+            stderr = 100 * np.sqrt(np.mean((np.std(t30, axis=0, ddof=1) /
+                np.sqrt(nreplicas) / ref)**2))
+            print('{:>10s} {:7d} {:10.2f} {:12.2f}'.format(method, nrays,
+                error, stderr))
+            if needed is None and error <= 1.0:
+                needed = nrays
+        print('{:>10s} needs {} rays for T30 within 1%'.format(method,
+            needed if needed is not None else '> {}'.format(NRAYS[-1])))
+
+
+def main():
+    nreplicas = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    nref = int(sys.argv[2]) if len(sys.argv) > 2 else 16384
+    sim_cfg, geom_dict = load_odeon_ex()
+    print('As configured (scattering after the transition order)')
+    study(sim_cfg, geom_dict, nreplicas, nref)
+    specular = copy.deepcopy(sim_cfg)
+    specular['controls']['allow_scattering'] = 0
+    print('Specular reflections only')
+    study(specular, geom_dict, nreplicas, nref)
+
+
+if __name__ == '__main__':
+    main()
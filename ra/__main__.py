@@ -7,6 +7,7 @@ import signal
 
 from ra import run_simu
 from ra import simulation_api
+from ra import backends
 from ra.log import log
 
 ## To run tests
@@ -15,9 +16,16 @@ import numpy as np
 from ra.room import Geometry, GeometryMat
 import matplotlib.pyplot as plt
 
-def sigint_handler(sig, frame):
-    log.debug('Interrupted by user with Ctrl+C!')
-    sys.exit(0)
+def sigint_handler(checkpoint=None):
+    '''The Ctrl+C handler of a run checkpointed to the file checkpoint
+    (None for a run without checkpoints)'''
+    def handler(sig, frame):
+        log.debug('Interrupted by user with Ctrl+C!')
+        if checkpoint is not None and os.path.exists(checkpoint):
+            log.info('Run again with --resume to continue from the last ' +
+                'checkpoint.')
+        sys.exit(0)
+    return handler
 
 
 def parse_args():
@@ -30,14 +38,41 @@ def parse_args():
         help='Path pointing to dir with simulation configuration files.',
         required=True
     )
+    parser.add_argument(
+        '-b', '--backend',
+        help="Calculation backend ('cpp' or 'numpy'). Checkpoints need " +
+            "the 'numpy' backend (the default with --checkpoint or --resume).",
+        choices=sorted(backends.BACKENDS),
+        default=None
+    )
+    parser.add_argument(
+        '--checkpoint',
+        help='Checkpoint the ray tracing to this file (--resume without ' +
+            'it uses checkpoint.npz in the configuration dir).',
+        default=None
+    )
+    parser.add_argument(
+        '--checkpoint-rays',
+        help='Rays of a source traced between checkpoints.',
+        type=int,
+        default=1000
+    )
+    parser.add_argument(
+        '--resume',
+        help='Continue the ray tracing from the last checkpoint.',
+        action='store_true'
+    )
     args = vars(parser.parse_args())
+    if args['backend'] == 'cpp' and (args['resume'] or
+        args['checkpoint'] is not None):
+        parser.error("--checkpoint and --resume need the 'numpy' backend.")
     log.debug('Parsed arguments: {}'.format(args))
     return args
 
 
 def main():
     args = parse_args()
-    signal.signal(signal.SIGINT, sigint_handler)
+    signal.signal(signal.SIGINT, sigint_handler())
     cfgs = run_simu.setup(args['cfg_dir'])
     # run_simu.run(cfgs)
 
@@ -98,10 +133,23 @@ def main():
     ]
 
     sims = simulation_api.Simulation()
+    # checkpoints only when asked for, with the 'numpy' backend
+    checkpointed = args['resume'] or args['checkpoint'] is not None
+    backend = args['backend']
+    if backend is None:
+        backend = 'numpy' if checkpointed else backends.default_backend()
+    sims.set_backend(backend)
     sims.set_configs(alg_configs)
     sims.set_air(air_properties)
     sims.set_geometry(plane_list_blender)
     sims.set_raydir()
+    if checkpointed:
+        checkpoint = args['checkpoint']
+        if checkpoint is None:
+            checkpoint = os.path.join(args['cfg_dir'], 'checkpoint.npz')
+        sims.set_checkpoint(checkpoint, every_rays=args['checkpoint_rays'],
+            resume=args['resume'])
+        signal.signal(signal.SIGINT, sigint_handler(checkpoint))
     print("The number of rays is {}.".format(sims.rays_v.Nrays))
     sims.set_receivers(recs)
     sims.set_memory_init()
@@ -0,0 +1,247 @@
+'''
+Calculation backends of the `Simulation` API. A backend provides the
+receiver, receiver crossing and source objects and the three calculation
+stages (direct sound, ray tracing and intensities). Available backends:
+- 'cpp' - the compiled ra_cpp module (default when it is installed).
+- 'numpy' - the pure NumPy engine of `ra.numpy_engine`, tracing all the
+    rays of a source together against the simulation's `CompiledScene`.
+'''
+import numpy as np
+
+from ra import numpy_engine, parallel
+from ra.checkpoint import config_digest
+from ra.log import log
+from ra.ray_initializer import ray_initializer
+from ra.results import process_results
+
+from ra.cpp_extension import ra_cpp
+
+class CppBackend():
+    '''The ra_cpp calculation stages'''
+    name = 'cpp'
+
+    def __init__(self,):
+        if ra_cpp is None:
+            raise ImportError("The 'cpp' backend needs the ra_cpp module. " +
+                "Build it or use the 'numpy' backend.")
+        self.Receiver = ra_cpp.Receivercpp
+        self.RecCross = ra_cpp.RecCrosscpp
+        self.RecCrossDir = ra_cpp.RecCrossDircpp
+        self.Source = ra_cpp.Sourcecpp
+
+    def init_rays(self, rays_v, N_max_ref, transition_order, reccross):
+        return ray_initializer(rays_v, N_max_ref, transition_order, reccross)
+
+    def direct_sound(self, sim):
+        return ra_cpp._direct_sound(sim.sources, sim.receivers,
+            sim.rec_radius_init, sim.geometry.planes, sim.c0,
+            sim.rays_v.vinit)
+
+    def check_modes(self, sim):
+        '''Raises a ValueError if the simulation is set to a mode of the
+        'numpy' backend only, which this backend would not honour'''
+        modes = [name for name, on in (
+            ('the wavefront mode (set_wavefront)', sim.wavefront is not None),
+            ('receiver grids (set_receiver_grid)',
+                sim.receiver_map is not None),
+            ('checkpoints (set_checkpoint)', sim.checkpoint is not None),
+            ('the streaming mode (set_streaming)', sim.streaming is not None),
+            ('compact storage (set_compact)', sim.compact),
+            ('a memory budget (set_max_memory)', sim.max_memory is not None))
+            if on]
+        if modes:
+            raise ValueError("The 'cpp' backend does not support " +
+                ', '.join(modes) + ". Use set_backend('numpy') or turn " +
+                "them off.")
+
+    def raytracer(self, sim, workers=1):
+        if workers > 1:
+            log.info("The 'cpp' backend traces the rays in a single " +
+                "process, use the 'numpy' backend for workers > 1.")
+        return ra_cpp._raytracer_main(sim.ht_length, sim.allow_scattering,
+            sim.transition_order, sim.rec_radius_init, sim.alow_growth,
+            sim.rec_radius_final, sim.sources, sim.receivers,
+            sim.geometry.planes, sim.c0, sim.rays_v.vinit)
+
+    def intensity(self, sim):
+        # intensities of a 1 W source (see results.RecResults): the c++
+        # stage reads the sources' power, so it runs with a unit power and
+        # the returned sources get their power back
+        power = [s.power_lin for s in sim.sources]
+        for s in sim.sources:
+            s.power_lin = np.ones_like(s.power_lin)
+        try:
+            sources = ra_cpp._intensity_main(sim.rec_radius_init,
+                sim.sources, sim.c0, sim.m,
+                np.ascontiguousarray(sim.scene.alpha.T))
+        finally:
+            for s, power_lin in zip(sim.sources, power):
+                s.power_lin = power_lin
+        for s, power_lin in zip(sources, power):
+            s.power_lin = power_lin
+        return sources
+
+    def run_sources(self, sim, workers):
+        log.info("The 'cpp' backend runs the sources in a single " +
+            "process, use the 'numpy' backend for source_workers > 1.")
+        sim.sources = self.direct_sound(sim)
+        sim.sources = self.raytracer(sim)
+        sim.sources = self.intensity(sim)
+        return sim.sources, process_results(sim.Dt, sim.ht_length, sim.freq,
+            sim.sources, sim.receivers)
+
+class NumpyBackend():
+    '''The ra.numpy_engine calculation stages'''
+    name = 'numpy'
+
+    def __init__(self,):
+        self.Receiver = numpy_engine.PyReceiver
+        self.RecCross = numpy_engine.PyRecCross
+        self.RecCrossDir = numpy_engine.PyRecCrossDir
+        self.Source = numpy_engine.PySource
+
+    def check_modes(self, sim):
+        # every mode is a mode of this backend
+        pass
+
+    def init_rays(self, rays_v, N_max_ref, transition_order, reccross):
+        # the engine allocates the rays history while tracing
+        return []
+
+    def direct_sound(self, sim):
+        return numpy_engine.direct_sound(sim.sources, sim.receivers,
+            sim.rec_radius_init, sim.scene, sim.c0, sim.rays_v.vinit)
+
+    def raytracer(self, sim, workers=1):
+        args = (sim.ht_length, sim.allow_scattering, sim.transition_order,
+            sim.rec_radius_init, sim.alow_growth, sim.rec_radius_final,
+            sim.sources, sim.receivers, sim.scene, sim.c0, sim.rays_v.vinit,
+            sim.N_max_ref, sim.transition_order + 2)
+        histograms = self.map_histograms(sim)
+        streams = self.stream_histograms(sim)
+        checkpoint = sim.checkpoint
+        if (histograms is not None or streams is not None) and \
+            checkpoint is not None:
+            log.info("Receiver grids and streamed runs are not checkpointed.")
+            checkpoint = None
+        if workers > 1 and histograms is None and streams is None and \
+            checkpoint is None:
+            return parallel.raytracer_main(*args, workers=workers,
+                wavefront=self.wavefront(sim),
+                compact_bins=self.compact_bins(sim))
+        if workers > 1:
+            log.info("Receiver grids, streamed and checkpointed runs are " +
+                "traced in a single process.")
+        if checkpoint is not None:
+            checkpoint.check(self.checkpoint_digest(sim))
+        sources = numpy_engine.raytracer_main(*args,
+            wavefront=self.wavefront(sim), histograms=histograms,
+            checkpoint=checkpoint, streams=streams,
+            chunk_rays=(sim.streaming or {}).get('chunk_rays'),
+            compact_bins=self.compact_bins(sim))
+        if checkpoint is not None:
+            checkpoint.remove()
+        return sources
+
+    def checkpoint_digest(self, sim):
+        '''The configuration digest of a checkpointed ray tracing (see
+        checkpoint.config_digest())'''
+        wavefront = sim.wavefront or {'energy_floor_dB': 0.0, 'roulette': 0.0}
+        settings = (sim.ht_length, sim.allow_scattering, sim.transition_order,
+            sim.rec_radius_init, sim.alow_growth, sim.rec_radius_final,
+            sim.c0, sim.N_max_ref, sim.wavefront is not None,
+            wavefront['energy_floor_dB'], wavefront['roulette'],
+            self.compact_bins(sim) is not None)
+        return config_digest(sim.scene, sim.receivers, sim.sources,
+            sim.rays_v.Nrays, sim.freq, settings)
+
+    def compact_bins(self, sim):
+        '''The results' time bins, which the crossing tables are compacted
+        to (see Simulation.set_compact()), None otherwise'''
+        if not sim.compact or sim.streaming is not None:
+            return None
+        return np.arange(0.0, 1.2 * sim.ht_length, sim.Dt)
+
+    def wavefront(self, sim):
+        '''The culling arguments of numpy_engine.trace_source() in the
+        wavefront mode (see Simulation.set_wavefront())'''
+        if sim.wavefront is None:
+            return None
+        # crossings later than the reflectograms' length are not counted
+        return dict(t_max=1.2 * sim.ht_length,
+            energy_floor_dB=sim.wavefront['energy_floor_dB'], m_s=sim.m,
+            roulette=sim.wavefront['roulette'])
+
+    def map_histograms(self, sim):
+        '''An empty GridHistogram per source for the receiver map mode (see
+        Simulation.set_receiver_grid()), None otherwise'''
+        if sim.receiver_map is None:
+            return None
+        time_bins = np.arange(0.0, 1.2 * sim.ht_length, sim.Dt)
+        # binned at a unit source power, as the intensities
+        return [numpy_engine.GridHistogram(sim.receiver_map.coords,
+            time_bins, np.ones_like(s.power_lin) / sim.rays_v.Nrays, sim.m,
+            sim.c0, max(sim.rec_radius_init, sim.rec_radius_final))
+            for s in sim.sources]
+
+    def stream_histograms(self, sim):
+        '''An empty ReceiverHistogram per source for the streaming mode (see
+        Simulation.set_streaming()), None otherwise'''
+        if sim.streaming is None:
+            return None
+        time_bins = np.arange(0.0, 1.2 * sim.ht_length, sim.Dt)
+        histograms = []
+        for s in sim.sources:
+            rec_coords, fig8 = numpy_engine.point_all_receivers(s.coord,
+                sim.receivers)
+            histograms.append(numpy_engine.ReceiverHistogram(rec_coords, fig8,
+                time_bins, np.ones_like(s.power_lin) / sim.rays_v.Nrays,
+                sim.m, sim.c0,
+                max(sim.rec_radius_init, sim.rec_radius_final)))
+        return histograms
+
+    def intensity(self, sim):
+        if any(s.stream_histogram is not None for s in sim.sources):
+            log.info("The streamed sources keep no crossings (their " +
+                "intensities were binned while tracing), run the ray " +
+                "tracing again for new materials or air.")
+            return sim.sources
+        return numpy_engine.intensity_main(sim.rec_radius_init, sim.sources,
+            sim.c0, sim.m, np.ascontiguousarray(sim.scene.alpha.T),
+            unit_power=True)
+
+    def run_sources(self, sim, workers):
+        if sim.receiver_map is not None or sim.checkpoint is not None or \
+            sim.streaming is not None:
+            log.info("Receiver grids, streamed and checkpointed runs are " +
+                "traced in a single process.")
+            sim.sources = self.direct_sound(sim)
+            sim.sources = self.raytracer(sim)
+            sim.sources = self.intensity(sim)
+            return sim.sources, process_results(sim.Dt, sim.ht_length,
+                sim.freq, sim.sources, sim.receivers)
+        params = dict(ht_length=sim.ht_length,
+            allow_scattering=sim.allow_scattering,
+            transition_order=sim.transition_order,
+            rec_radius_init=sim.rec_radius_init,
+            allow_growth=sim.alow_growth,
+            rec_radius_final=sim.rec_radius_final, c0=sim.c0, m=sim.m,
+            N_max_ref=sim.N_max_ref, N_max_ro=sim.transition_order + 2,
+            Dt=sim.Dt, freq=sim.freq, wavefront=self.wavefront(sim),
+            compact_bins=self.compact_bins(sim))
+        return parallel.run_sources(sim.sources, sim.receivers, sim.scene,
+            sim.rays_v.vinit, params, workers)
+
+BACKENDS = {'cpp': CppBackend, 'numpy': NumpyBackend}
+
+def default_backend():
+    '''The name of the backend used when none is chosen'''
+    return 'numpy' if ra_cpp is None else 'cpp'
+
+def get_backend(name):
+    '''Returns a new backend object, given its name ('cpp' or 'numpy')'''
+    try:
+        return BACKENDS[name]()
+    except KeyError:
+        raise ValueError("Unknown backend '{}'. Valid backends are: {}".format(
+            name, ', '.join(BACKENDS)))
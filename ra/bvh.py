@@ -0,0 +1,214 @@
+import numpy as np
+
+import ra.rtrace as rt
+
+# rooms with more planes than this are traced with a bounding volume hierarchy
+# instead of testing every ray against every plane
+BVH_MIN_PLANES = 64
+
+class BVH():
+    '''
+    A bounding volume hierarchy over a set of planes (polygons), built once
+    from the room geometry and used to find the nearest plane hit by many rays
+    at once. The tree is stored in flat arrays (one entry per node):
+    - box_min, box_max - the node's axis aligned bounding box (N x 3)
+    - left, right - the children nodes (-1 for a leaf node)
+    - start, count - the range of `order` holding the leaf's planes
+    - order - the planes indexes sorted by leaf
+    '''
+    def __init__(self, poly_verts, normals, leaf_size=4):
+        '''
+        Parameters
+        ----------
+        poly_verts: a numpy.ndarray with shape (P, V, 3) representing the
+            polygons' vertices (see `rtrace.pack_polygons()`).
+        normals: a numpy.ndarray with shape (P, 3) representing the polygons'
+            normal vectors.
+        leaf_size: an integer, the maximum number of planes per leaf.
+        '''
+        self.poly_verts = np.asarray(poly_verts, dtype=np.float32)
+        self.normals = np.asarray(normals, dtype=np.float32)
+        self.leaf_size = leaf_size
+        self.build()
+
+    @classmethod
+    def from_planes(cls, planes, leaf_size=4):
+        '''Builds the hierarchy from a list of plane objects (`ra_cpp.Planecpp`
+        or `room.PyPlane`), e.g. `GeometryApi.planes` or `Geometry.planes`'''
+        poly_verts = rt.pack_polygons([plane.vertices for plane in planes])
+        normals = np.array([plane.normal for plane in planes], np.float32)
+        return cls(poly_verts, normals, leaf_size)
+
+    @property
+    def nplanes(self):
+        return len(self.normals)
+
+    @property
+    def nnodes(self):
+        return len(self.left)
+
+    def build(self):
+        '''Top down construction: every node is split in two at the median of
+        its planes' centroids along the largest axis of the centroids' extent.
+        '''
+        pmin = self.poly_verts.min(axis=1)
+        pmax = self.poly_verts.max(axis=1)
+        # pad the boxes so flat (axis aligned) planes still have a volume
+        pad = 1e-4 * max(float(np.max(pmax - pmin)), 1.0)
+        pmin = pmin - pad
+        pmax = pmax + pad
+        centroids = 0.5 * (pmin + pmax)
+        box_min, box_max, left, right, start, count = [], [], [], [], [], []
+        order = np.arange(self.nplanes)
+        # stack of (node id, first plane, last plane) to be processed
+        stack = [(0, 0, self.nplanes)]
+        for lst in (box_min, box_max, left, right, start, count):
+            lst.append(None)
+        while stack:
+            node, first, last = stack.pop()
+            ids = order[first:last]
+            box_min[node] = pmin[ids].min(axis=0)
+            box_max[node] = pmax[ids].max(axis=0)
+            start[node] = first
+            count[node] = last - first
+            if last - first <= self.leaf_size:
+                left[node] = right[node] = -1
+                continue
+            extent = centroids[ids].max(axis=0) - centroids[ids].min(axis=0)
+            axis = np.argmax(extent)
+            order[first:last] = ids[np.argsort(centroids[ids, axis],
+                kind='mergesort')]
+            middle = (first + last) // 2
+            for child, (cfirst, clast) in enumerate(
+                    ((first, middle), (middle, last))):
+                child_node = len(left)
+                for lst in (box_min, box_max, left, right, start, count):
+                    lst.append(None)
+                if child == 0:
+                    left[node] = child_node
+                else:
+                    right[node] = child_node
+                stack.append((child_node, cfirst, clast))
+        self.box_min = np.array(box_min, dtype=np.float32)
+        self.box_max = np.array(box_max, dtype=np.float32)
+        self.left = np.array(left, dtype=np.int64)
+        self.right = np.array(right, dtype=np.int64)
+        self.start = np.array(start, dtype=np.int64)
+        self.count = np.array(count, dtype=np.int64)
+        self.order = order
+        # the largest number of nodes from the root to a leaf
+        depth = np.zeros(self.nnodes, dtype=np.int64)
+        for node in range(self.nnodes):
+            if self.left[node] >= 0:
+                depth[self.left[node]] = depth[self.right[node]] = \
+                    depth[node] + 1
+        self.depth = int(depth.max()) + 1
+
+    def rays_x_boxes(self, r0, inv_rd, nodes):
+        '''Slab test of each ray against the bounding box of its node.
+        Returns the distance at which the ray enters the box (`inf` if the box
+        is missed).'''
+        with np.errstate(invalid='ignore'):
+            t1 = (self.box_min[nodes] - r0) * inv_rd
+            t2 = (self.box_max[nodes] - r0) * inv_rd
+        # fmin/fmax ignore the nan's of rays lying on a slab plane
+        t_near = np.max(np.fmin(t1, t2), axis=1)
+        t_far = np.min(np.fmax(t1, t2), axis=1)
+        t_near = np.maximum(t_near, 0)
+        return np.where(t_far >= t_near, t_near, np.inf)
+
+    def nearest(self, r0, rd, tol=1e-6, test=None):
+        '''Batched closest hit query, a drop-in replacement for
+        `rtrace.nearest_polygons()`. Every ray walks the tree depth first with
+        its own stack, nearest child first, skipping the nodes whose box is
+        hit farther than the ray's current best hit. All the rays advance one
+        node per step, so each step is a handful of whole-array operations.
+
+        Parameters
+        ----------
+        r0: a numpy.ndarray with shape (R, 3) representing the rays' origins
+        rd: a numpy.ndarray with shape (R, 3) representing the rays' directions
+        tol: check function `rtrace.ray_x_plane()` parameters.
+        test: an optional function `test(rays, planes)` replacing the ray x
+            plane test at the leaves (e.g. `CompiledScene.rays_x_planes()`).
+            It receives the rays indexes (n,) and the planes indexes (n, L)
+            and returns the distances, intersection points and hit flags
+            with shapes (n, L), (n, L, 3) and (n, L).
+
+        Returns
+        -------
+        A 3-tuple with the index of the nearest plane (-1 if the ray misses
+        every plane), the distance to it and the intersection point, with
+        shapes (R,), (R,) and (R, 3).
+        '''
+        r0 = np.asarray(r0, dtype=np.float32)
+        rd = np.asarray(rd, dtype=np.float32)
+        if test is None:
+            test = lambda rays, planes: rt.rays_x_polygons(r0[rays, None],
+                rd[rays, None], self.poly_verts[planes],
+                self.normals[planes], tol)
+        nrays = r0.shape[0]
+        ids = np.full(nrays, -1, dtype=np.int64)
+        ts = np.full(nrays, np.inf, dtype=np.float32)
+        ris = np.full((nrays, 3), np.inf, dtype=np.float32)
+        with np.errstate(divide='ignore'):
+            inv_rd = 1 / rd
+        # one stack per ray, the root node pushed first
+        stack = np.zeros((nrays, self.depth + 1), dtype=np.int64)
+        stack_size = np.ones(nrays, dtype=np.int64)
+        rays = np.arange(nrays)
+        while rays.size > 0:
+            stack_size[rays] -= 1
+            nodes = stack[rays, stack_size[rays]]
+            t_box = self.rays_x_boxes(r0[rays], inv_rd[rays], nodes)
+            visit = t_box <= ts[rays]
+            is_leaf = self.left[nodes] < 0
+            # leaves: test the ray against every plane in the leaf
+            leaf = visit & is_leaf
+            if np.any(leaf):
+                self.test_leaves(test, rays[leaf], nodes[leaf], ids, ts, ris)
+            # inner nodes: push the children whose box is hit, the nearest
+            # one last so it is popped first
+            inner = visit & ~is_leaf
+            self.push_children(r0, inv_rd, rays[inner], nodes[inner],
+                stack, stack_size)
+            rays = rays[stack_size[rays] > 0]
+        return ids, ts, ris
+
+    def push_children(self, r0, inv_rd, rays, nodes, stack, stack_size):
+        '''Pushes (in place) the children of `nodes` hit by `rays` to the
+        rays' stacks, the farthest child first.'''
+        children = np.stack((self.left[nodes], self.right[nodes]), axis=1)
+        t_child = np.stack([self.rays_x_boxes(r0[rays], inv_rd[rays],
+            children[:, jc]) for jc in range(2)], axis=1)
+        far_first = np.argsort(-t_child, axis=1, kind='mergesort')
+        rows = np.arange(rays.size)[:, None]
+        children = children[rows, far_first]
+        t_child = t_child[rows, far_first]
+        for jc in range(2):
+            hit = np.isfinite(t_child[:, jc])
+            stack[rays[hit], stack_size[rays[hit]]] = children[hit, jc]
+            stack_size[rays[hit]] += 1
+
+    def test_leaves(self, test, rays, nodes, ids, ts, ris):
+        '''Tests each ray against the planes of its leaf and updates (in
+        place) the rays' best hits. Ties are resolved in favour of the lowest
+        plane index, as in `rtrace.nearest_polygons()`.'''
+        slots = np.arange(self.leaf_size)
+        # planes of each leaf, padded with -1
+        cols = self.start[nodes, None] + slots
+        valid = slots < self.count[nodes, None]
+        planes = np.where(valid, self.order[np.where(valid, cols, 0)], -1)
+        t, ri, hit = test(rays, np.where(valid, planes, 0))
+        t = np.where(hit & valid, t, np.inf)
+        t_min = t.min(axis=1)
+        nplanes = self.nplanes
+        plane = np.where(t == t_min[:, None], planes, nplanes).min(axis=1)
+        better = np.isfinite(t_min) & ((t_min < ts[rays]) |
+            ((t_min == ts[rays]) & (plane < ids[rays])))
+        slot = np.argmax(planes == plane[:, None], axis=1)
+        rows = np.arange(rays.size)
+        rays = rays[better]
+        ids[rays] = plane[better]
+        ts[rays] = t_min[better]
+        ris[rays] = ri[rows, slot][better]
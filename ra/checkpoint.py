@@ -0,0 +1,171 @@
+'''
+Checkpoints of the 'numpy' backend ray tracing. The rays of each source are
+traced in chunks of `every_rays` and each chunk's traced data (planes
+history, reflection points, crossing columns and rays alive per order) is
+written once, to its own compressed file next to the checkpoint file. The
+checkpoint file itself only holds the small run state: the cursor (source,
+next ray), the list of written chunks, numpy's random state and a digest of
+the run's configuration (see config_digest()). The initial ray directions
+are written once, with the first chunk. So a checkpoint costs the size of
+the chunk it adds, not of the whole traced data.
+
+A run resumed from the checkpoint traces the remaining chunks with the same
+random numbers, so it gives the same results as an uninterrupted run with
+the same `every_rays`, and it refuses a checkpoint of another configuration.
+Note that the chunks draw the scattering random numbers chunk by chunk, in
+another order than a run without checkpoints: for the same seed, a
+checkpointed run of a scattering room does not give the results of a run
+without checkpoints (the parameters differ as much as two runs with
+different seeds do). The files are deleted once every source is traced.
+'''
+import glob
+import hashlib
+import os
+
+import numpy as np
+
+from ra.log import log
+from ra.parallel import merge_shards
+
+def config_digest(scene, receivers, sources, nrays, freq, settings):
+    '''
+    The sha1 hex digest of what the traced data depends on: the scene
+    (materials included), the receivers and sources positions, the number
+    of rays, the frequency bands and the tracing settings (a tuple of
+    numbers)
+    '''
+    sha = hashlib.sha1(scene.digest.encode())
+    for obj in list(receivers) + list(sources):
+        sha.update(np.asarray(obj.coord, dtype=np.float64).tobytes())
+    sha.update(np.asarray(freq, dtype=np.float64).tobytes())
+    sha.update(repr((len(receivers), len(sources), int(nrays)) +
+        tuple(float(value) for value in settings)).encode())
+    return sha.hexdigest()
+
+class Checkpoint():
+    '''
+    A checkpoint of the ray tracing (see the module's docstring):
+    - path - the .npz file of the run state
+    - every_rays - rays traced between checkpoints (per source)
+    - state - the arrays of the loaded checkpoint (None for a fresh run)
+    - digest - the configuration digest of the run (see check())
+    '''
+    def __init__(self, path, every_rays = 1000, resume = False):
+        self.path = str(path)
+        # the chunks' files are <base>.<chunk>.npz
+        self.base = self.path[:-4] if self.path.endswith('.npz') else \
+            self.path
+        self.every_rays = int(every_rays)
+        self.state = None
+        self.digest = ''
+        self.chunks = []
+        self.random_restored = False
+        if resume:
+            if os.path.exists(self.path):
+                with np.load(self.path) as data:
+                    self.state = {key: data[key] for key in data.files}
+                with np.load(self.chunk_path('rays')) as data:
+                    self.state['v_init'] = data['v_init']
+                self.chunks = [tuple(int(x) for x in chunk)
+                    for chunk in self.state['chunks']]
+                js, first = self.state['cursor']
+                log.info("Resuming from the checkpoint {} (source {}, ray {})".format(
+                    self.path, js + 1, first))
+            else:
+                log.info("No checkpoint at {}, starting a new run.".format(
+                    self.path))
+
+    @property
+    def v_init(self):
+        '''The initial ray directions of the checkpointed run (or None)'''
+        return None if self.state is None else self.state['v_init']
+
+    def chunk_path(self, name):
+        '''The file of a chunk (or of the ray directions), next to the
+        checkpoint file'''
+        return '{}.{}.npz'.format(self.base, name)
+
+    def check(self, digest):
+        '''
+        Sets the configuration digest of the run (see config_digest()).
+        Raises a ValueError if the loaded checkpoint is of another
+        configuration.
+        '''
+        if self.state is not None and str(self.state['digest']) != digest:
+            raise ValueError(("The checkpoint {} is of another configuration " +
+                "(scene, receivers, sources, rays, bands or settings). Run " +
+                "without resume or delete it.").format(self.path))
+        self.digest = digest
+
+    def load_source(self, js):
+        '''The traced chunks (as trace_source() returns them) of source js
+        in the loaded checkpoint and their bounds'''
+        shards, bounds = [], [0]
+        for jsrc, first, last in self.chunks:
+            if jsrc != js:
+                continue
+            with np.load(self.chunk_path('s{}_{}'.format(js, first))) as data:
+                cols = {name[4:]: data[name] for name in data.files
+                    if name.startswith('col_')}
+                shards.append((data['planes_hist'], data['refpts_hist'],
+                    cols, data['alive']))
+            bounds.append(last)
+        return shards, bounds
+
+    def trace(self, js, v_init, trace_rays):
+        '''
+        Traces the rays of source js in chunks, continuing from the loaded
+        checkpoint, and saves a checkpoint after each chunk.
+        trace_rays(first, last) traces the rays [first, last) and returns
+        what trace_source() returns. Returns the traced data of all the
+        source's rays.
+        '''
+        nrays = v_init.shape[0]
+        shards, bounds = self.load_source(js)
+        while bounds[-1] < nrays:
+            if self.state is not None and not self.random_restored:
+                np.random.set_state(('MT19937', self.state['rs_keys'],
+                    int(self.state['rs_pos']), int(self.state['rs_has_gauss']),
+                    float(self.state['rs_gauss'])))
+            self.random_restored = True
+            last = min(bounds[-1] + self.every_rays, nrays)
+            shards.append(trace_rays(bounds[-1], last))
+            self.save(v_init, js, bounds[-1], last, shards[-1])
+            bounds.append(last)
+        if len(shards) == 1:
+            return shards[0]
+        return merge_shards(shards, bounds[:-1])
+
+    def save(self, v_init, js, first, last, traced):
+        '''Writes the traced chunk [first, last) of source js and then the
+        run state (each through a temporary file, so an interruption never
+        leaves a broken checkpoint)'''
+        if not self.chunks:
+            self.write(self.chunk_path('rays'), {'v_init': v_init})
+        planes_hist, refpts_hist, cols, alive = traced
+        arrays = {'planes_hist': planes_hist, 'refpts_hist': refpts_hist,
+            'alive': alive}
+        arrays.update({'col_' + name: value for name, value in cols.items()})
+        self.write(self.chunk_path('s{}_{}'.format(js, first)), arrays)
+        self.chunks.append((js, first, last))
+        _, keys, pos, has_gauss, gauss = np.random.get_state()
+        self.write(self.path, {'cursor': np.array([js, last]),
+            'chunks': np.array(self.chunks, dtype=np.int64).reshape(-1, 3),
+            'digest': np.array(self.digest), 'rs_keys': keys, 'rs_pos': pos,
+            'rs_has_gauss': has_gauss, 'rs_gauss': gauss})
+
+    def write(self, path, arrays):
+        tmp_path = path + '.tmp.npz'
+        np.savez_compressed(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+    def remove(self):
+        '''Deletes the checkpoint files (after a complete ray tracing): a
+        next run with this object starts from scratch'''
+        for path in [self.path, self.chunk_path('rays')] + \
+            glob.glob(glob.escape(self.base) + '.s*_*.npz'):
+            if os.path.exists(path):
+                os.remove(path)
+        self.state = None
+        self.chunks = []
+        self.random_restored = False
@@ -0,0 +1,11 @@
+'''
+The compiled ra_cpp extension, or None when it is not built. From the
+repository root `import ra_cpp` also finds the ra_cpp/ source directory (an
+empty namespace package), so the extension is recognised by its classes.
+'''
+try:
+    import ra_cpp
+except ImportError:
+    ra_cpp = None
+if ra_cpp is not None and not hasattr(ra_cpp, 'Sourcecpp'):
+    ra_cpp = None
@@ -0,0 +1,197 @@
+'''
+Memory model of a simulation ('numpy' backend layouts). The peak memory of
+a run is predicted from its number of rays, N_max_ref, receivers, sources,
+frequency bands and time bins, with the receivers' crossings estimated from
+the rays' path length, the mean free path (4V/S) and the receivers' radii
+(see crossings_per_ray()). Given a memory budget (max_memory), a
+MemoryPlan keeps every crossing in full precision if it fits, or compact
+(see numpy_engine.compact_columns()), or else streams the rays in the
+largest chunks that fit (see numpy_engine.ReceiverHistogram): each chunk's
+crossings are binned into the reflectograms and dropped, so only a chunk
+of rays is in memory at a time.
+'''
+import numpy as np
+
+from ra.receiver_grid import RECGRID_MIN_RECEIVERS
+
+# bytes per crossing of the crossing tables (numpy_engine.COLUMNS and
+# COMPACT_COLUMNS) and of their intensities, per band
+CROSSING_BYTES = {'full': 38, 'compact': 23}
+INTENSITY_BYTES = {'full': 4, 'compact': 2}
+# bytes per ray of the tracing state (origins, directions, distances,
+# radii, weights and their copies while compacting the live rays)
+RAY_STATE_BYTES = 240
+# bytes per (ray, plane) of the chunked linear scan of scene.nearest() and
+# its chunk of rays
+SCAN_PAIR_BYTES = 40
+SCAN_CHUNK_RAYS = 4096
+# bytes per (ray, receiver) of the crossings test against every receiver
+# (numpy_engine.rays_x_spheres())
+SPHERE_PAIR_BYTES = 96
+# bytes per crossing of the temporaries of the intensity (per band) and
+# results (all receivers of a source at once) stages
+INTENSITY_TEMP_BYTES = 40
+RESULTS_TEMP_BYTES = 64
+# bytes per ray and reflection order of the cumulative reflection losses of
+# the intensity stage (one band at a time)
+INTENSITY_RAY_BYTES = 12
+# float64 arrays per source-receiver pair, band and time bin kept by the
+# results (the reflectograms, the decay and the parameters' curves)
+RESULTS_ARRAYS = 7
+# the smallest chunk of rays worth tracing in the streaming mode
+MIN_CHUNK_RAYS = 100
+
+def history_bytes(nrays, N_max_ref, N_max_ro):
+    '''The bytes of the planes (uint16) and reflection points (float32)
+    histories of nrays rays'''
+    return nrays * (2 * N_max_ref + 12 * N_max_ro)
+
+def crossings_per_ray(length, mfp, volume, rec_radius_init,
+    rec_radius_final, allow_growth, transition_order, nrays, nsteps=256):
+    '''
+    Expected crossings of a receiver by a ray travelling `length` [m] in a
+    room of `volume` [m^3]: a receiver of radius r is crossed with
+    probability pi r^2 / V per meter, and the radius grows (allow_growth)
+    as 2 d / sqrt(nrays) after transition_order reflections (d > order x
+    mfp), clipped to [rec_radius_init, rec_radius_final].
+    '''
+    if length <= 0:
+        return 0.0
+    dist = (np.arange(nsteps) + 0.5) * length / nsteps
+    radius = np.full(nsteps, float(rec_radius_init))
+    if allow_growth == 1:
+        grown = dist > transition_order * mfp
+        radius[grown] = 2.0 * dist[grown] / np.sqrt(nrays)
+    radius = np.clip(radius, rec_radius_init, rec_radius_final)
+    return float(np.sum(np.pi * radius**2) * length / nsteps / volume)
+
+class MemoryPlan():
+    '''
+    The memory model of a simulation and its plan for a memory budget:
+    - nrays, nsources, nrecs, nbands, nbins - the size of the run
+    - crossings - the expected crossings per source
+    - mode - 'full', 'compact' or 'stream' (see the module's docstring)
+    - chunk_rays - the rays traced at once in the 'stream' mode
+    - parts - the predicted bytes of each part of the run (see parts())
+    - peak - the predicted peak memory [bytes]
+    The modes chosen by the user (Simulation.set_compact() and
+    set_streaming()) are kept; with a max_memory [bytes] the plan moves to
+    the next mode (full, compact, stream) until the run fits.
+    '''
+    def __init__(self, sim, max_memory=None):
+        self.max_memory = max_memory
+        self.nrays = int(sim.rays_v.Nrays)
+        self.nsources = max(len(sim.sources), 1)
+        self.nrecs = len(sim.receivers)
+        self.nbands = len(sim.freq)
+        self.nbins = np.arange(0.0, 1.2 * sim.ht_length, sim.Dt).size
+        self.N_max_ref = sim.N_max_ref
+        self.N_max_ro = sim.transition_order + 2
+        self.nplanes = sim.scene.nplanes
+        volume = float(sim.geometry.volume)
+        mfp = 4 * volume / float(sim.geometry.total_area)
+        # the rays travel N_max_ref free paths (less in the wavefront mode)
+        length = self.N_max_ref * mfp
+        if sim.wavefront is not None:
+            length = min(length, sim.c0 * 1.2 * sim.ht_length)
+        self.hits = crossings_per_ray(length, mfp, volume,
+            sim.rec_radius_init, sim.rec_radius_final, sim.alow_growth,
+            sim.transition_order, self.nrays)
+        self.crossings = self.nrays * self.nrecs * self.hits
+        if sim.streaming is not None:
+            self.mode = 'stream'
+            self.chunk_rays = min(sim.streaming['chunk_rays'] or self.nrays,
+                self.nrays)
+        else:
+            self.mode = 'compact' if sim.compact else 'full'
+            self.chunk_rays = self.nrays
+        if max_memory is not None:
+            self.fit(max_memory)
+        self.parts = self.parts_of(self.mode, self.chunk_rays)
+        self.peak = self.peak_of(self.parts)
+
+    def parts_of(self, mode, chunk_rays):
+        '''
+        The predicted bytes of a run in `mode` (chunk_rays at once), the
+        parts kept until the end of the run:
+        - rays - the planes and reflection points histories
+        - crossings - the crossing tables and their intensities
+        - histograms - the streaming histograms
+        - reflectograms - the results of every source-receiver pair
+        and the temporaries of the largest source of each stage (tracing,
+        intensity and results).
+        '''
+        history = history_bytes(1, self.N_max_ref, self.N_max_ro)
+        pairs = self.nsources * self.nrecs * self.nbands * self.nbins * 8
+        # the reflectograms of a source (see results.bin_reflectograms())
+        source_hist = 3 * self.nrecs * self.nbands * (self.nbins + 1) * 8
+        scan = min(chunk_rays, SCAN_CHUNK_RAYS) * self.nplanes * \
+            SCAN_PAIR_BYTES
+        spheres = chunk_rays * min(self.nrecs, RECGRID_MIN_RECEIVERS) * \
+            SPHERE_PAIR_BYTES
+        tracing = chunk_rays * (RAY_STATE_BYTES + 8 * self.nbands) + scan + \
+            spheres
+        if mode == 'stream':
+            # a chunk of rays and the crossings of one reflection order
+            return {'rays': chunk_rays * history, 'crossings': 0.0,
+                'histograms': self.nsources * source_hist,
+                'reflectograms': pairs * RESULTS_ARRAYS,
+                'tracing': tracing + chunk_rays * self.nrecs * self.hits /
+                max(self.N_max_ref, 1) * CROSSING_BYTES['full'],
+                'intensity': 0.0, 'results': 0.0}
+        crossing = CROSSING_BYTES[mode] + INTENSITY_BYTES[mode] * self.nbands
+        return {'rays': self.nsources * self.nrays * history,
+            'crossings': self.nsources * self.crossings * crossing,
+            'histograms': 0.0, 'reflectograms': pairs * RESULTS_ARRAYS,
+            # the chunks of crossings of a source are concatenated once
+            'tracing': tracing + 2 * self.crossings * CROSSING_BYTES[mode],
+            'intensity': self.nrays * self.N_max_ref * INTENSITY_RAY_BYTES +
+                self.crossings * INTENSITY_TEMP_BYTES,
+            'results': source_hist + self.crossings * RESULTS_TEMP_BYTES}
+
+    @staticmethod
+    def peak_of(parts):
+        '''The kept parts plus the largest stage (the reflectograms are
+        made by the results stage)'''
+        return int(parts['rays'] + parts['crossings'] + parts['histograms'] +
+            max(parts['tracing'], parts['intensity'],
+            parts['reflectograms'] + parts['results']))
+
+    def fit(self, max_memory):
+        '''Moves to the first mode (and largest chunk) that fits
+        max_memory'''
+        modes = ('full', 'compact', 'stream')
+        for mode in modes[modes.index(self.mode):]:
+            if mode != 'stream':
+                if self.peak_of(self.parts_of(mode, self.nrays)) <= \
+                    max_memory:
+                    self.mode, self.chunk_rays = mode, self.nrays
+                    return
+                continue
+            # the peak grows linearly with the chunk
+            fixed = self.peak_of(self.parts_of(mode, 0))
+            per_ray = self.peak_of(self.parts_of(mode, 1)) - fixed
+            chunk = int((max_memory - fixed) // max(per_ray, 1))
+            if chunk < min(MIN_CHUNK_RAYS, self.nrays):
+                raise ValueError(("A max_memory of {:.1f} MB cannot hold " +
+                    "the reflectograms and a chunk of {} rays ({:.1f} MB).")
+                    .format(max_memory / 1e6, MIN_CHUNK_RAYS, (fixed +
+                    MIN_CHUNK_RAYS * per_ray) / 1e6))
+            self.mode = mode
+            self.chunk_rays = min(chunk, self.nrays, self.chunk_rays)
+            return
+
+    def apply(self, sim):
+        '''Sets the simulation's compact and streaming modes to the plan'''
+        sim.compact = self.mode == 'compact'
+        sim.streaming = {'chunk_rays': self.chunk_rays} \
+            if self.mode == 'stream' else None
+
+    def __str__(self):
+        chunk = ' in chunks of {} rays'.format(self.chunk_rays) \
+            if self.mode == 'stream' else ''
+        return ('Predicted peak memory {:.1f} MB ({} mode{}): rays ' +
+            '{:.1f} MB, {:.0f} crossings per source ({:.1f} MB), ' +
+            'reflectograms {:.1f} MB').format(self.peak / 1e6, self.mode,
+            chunk, self.parts['rays'] / 1e6, self.crossings,
+            self.parts['crossings'] / 1e6, self.parts['reflectograms'] / 1e6)
@@ -0,0 +1,867 @@
+'''
+A pure NumPy implementation of the three calculation stages of `ra_cpp`
+(`_direct_sound`, `_raytracer_main` and `_intensity_main`). The rays of a
+source are traced together, one reflection order per step, against a
+`CompiledScene`. The results are stored in Python mirrors of the ra_cpp
+classes (`PySource`, `PyRay`, `PyRecCross`, ...), with the same attributes,
+so `results.process_results` consumes them in the same way. The crossings
+of a source are kept in a `CrossingTable` (a column per field), its `rays`
+(PyRay objects) are built from the table on demand.
+
+The tracing rules follow the c++ code: nearest plane ahead of the ray (the
+plane the ray leaves excluded), specular reflection up to the transition
+order and random (scattered) reflection afterwards, receiver growth and the
+visibility test that discards the receiver crossings behind the next plane.
+Two c++ quirks are not reproduced: the cosine of a discarded crossing is
+discarded too (c++ keeps `cos_cross` out of sync with `time_cross`) and a
+receiver with the direct sound blocked gets no direct sound intensity.
+'''
+import copy
+
+import numpy as np
+
+from ra.log import log
+from ra.receiver_grid import ReceiverGrid, RECGRID_MIN_RECEIVERS
+
+# planes_hist codes of the c++ ray tracer
+NO_PLANE = 65533        # the ray escaped (no plane was found)
+EMPTY_PLANE = 65535     # reflection order not reached
+
+class PyReceiver():
+    '''
+    Python mirror of ra_cpp.Receivercpp:
+    - coord - the 3D position of the receiver.
+    - orientation - the orientation of the receiver.
+    - orientation_fig8 - the orientation of the figure of 8 microphone.
+    '''
+    def __init__(self, coord, orientation):
+        self.coord = np.array(coord, dtype=np.float32)
+        self.orientation = np.array(orientation, dtype=np.float32)
+        self.orientation_fig8 = np.zeros(3, dtype=np.float32)
+
+    def point_to_source(self, source_coord):
+        '''Point the receiver towards a sound source'''
+        self.orientation = np.float32(source_coord) - self.coord
+        self.orientation /= np.linalg.norm(self.orientation)
+        return self.orientation
+
+    def point_fig8(self):
+        '''Point the receiver 90 deg from orientation (y-axis)'''
+        return fig8_orientations(self.orientation[None])[0]
+
+class PyRecCross():
+    '''
+    Python mirror of ra_cpp.RecCrosscpp: source-ray-receiver data (time of
+    ray cross, receiver radius, reflection order and cosine at crossing) and,
+    after the intensity stage, i_cross (Nfreq x Ncrossings). The optional
+    weight of each crossing (Russian roulette survivors) scales i_cross.
+    '''
+    def __init__(self, time_cross, rad_cross, ref_order, cos_cross,
+        weight=None):
+        self.time_cross = np.array(time_cross, dtype=np.float32)
+        self.rad_cross = np.array(rad_cross, dtype=np.float32)
+        self.ref_order = np.array(ref_order, dtype=np.uint16)
+        self.cos_cross = np.array(cos_cross, dtype=np.float32)
+        if weight is None:
+            weight = np.ones(len(self.time_cross))
+        self.weight = np.array(weight, dtype=np.float32)
+        self.i_cross = np.zeros((0, len(self.time_cross)), dtype=np.float32)
+
+class PyRecCrossDir():
+    '''
+    Python mirror of ra_cpp.RecCrossDircpp: source-receiver direct sound
+    data (size_of_time, time_dir, hits_dir, cos_dir and i_dir).
+    '''
+    def __init__(self, size_of_time, time_dir, hits_dir, cos_dir):
+        self.size_of_time = size_of_time
+        self.time_dir = time_dir
+        self.hits_dir = hits_dir
+        self.cos_dir = cos_dir
+        self.i_dir = np.zeros(0, dtype=np.float32)
+
+class PyRay():
+    '''
+    Python mirror of ra_cpp.Raycpp: planes_hist (the planes hit by the ray),
+    refpts_hist (the first reflection points) and recs (one PyRecCross per
+    receiver).
+    '''
+    def __init__(self, planes_hist, refpts_hist, recs):
+        self.planes_hist = planes_hist
+        self.refpts_hist = refpts_hist
+        self.recs = recs
+
+class PySource():
+    '''
+    Python mirror of ra_cpp.Sourcecpp. As in c++, the source keeps its own
+    copy of the reccrossdir objects.
+    '''
+    def __init__(self, coord, orientation, power_dB, eq_dB, power_lin,
+        delay, rays, reccrossdir):
+        self.coord = np.array(coord, dtype=np.float32)
+        self.orientation = np.array(orientation, dtype=np.float32)
+        self.power_dB = np.array(power_dB, dtype=np.float32)
+        self.eq_dB = np.array(eq_dB, dtype=np.float32)
+        self.power_lin = np.array(power_lin, dtype=np.float32)
+        self.delay = delay
+        # the traced rays: planes and reflection points history (Nrays x
+        # N_max_ref and Nrays x N_max_ro x 3) and the CrossingTable
+        self.planes_hist = None
+        self.refpts_hist = None
+        self.crossings = None
+        self.rays = rays
+        self.reccrossdir = [copy.deepcopy(r) for r in reccrossdir]
+        # number of rays traced at each reflection order
+        self.alive_per_order = np.zeros(0, dtype=np.int64)
+        # receiver map mode: the GridHistogram filled while tracing
+        self.map_histogram = None
+        # streaming mode: the ReceiverHistogram of the receivers
+        self.stream_histogram = None
+
+    @property
+    def rays(self):
+        '''One PyRay per traced ray (with a PyRecCross per receiver), built
+        from the crossing table when it is read'''
+        if self.crossings is None:
+            return self._rays
+        return split_crossings(self.crossings, self.planes_hist,
+            self.refpts_hist)
+
+    @rays.setter
+    def rays(self, rays):
+        self._rays = list(rays)
+        self.crossings = None
+
+    @property
+    def nrays(self):
+        '''The number of traced rays'''
+        if self.crossings is None:
+            return len(self._rays)
+        return self.planes_hist.shape[0]
+
+def fig8_orientations(orientations):
+    '''Receivercpp::point_fig8 for many orientations (N x 3) at once'''
+    orientation_z = orientations.copy()
+    orientation_z[:, 2] += 0.2
+    orientation_z /= np.linalg.norm(orientation_z, axis=1)[:, None]
+    fig8 = np.cross(orientations, orientation_z)
+    return (fig8 / np.linalg.norm(fig8, axis=1)[:, None]).astype(np.float32)
+
+def point_all_receivers(source_coord, receivers):
+    '''
+    Points every receiver to the source (as ra_cpp's point_all_receivers)
+    and returns the receivers' coordinates and fig 8 orientations (Nrec x 3).
+    '''
+    coords = np.array([r.coord for r in receivers],
+        dtype=np.float32).reshape(-1, 3)
+    orientations = np.float32(source_coord) - coords
+    orientations /= np.linalg.norm(orientations, axis=1)[:, None]
+    fig8 = fig8_orientations(orientations)
+    for r, orientation, orientation_fig8 in zip(receivers, orientations,
+            fig8):
+        r.orientation = orientation
+        r.orientation_fig8 = orientation_fig8
+    return coords, fig8
+
+def rays_x_spheres(r0, rd, rec_coords, rec_radius):
+    '''
+    Receivercpp::raysphere for rays (origins r0, directions rd) against
+    receivers (centers rec_coords, radii rec_radius). The arrays broadcast
+    against each other (with a last axis of size 3 for the vectors), e.g.
+    r0[:, None], rd[:, None], rec_coords[None] to test every ray against
+    every receiver.
+
+    Returns
+    -------
+    The crossing flags and the "distance from the reflection point to the
+    receiver" used by the visibility test and the arrival times.
+    '''
+    ray_rec_vec = r0 - rec_coords
+    b = np.sum(ray_rec_vec * rd, axis=-1)
+    dist_origin2rec = np.linalg.norm(ray_rec_vec, axis=-1)
+    delta = b**2 - (dist_origin2rec**2 - rec_radius**2)
+    hit = (delta >= 0) & (b <= 0)
+    d = np.linalg.norm(ray_rec_vec - b[..., None] * rd, axis=-1)
+    dist_rp_rec = np.sqrt(dist_origin2rec**2 + d**2)
+    return hit, dist_rp_rec
+
+def direct_sound(sources, receivers, rec_radius, scene, c0, v_init):
+    '''
+    NumPy version of ra_cpp._direct_sound. For each source-receiver pair
+    with an unblocked direct path it sets the time of arrival, the cosine
+    and the number of rays hitting the receiver in direct incidence.
+    '''
+    for s in sources:
+        rec_coords, fig8 = point_all_receivers(s.coord, receivers)
+        sr_vec = rec_coords - s.coord
+        dist_dir = np.linalg.norm(sr_vec, axis=1)
+        v_dir = sr_vec / dist_dir[:, None]
+        origins = np.repeat(s.coord[None], len(receivers), axis=0)
+        _, dist_plane, _ = scene.nearest(origins, v_dir)
+        hits, _ = rays_x_spheres(s.coord, v_init[:, None], rec_coords[None],
+            rec_radius)
+        hits_dir = np.count_nonzero(hits, axis=0)
+        for jrec, rec in enumerate(s.reccrossdir):
+            if dist_dir[jrec] < dist_plane[jrec]:
+                rec.size_of_time += 1
+                rec.time_dir = np.float32(dist_dir[jrec] / c0)
+                rec.cos_dir = np.float32(np.dot(v_dir[jrec], fig8[jrec]))
+                rec.hits_dir = max(int(hits_dir[jrec]), 1)
+    return sources
+
+def reflect(v_in, normals, s, scatter):
+    '''
+    rayreflection for many rays: specular reflection, or a random direction
+    (the c++ distribution) pointing into the room for the rays in `scatter`
+    whose random draw falls below the plane's scattering coefficient.
+    '''
+    v_out = v_in - 2 * np.sum(normals * v_in, axis=1)[:, None] * normals
+    if scatter:
+        diffuse = np.random.rand(len(v_in)) <= s
+        ndiffuse = np.count_nonzero(diffuse)
+        if ndiffuse > 0:
+            phi_h = np.arccos(np.sqrt(np.random.rand(ndiffuse)))
+            phi_v = 2.0 * np.pi * np.random.rand(ndiffuse)
+            v_rand = np.stack((np.cos(phi_v) * np.cos(phi_h),
+                np.cos(phi_v) * np.sin(phi_h), np.sin(phi_v)), axis=1)
+            # the normal facing the incoming ray
+            n = normals[diffuse]
+            n = np.where(np.sum(v_in[diffuse] * n, axis=1)[:, None] > 0,
+                -n, n)
+            flip = np.sum(n * v_rand, axis=1) < 0
+            v_rand[flip] = -v_rand[flip]
+            v_out[diffuse] = v_rand
+    return v_out.astype(np.float32)
+
+def trace_source(source_coord, rec_coords, fig8, scene, N_max_ref, N_max_ro,
+    v_init, allow_scattering, transition_order, rec_radius_init,
+    allow_growth, rec_radius_final, c0, nrays_total=None, t_max=None,
+    energy_floor_dB=None, m_s=None, roulette=0.0, use_grid=None,
+    histogram=None, stream=None, compact_bins=None):
+    '''
+    Traces all the rays of a source, one reflection order per step, keeping
+    only the rays still alive (compacted) in the state arrays.
+    `v_init` may be a shard of the source's rays, in which case
+    `nrays_total` (the number of rays of the source) sets the receiver
+    growth.
+
+    A ray dies when it escapes the room. In the wavefront mode it also dies
+    when its travelled time passes `t_max` (it cannot reach a receiver before
+    t_max anymore) or when its energy (the largest over the frequency
+    bands, reflection and air losses with the air absorption `m_s`) falls
+    below `energy_floor_dB` (relative to its initial energy). With a
+    `roulette` survival probability p > 0 these rays play Russian roulette
+    instead: they survive with probability p and their weight (and energy)
+    is multiplied by 1/p, so the expected intensities are unbiased.
+
+    The ray segments are tested against the receivers of a ReceiverGrid when
+    `use_grid` is True (by default, with more than RECGRID_MIN_RECEIVERS
+    receivers) or against every receiver otherwise.
+
+    With a `histogram` (GridHistogram, receiver map mode), the crossings of
+    its receivers are also binned in it, with the rays' energies, instead
+    of being returned. With a `stream` (ReceiverHistogram of rec_coords,
+    streaming mode), the crossings of the receivers are binned in it and
+    the returned crossing columns are empty. With `compact_bins` (the
+    results' time bins) the crossings of each reflection order are
+    compacted as they are found (see compact_columns()).
+
+    Returns
+    -------
+    planes_hist (Nrays x N_max_ref), refpts_hist (Nrays x N_max_ro x 3),
+    a dictionary of crossing columns (ray, rec, time, rad, order, cos,
+    weight) and
+    the number of rays alive at each reflection order (N_max_ref).
+    '''
+    nrays = v_init.shape[0]
+    if nrays_total is None:
+        nrays_total = nrays
+    planes_hist = np.full((nrays, N_max_ref), EMPTY_PLANE, dtype=np.uint16)
+    refpts_hist = np.zeros((nrays, N_max_ro, 3), dtype=np.float32)
+    # state of the live rays
+    live = np.arange(nrays)
+    origin = np.repeat(np.float32(source_coord)[None], nrays, axis=0)
+    v_dir = np.array(v_init, dtype=np.float32)
+    previous = np.full(nrays, -1, dtype=np.int64)
+    cum_dist = np.zeros(nrays)
+    rec_radius = np.full(nrays, rec_radius_init)
+    track_energy = energy_floor_dB is not None or histogram is not None or \
+        stream is not None
+    if track_energy:
+        with np.errstate(divide='ignore'):
+            log_vp = np.log(1 - scene.alpha.astype(np.float64))
+        log_energy = np.zeros((nrays, scene.nbands))
+    if energy_floor_dB is not None:
+        log_floor = energy_floor_dB / (10 * np.log10(np.e))
+    log_weight = np.zeros(nrays)
+    alive = np.zeros(N_max_ref, dtype=np.int64)
+    if use_grid is None:
+        use_grid = rec_coords.shape[0] > RECGRID_MIN_RECEIVERS
+    grid = None
+    if use_grid and stream is None:
+        grid = ReceiverGrid(rec_coords, max(rec_radius_init,
+            rec_radius_final))
+    crossings = CrossingTable(rec_coords.shape[0], compact_bins)
+    for ref_order in range(N_max_ref):
+        if live.size == 0:
+            break
+        alive[ref_order] = live.size
+        planes, dist, ref_pt = scene.nearest(origin, v_dir, previous)
+        is_hit = planes >= 0
+        planes_hist[live, ref_order] = np.where(is_hit, planes, NO_PLANE)
+        if ref_order < N_max_ro:
+            refpts_hist[live, ref_order] = origin
+        # receivers crossed by the segments from the last reflection, with
+        # the visibility test against the next plane (the rays that escaped
+        # cross all the receivers ahead)
+        if ref_order > 0:
+            if stream is None:
+                crossings.append(segment_crossings(live, origin, v_dir, dist,
+                    cum_dist, rec_radius, log_weight, ref_order, rec_coords,
+                    fig8, grid, c0))
+            for hist in (histogram, stream):
+                if hist is not None:
+                    hist.add_segments(origin, v_dir, dist, cum_dist,
+                        rec_radius, log_weight, log_energy, ref_order)
+        # rays that escaped are not traced any further
+        live, v_dir, planes, dist, ref_pt = live[is_hit], v_dir[is_hit], \
+            planes[is_hit], dist[is_hit], ref_pt[is_hit]
+        cum_dist, rec_radius = cum_dist[is_hit], rec_radius[is_hit]
+        log_weight = log_weight[is_hit]
+        if track_energy:
+            log_energy = log_energy[is_hit] + log_vp[planes]
+        # reflect the rays
+        v_dir = reflect(v_dir, scene.normals[planes], scene.s[planes],
+            allow_scattering == 1 and ref_order > transition_order)
+        cum_dist = cum_dist + dist
+        origin = ref_pt
+        previous = planes
+        # wavefront mode: compact the rays out of time or energy
+        if t_max is not None or energy_floor_dB is not None:
+            keep = np.ones(live.size, dtype=bool)
+            if t_max is not None:
+                keep &= cum_dist <= c0 * t_max
+            if energy_floor_dB is not None:
+                below = np.max(log_energy - np.float64(m_s) *
+                    cum_dist[:, None], axis=1) + log_weight < log_floor
+                if roulette > 0:
+                    survive = below & (np.random.rand(below.size) < roulette)
+                    log_weight[survive] -= np.log(roulette)
+                    below &= ~survive
+                keep &= ~below
+            if track_energy:
+                log_energy = log_energy[keep]
+            live, v_dir, cum_dist, rec_radius, origin, previous, log_weight = \
+                live[keep], v_dir[keep], cum_dist[keep], rec_radius[keep], \
+                origin[keep], previous[keep], log_weight[keep]
+        # receiver growth
+        if allow_growth == 1 and ref_order + 1 > transition_order:
+            rec_radius = 2.0 * cum_dist / np.sqrt(nrays_total)
+        rec_radius = np.clip(rec_radius, rec_radius_init, rec_radius_final)
+    else:
+        # segments after the last reflection order, not tested for
+        # visibility (as in c++)
+        if stream is None:
+            crossings.append(segment_crossings(live, origin, v_dir,
+                np.full(live.size, np.inf), cum_dist, rec_radius, log_weight,
+                N_max_ref, rec_coords, fig8, grid, c0))
+        for hist in (histogram, stream):
+            if hist is not None:
+                hist.add_segments(origin, v_dir, np.full(live.size, np.inf),
+                    cum_dist, rec_radius, log_weight, log_energy, N_max_ref)
+    return planes_hist, refpts_hist, crossings.columns, alive
+
+def segment_crossings(live, origin, v_dir, length, cum_dist, rec_radius,
+    log_weight, ref_order, rec_coords, fig8, grid, c0):
+    '''
+    Crossing columns of the receivers crossed by the live rays' segments
+    (from the reflection point `origin`, of length `length`), with the
+    receivers of the grid cells along each segment or, without a grid,
+    with every receiver.
+    '''
+    if grid is None:
+        hit, dist_rp_rec = rays_x_spheres(origin[:, None], v_dir[:, None],
+            rec_coords[None], rec_radius[:, None])
+        ray_pos, rec = np.nonzero(hit & (dist_rp_rec < length[:, None]))
+        dist_rp_rec = dist_rp_rec[ray_pos, rec]
+    else:
+        ray_pos, rec = grid.candidates(origin, v_dir, length)
+        hit, dist_rp_rec = rays_x_spheres(origin[ray_pos], v_dir[ray_pos],
+            rec_coords[rec], rec_radius[ray_pos])
+        hit &= dist_rp_rec < length[ray_pos]
+        ray_pos, rec, dist_rp_rec = ray_pos[hit], rec[hit], dist_rp_rec[hit]
+    return {
+        'ray': live[ray_pos],
+        'rec': rec,
+        'time': ((cum_dist[ray_pos] + dist_rp_rec) / c0).astype(np.float32),
+        'rad': rec_radius[ray_pos].astype(np.float32),
+        'order': np.full(ray_pos.size, ref_order, dtype=np.uint16),
+        'cos': np.sum(v_dir[ray_pos] * fig8[rec], axis=1),
+        'weight': np.exp(log_weight[ray_pos]),
+    }
+
+class GridHistogram():
+    '''
+    Receiver map mode: the energy arriving at each receiver of a
+    ReceiverMap from a source, binned while tracing into per receiver and
+    per band histograms, hist (Ncells x Nbands x Nbins, the reflectograms'
+    time bins), so no crossing is kept. The energies are the ones of
+    intensity_main() (reflection and air losses, receiver radius, weight).
+    '''
+    def __init__(self, coords, time_bins, power_ray, m_s, c0, max_radius):
+        self.coords = np.asarray(coords, dtype=np.float32)
+        self.time_bins = time_bins
+        self.power_ray = np.asarray(power_ray, dtype=np.float64)
+        self.m_s = np.asarray(m_s, dtype=np.float64)
+        self.c0 = c0
+        # the cosines are not used (no LF maps)
+        self.fig8 = np.zeros_like(self.coords)
+        self.grid = None
+        if len(self.coords) > RECGRID_MIN_RECEIVERS:
+            self.grid = ReceiverGrid(self.coords, max_radius)
+        self.hist = np.zeros((len(self.coords), len(self.power_ray),
+            len(time_bins)))
+
+    def add(self, time, cell, energy, cos=None):
+        '''Adds the energies (N x Nbands) arriving at the cells at `time`,
+        binned as in results.reflectogram_hist, and their cosines (N, see
+        weighted())'''
+        ncells, nbands, nbins = self.hist.shape
+        bins = np.digitize(time, self.time_bins)
+        keep = bins < nbins
+        index = cell[keep] * nbins + bins[keep]
+        for hist, weights in self.weighted(energy[keep],
+            None if cos is None else cos[keep]):
+            for jb in range(nbands):
+                hist[:, jb, :] += np.bincount(index,
+                    weights=weights[:, jb],
+                    minlength=ncells * nbins).reshape(ncells, nbins)
+
+    def weighted(self, energy, cos):
+        '''The histograms and the energies binned in each of them (the
+        cosines are not used)'''
+        return [(self.hist, energy)]
+
+    def add_direct(self, source_coord, scene, rec_radius):
+        '''Direct sound of the receivers with an unblocked path to the
+        source (as direct_sound() and intensity_main())'''
+        sr_vec = self.coords - np.float32(source_coord)
+        dist_dir = np.linalg.norm(sr_vec, axis=1)
+        origins = np.repeat(np.float32(source_coord)[None], len(sr_vec),
+            axis=0)
+        # (a receiver at the source gets no direct sound)
+        with np.errstate(invalid='ignore'):
+            _, dist_plane, _ = scene.nearest(origins,
+                sr_vec / dist_dir[:, None])
+        cell = np.nonzero(dist_dir < dist_plane)[0]
+        energy = self.power_ray * np.exp(-self.m_s * dist_dir[cell, None]) / \
+            (np.pi * rec_radius**2)
+        self.add(np.float32(dist_dir[cell] / self.c0), cell, energy)
+
+    def add_segments(self, origin, v_dir, length, cum_dist, rec_radius,
+        log_weight, log_energy, ref_order):
+        '''Adds the crossings of the rays' segments (see trace_source())'''
+        cols = segment_crossings(np.arange(len(origin)), origin, v_dir,
+            length, cum_dist, rec_radius, log_weight, ref_order,
+            self.coords, self.fig8, self.grid, self.c0)
+        time = cols['time'].astype(np.float64)
+        energy = self.power_ray * np.exp(log_energy[cols['ray']] -
+            self.m_s * self.c0 * time[:, None]) * \
+            (cols['weight'] / (np.pi * cols['rad']**2))[:, None]
+        self.add(cols['time'], cols['rec'], energy, cols['cos'])
+
+class ReceiverHistogram(GridHistogram):
+    '''
+    Streaming mode: the crossings of the receivers of a source binned while
+    tracing, as the GridHistogram of a receiver grid, so no crossing is kept
+    and the memory does not grow with the rays. Besides hist, it bins the
+    energies times cos^2 (hist_cos2, LF) and |cos| (hist_cosabs, LFC), with
+    the receivers' figure of 8 orientations fig8, and keeps the last bin
+    reached by each receiver (last), which reflectogram_hist drops.
+    '''
+    def __init__(self, coords, fig8, time_bins, power_ray, m_s, c0,
+        max_radius):
+        super().__init__(coords, time_bins, power_ray, m_s, c0, max_radius)
+        self.fig8 = np.asarray(fig8, dtype=np.float32)
+        self.hist_cos2 = np.zeros_like(self.hist)
+        self.hist_cosabs = np.zeros_like(self.hist)
+        self.last = np.zeros(len(self.coords), dtype=np.int64)
+
+    def add(self, time, cell, energy, cos=None):
+        np.maximum.at(self.last, cell, np.digitize(time, self.time_bins))
+        super().add(time, cell, energy, cos)
+
+    def weighted(self, energy, cos):
+        '''The histograms and the energies binned in each of them'''
+        cos = np.asarray(cos, dtype=np.float64)[:, None]
+        return [(self.hist, energy), (self.hist_cos2, energy * cos**2),
+            (self.hist_cosabs, energy * np.abs(cos))]
+
+    def add_direct_sound(self, reccrossdir, rec_radius):
+        '''The direct sound of the receivers (see direct_sound()), with the
+        intensities of intensity_main() (none when blocked)'''
+        time = np.array([r.time_dir for r in reccrossdir], dtype=np.float32)
+        energy = self.power_ray * np.exp(-self.m_s * self.c0 *
+            time[:, None].astype(np.float64)) / (np.pi * rec_radius**2)
+        energy[[r.hits_dir == 0 for r in reccrossdir]] = 0
+        self.add(time, np.arange(len(reccrossdir)), energy,
+            np.array([r.cos_dir for r in reccrossdir], dtype=np.float32))
+
+    def reflectograms(self):
+        '''The (reflectogram, reflecto_cos2, reflecto_cosabs) of each
+        receiver, as results.source_reflectograms'''
+        return [(self.hist[jrec, :, :last], self.hist_cos2[jrec, :, :last],
+            self.hist_cosabs[jrec, :, :last])
+            for jrec, last in enumerate(self.last)]
+
+def columns_take(columns, mask):
+    return {key: value[mask] for key, value in columns.items()}
+
+class CrossingTable():
+    '''
+    The receiver crossings of a source as a struct of arrays: a column per
+    field (ray, rec, time, rad, order, cos and weight, one entry per
+    crossing) and, after the intensity stage, the intensity of each band
+    (Nbands x Ncrossings). The crossings are appended in chunks (e.g., one
+    per reflection order or per shard) and concatenated once; sort() orders
+    them by receiver, ray and reflection order, so the crossings of a
+    receiver are a slice of the columns (see receiver()).
+
+    With the results' time bins (time_bins) the table is compact (see
+    compact_columns()), each chunk encoded as it is appended: the times
+    as the uint32 index of their time bin (column bin instead of time),
+    the cosines as int8 and the intensities as log quantized uint16 (see
+    quantize_log()). times(), cosines() and intensity decode them.
+    '''
+    def __init__(self, nrecs, time_bins=None):
+        self.nrecs = nrecs
+        self.chunks = []
+        self.bounds = None
+        # the time bins of the compact encoding (None: full precision)
+        self.time_bins = None if time_bins is None else \
+            np.asarray(time_bins)
+        self.intensity = None
+
+    def append(self, cols):
+        '''Appends a chunk of crossing columns (encoded if the table is
+        compact)'''
+        if self.compact and 'time' in cols:
+            cols = compact_columns(cols, self.time_bins)
+        self.chunks.append(cols)
+        self.bounds = None
+
+    @property
+    def columns(self):
+        '''The crossing columns (the chunks concatenated)'''
+        if len(self.chunks) != 1:
+            self.chunks = [columns_concatenate(self.chunks)]
+        return self.chunks[0]
+
+    def __len__(self):
+        return self.columns['ray'].size
+
+    @property
+    def nbytes(self):
+        '''The memory of the columns and intensities [bytes]'''
+        return sum(value.nbytes for value in self.columns.values()) + \
+            (0 if self._intensity is None else self._intensity.nbytes)
+
+    @property
+    def compact(self):
+        return self.time_bins is not None
+
+    @property
+    def intensity(self):
+        '''The intensities of the crossings (Nbands x Ncrossings, float32),
+        None before the intensity stage'''
+        if self._intensity is None or not self.compact:
+            return self._intensity
+        return dequantize_log(self._intensity, self.log_range)
+
+    @intensity.setter
+    def intensity(self, intensity):
+        if intensity is not None and self.compact:
+            intensity, self.log_range = quantize_log(intensity)
+        self._intensity = intensity
+
+    def set_intensity(self, nbands, band_intensity):
+        '''Sets the intensities band by band: band_intensity(jf) returns
+        the intensities (N) of band jf, encoded as they come in the compact
+        encoding'''
+        if not self.compact:
+            self._intensity = np.empty((nbands, len(self)), dtype=np.float32)
+            for jf in range(nbands):
+                self._intensity[jf] = band_intensity(jf)
+            return
+        self._intensity = np.empty((nbands, len(self)), dtype=np.uint16)
+        self.log_range = np.zeros((nbands, 2))
+        for jf in range(nbands):
+            self._intensity[jf:jf + 1], self.log_range[jf:jf + 1] = \
+                quantize_log(band_intensity(jf)[None])
+
+    def band_intensity(self, jf):
+        '''The intensities of the crossings in band jf'''
+        if not self.compact:
+            return self._intensity[jf]
+        return dequantize_log(self._intensity[jf:jf + 1],
+            self.log_range[jf:jf + 1])[0]
+
+    def times(self, cols=None):
+        '''The crossing times [s] (of the columns cols, all by default):
+        the bins' centres in the compact encoding'''
+        cols = self.columns if cols is None else cols
+        if not self.compact:
+            return cols['time']
+        Dt = self.time_bins[1] - self.time_bins[0]
+        return ((cols['bin'] - 0.5) * Dt).astype(np.float32)
+
+    def cosines(self, cols=None):
+        '''The cosines of the crossings (of the columns cols, all by
+        default)'''
+        cols = self.columns if cols is None else cols
+        if not self.compact:
+            return cols['cos']
+        return cols['cos'].astype(np.float32) / COS_SCALE
+
+    def sort(self):
+        '''Orders the crossings by receiver, ray and reflection order (a
+        single stable sort) and sets the receivers' bounds'''
+        cols = self.columns
+        order = np.lexsort((cols['order'], cols['ray'], cols['rec']))
+        self.chunks = [columns_take(cols, order)]
+        self.bounds = np.searchsorted(self.chunks[0]['rec'],
+            np.arange(self.nrecs + 1))
+        self.intensity = None
+
+    def receiver(self, jrec):
+        '''The crossing columns of receiver jrec (views, with time and cos
+        decoded) and their intensities (None before the intensity stage),
+        see sort()'''
+        sl = slice(self.bounds[jrec], self.bounds[jrec + 1])
+        cols = columns_take(self.columns, sl)
+        if self.compact:
+            cols['time'], cols['cos'] = self.times(cols), self.cosines(cols)
+        if self._intensity is None:
+            return cols, None
+        if self.compact:
+            return cols, dequantize_log(self._intensity[:, sl],
+                self.log_range)
+        return cols, self._intensity[:, sl]
+
+    def compact_to(self, time_bins):
+        '''Compact encoding of a full precision table, for the results'
+        time bins (time_bins), see compact_columns()'''
+        if self.compact:
+            return
+        intensity = self.intensity
+        self.chunks = [compact_columns(self.columns, time_bins)]
+        self.time_bins = np.asarray(time_bins)
+        self.intensity = intensity
+
+# int8 cosines of the compact crossing tables
+COS_SCALE = 127
+
+def compact_columns(cols, time_bins):
+    '''
+    Compact encoding of crossing columns, for the results' time bins
+    (time_bins): the times become the uint32 bin of
+    results.reflectogram_hist (np.digitize), the cosines int8 (cos x 127),
+    and the ray and receiver indexes int32 (COMPACT_COLUMNS).
+    '''
+    cols = dict(cols)
+    cols['bin'] = np.digitize(cols.pop('time'), time_bins)
+    cols['cos'] = np.round(cols['cos'] * COS_SCALE)
+    return {key: np.asarray(cols[key]).astype(dtype)
+        for key, dtype in COMPACT_COLUMNS}
+
+def quantize_log(values):
+    '''
+    Log quantization of non negative values (Nbands x N) to uint16: code 0
+    is a zero and codes 1 to 65535 split the band's range of log(values)
+    (log_range, Nbands x 2: its minimum and step) uniformly, a relative
+    error of at most step / 2 (e.g., 3e-4 for a range of 40 nepers).
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    positive = values > 0
+    with np.errstate(divide='ignore'):
+        logs = np.log(np.where(positive, values, 1.0))
+    low = np.min(np.where(positive, logs, np.inf), axis=1, initial=np.inf)
+    high = np.max(np.where(positive, logs, -np.inf), axis=1,
+        initial=-np.inf)
+    # bands without positive values
+    empty = ~np.isfinite(low)
+    low[empty], high[empty] = 0.0, 0.0
+    step = np.maximum(high - low, 1e-12) / 65534
+    codes = np.where(positive, 1 + np.round((logs - low[:, None]) /
+        step[:, None]), 0).astype(np.uint16)
+    return codes, np.stack((low, step), axis=1)
+
+def dequantize_log(codes, log_range):
+    '''The float32 values of quantize_log()'s codes'''
+    low, step = log_range[:, :1], log_range[:, 1:]
+    return np.where(codes > 0, np.exp(low + (codes.astype(np.float64) - 1) *
+        step), 0.0).astype(np.float32)
+
+# the crossing columns and their dtypes, full precision and compact (see
+# compact_columns())
+COLUMNS = (('ray', np.int64), ('rec', np.int64), ('time', np.float32),
+    ('rad', np.float32), ('order', np.uint16), ('cos', np.float32),
+    ('weight', np.float32))
+COMPACT_COLUMNS = (('ray', np.int32), ('rec', np.int32), ('bin', np.uint32),
+    ('rad', np.float32), ('order', np.uint16), ('cos', np.int8),
+    ('weight', np.float32))
+
+def columns_concatenate(columns_list):
+    columns = COMPACT_COLUMNS if any('bin' in c for c in columns_list) \
+        else COLUMNS
+    return {key: np.concatenate([c[key] for c in columns_list] +
+        [np.zeros(0, dtype)]).astype(dtype) for key, dtype in columns}
+
+def raytracer_main(ht_length, allow_scattering, transition_order,
+    rec_radius_init, allow_growth, rec_radius_final, sources, receivers,
+    scene, c0, v_init, N_max_ref, N_max_ro, wavefront=None,
+    histograms=None, checkpoint=None, streams=None, chunk_rays=None,
+    compact_bins=None):
+    '''
+    NumPy version of ra_cpp._raytracer_main. Traces the rays of each source
+    and fills the source's rays (PyRay objects) with the planes history and
+    the receivers crossings. `wavefront` is an optional dictionary with the
+    t_max, energy_floor_dB and m_s arguments of trace_source().
+    `histograms` is an optional list with a GridHistogram per source
+    (receiver map mode), filled with the direct sound and the crossings.
+    With a `checkpoint` (ra.checkpoint.Checkpoint) the rays are traced in
+    chunks, checkpointed after each chunk, and a resumed run continues from
+    the checkpoint's cursor.
+    `streams` is an optional list with a ReceiverHistogram per source
+    (streaming mode): the receivers' crossings are binned in it, the rays
+    are traced in chunks of chunk_rays (all at once if None) and the source
+    keeps no rays, so the memory does not grow with the number of rays.
+    With `compact_bins` (the results' time bins) the crossing tables are
+    compact (see compact_columns()).
+    '''
+    for js, s in enumerate(sources):
+        log.info("Tracing rays for source: {} at: ({}) [m]".format(
+            js + 1, s.coord))
+        rec_coords, fig8 = point_all_receivers(s.coord, receivers)
+        histogram = None
+        if histograms is not None:
+            histogram = histograms[js]
+            histogram.add_direct(s.coord, scene, rec_radius_init)
+            s.map_histogram = histogram
+        stream = None
+        if streams is not None:
+            stream = streams[js]
+            stream.add_direct_sound(s.reccrossdir, rec_radius_init)
+            s.stream_histogram = stream
+        def trace_rays(first, last):
+            return trace_source(s.coord, rec_coords, fig8, scene, N_max_ref,
+                N_max_ro, v_init[first:last], allow_scattering,
+                transition_order, rec_radius_init, allow_growth,
+                rec_radius_final, c0, nrays_total=v_init.shape[0],
+                histogram=histogram, stream=stream,
+                compact_bins=compact_bins, **(wavefront or {}))
+        if stream is not None:
+            # only the rays alive per order are kept from each chunk
+            alive = np.zeros(N_max_ref, dtype=np.int64)
+            chunk = chunk_rays or max(v_init.shape[0], 1)
+            for first in range(0, v_init.shape[0], chunk):
+                alive += trace_rays(first, first + chunk)[3]
+            s.rays = []
+            s.alive_per_order = alive
+            log.info("Rays alive per reflection order: {}".format(
+                np.trim_zeros(alive, 'b')))
+            continue
+        if checkpoint is None:
+            traced = trace_rays(0, v_init.shape[0])
+        else:
+            traced = checkpoint.trace(js, v_init, trace_rays)
+        planes_hist, refpts_hist, cols, alive = traced
+        store_rays(s, planes_hist, refpts_hist, cols, len(receivers), alive,
+            compact_bins)
+    return sources
+
+def store_rays(source, planes_hist, refpts_hist, cols, nrecs, alive,
+    compact_bins=None):
+    '''Keeps the traced data in the source (its crossings in a
+    CrossingTable, compact for the time bins compact_bins if given) and
+    counts the receivers crossings'''
+    source.alive_per_order = alive
+    log.info("Rays alive per reflection order: {}".format(
+        np.trim_zeros(alive, 'b')))
+    crossings = CrossingTable(nrecs, compact_bins)
+    crossings.append(cols)
+    crossings.sort()
+    source.rays = []
+    source.planes_hist, source.refpts_hist = planes_hist, refpts_hist
+    source.crossings = crossings
+    for rec, count in zip(source.reccrossdir, np.diff(crossings.bounds)):
+        rec.size_of_time += int(count)
+
+def split_crossings(crossings, planes_hist, refpts_hist):
+    '''Builds one PyRay per ray (and one PyRecCross per ray and receiver,
+    with its intensities if computed) from a sorted CrossingTable'''
+    cols, nrecs = crossings.columns, crossings.nrecs
+    time, cos = crossings.times(), crossings.cosines()
+    intensity = crossings.intensity
+    # the crossings of each (receiver, ray), in reflection order
+    nrays = planes_hist.shape[0]
+    bounds = np.searchsorted(cols['rec'] * nrays + cols['ray'],
+        np.arange(nrecs * nrays + 1))
+    rays = []
+    for jray in range(nrays):
+        recs = []
+        for jrec in range(nrecs):
+            sl = slice(bounds[jrec * nrays + jray],
+                bounds[jrec * nrays + jray + 1])
+            rec_cross = PyRecCross(time[sl], cols['rad'][sl],
+                cols['order'][sl], cos[sl], cols['weight'][sl])
+            if intensity is not None:
+                rec_cross.i_cross = intensity[:, sl]
+            recs.append(rec_cross)
+        rays.append(PyRay(planes_hist[jray], refpts_hist[jray], recs))
+    return rays
+
+def intensity_main(rec_radius_init, sources, c0, m_s, alpha_s,
+    unit_power=False):
+    '''
+    NumPy version of ra_cpp._intensity_main: direct sound intensities
+    (i_dir) and reflected sound intensities of every crossing (the
+    intensity of the source's CrossingTable), computed for all the
+    crossings of a source at once. With unit_power the intensities are the
+    ones of a 1 W source (every band), as kept by results.RecResults.
+    '''
+    m_s = np.asarray(m_s, dtype=np.float32)
+    # log of the reflection coefficients, with a column of zeros for the
+    # planes_hist codes (the cumulative sums never reach them)
+    with np.errstate(divide='ignore'):
+        log_vp = np.log(1 - np.asarray(alpha_s, dtype=np.float32))
+    for js, s in enumerate(sources):
+        log.info("Calculating intensities for source: {} at: ({}) [m]".format(
+            js + 1, s.coord))
+        nrays = s.nrays
+        power_lin = np.ones_like(s.power_lin) if unit_power else s.power_lin
+        power_ray = np.asarray(power_lin, dtype=np.float32) / nrays
+        # direct sound
+        for rec in s.reccrossdir:
+            rec.i_dir = (power_ray * (1 / (np.pi * rec_radius_init**2)) *
+                np.exp(-m_s * rec.time_dir * c0)).astype(np.float32)
+            if rec.hits_dir == 0:
+                # blocked direct sound
+                rec.i_dir = np.zeros_like(rec.i_dir)
+        if nrays == 0:
+            continue
+        # cumulative sum of log(1-alpha) along each ray's planes, one band
+        # at a time (Nrays x N_max_ref floats)
+        valid = s.planes_hist < log_vp.shape[1]
+        planes = np.where(valid, s.planes_hist, 0)
+        cols = s.crossings.columns
+        ray, order = cols['ray'], cols['order'].astype(np.int64)
+        time = s.crossings.times()
+        def band_intensity(jf):
+            log_cumsum = np.concatenate((np.zeros((nrays, 1),
+                dtype=np.float32), np.cumsum(np.where(valid,
+                log_vp[jf, planes], 0), axis=1)), axis=1)
+            vp_cp = np.exp(log_cumsum[ray, order])
+            return (vp_cp * np.exp(-m_s[jf] * time * c0) * power_ray[jf] *
+                cols['weight'] / (np.pi * cols['rad']**2)).astype(np.float32)
+        s.crossings.set_intensity(log_vp.shape[0], band_intensity)
+    return sources
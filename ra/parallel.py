@@ -0,0 +1,193 @@
+'''
+Multiprocess calculations for the 'numpy' backend:
+- raytracer_main() - the rays of each source are split in shards traced
+    by a pool of worker processes.
+- run_sources() - each source runs its whole calculation (direct sound to
+    SouResults) in a worker process.
+The compiled scene and the initial ray directions are copied once to shared
+memory (multiprocessing.RawArray) and mapped read only by every worker; the
+tasks carry only the per source (or per shard) data and the results are
+merged into the same source/ray/receiver structures of the serial engine.
+'''
+import multiprocessing
+
+import numpy as np
+
+from ra.log import log
+from ra import numpy_engine
+from ra.results import process_results
+from ra.scene import CompiledScene
+
+# data of a worker process, set once by init_worker()
+_worker = {}
+
+def share_array(array):
+    '''Copies an array to shared memory. Returns a picklable
+    (RawArray, dtype, shape) tuple, see shared_view()'''
+    array = np.ascontiguousarray(array)
+    raw = multiprocessing.RawArray('b', max(array.nbytes, 1))
+    np.frombuffer(raw, dtype=np.int8)[:array.nbytes] = \
+        array.reshape(-1).view(np.int8)
+    return raw, array.dtype.str, array.shape
+
+def shared_view(shared):
+    '''A numpy view of an array in shared memory (see share_array())'''
+    raw, dtype, shape = shared
+    count = int(np.prod(shape))
+    return np.frombuffer(raw, dtype=dtype, count=count).reshape(shape)
+
+def share_scene(scene):
+    '''The state of a CompiledScene with its arrays in shared memory'''
+    state = scene.__getstate__()
+    return {key: share_array(value) if isinstance(value, np.ndarray)
+        else value for key, value in state.items()}
+
+def scene_from_shared(state):
+    '''Rebuilds a CompiledScene (see share_scene()) on top of the shared
+    memory, without copying its arrays'''
+    scene = CompiledScene.__new__(CompiledScene)
+    scene.__setstate__({key: shared_view(value)
+        if isinstance(value, tuple) else value
+        for key, value in state.items()})
+    return scene
+
+def init_worker(scene_state, v_init, params):
+    _worker['scene'] = scene_from_shared(scene_state)
+    _worker['v_init'] = shared_view(v_init)
+    _worker['params'] = params
+
+def trace_shard(task):
+    '''Traces the rays [first, last) of a source in a worker process'''
+    source_coord, rec_coords, fig8, first, last, seed = task
+    np.random.seed(seed)
+    v_init = _worker['v_init']
+    return numpy_engine.trace_source(source_coord, rec_coords, fig8,
+        _worker['scene'], v_init=v_init[first:last],
+        nrays_total=v_init.shape[0], **_worker['params'])
+
+def shard_bounds(nrays, nshards):
+    '''Bounds of `nshards` contiguous shards of nearly equal size'''
+    return np.linspace(0, nrays, nshards + 1).astype(np.int64)
+
+def merge_shards(shards, bounds):
+    '''Concatenates the traced data of the shards of a source, with the
+    crossings' ray indexes relative to the whole source'''
+    planes_hist = np.concatenate([shard[0] for shard in shards])
+    refpts_hist = np.concatenate([shard[1] for shard in shards])
+    cols_list = []
+    for (_, _, cols, _), first in zip(shards, bounds):
+        cols = dict(cols)
+        cols['ray'] = (cols['ray'] + first).astype(cols['ray'].dtype)
+        cols_list.append(cols)
+    alive = np.sum([shard[3] for shard in shards], axis=0)
+    return planes_hist, refpts_hist, \
+        numpy_engine.columns_concatenate(cols_list), alive
+
+def raytracer_main(ht_length, allow_scattering, transition_order,
+    rec_radius_init, allow_growth, rec_radius_final, sources, receivers,
+    scene, c0, v_init, N_max_ref, N_max_ro, workers, wavefront=None,
+    compact_bins=None):
+    '''
+    numpy_engine.raytracer_main with the rays of each source split in
+    `workers` shards, traced by a pool of `workers` processes. Each shard
+    has its own random seed, drawn from numpy's global random state.
+    '''
+    nrays = v_init.shape[0]
+    bounds = shard_bounds(nrays, workers)
+    seeds = np.random.randint(2**31 - 1, size=(len(sources), workers))
+    tasks = []
+    for js, s in enumerate(sources):
+        rec_coords, fig8 = numpy_engine.point_all_receivers(s.coord,
+            receivers)
+        for jw in range(workers):
+            tasks.append((s.coord, rec_coords, fig8, bounds[jw],
+                bounds[jw + 1], seeds[js, jw]))
+    params = dict(N_max_ref=N_max_ref, N_max_ro=N_max_ro,
+        allow_scattering=allow_scattering,
+        transition_order=transition_order, rec_radius_init=rec_radius_init,
+        allow_growth=allow_growth, rec_radius_final=rec_radius_final, c0=c0,
+        compact_bins=compact_bins, **(wavefront or {}))
+    log.info("Tracing {} rays of {} sources with {} workers".format(
+        nrays, len(sources), workers))
+    with multiprocessing.Pool(workers, initializer=init_worker,
+            initargs=(share_scene(scene), share_array(v_init),
+            params)) as pool:
+        shards = pool.map(trace_shard, tasks)
+    for js, s in enumerate(sources):
+        planes_hist, refpts_hist, cols, alive = merge_shards(
+            shards[js * workers:(js + 1) * workers], bounds)
+        numpy_engine.store_rays(s, planes_hist, refpts_hist, cols,
+            len(receivers), alive, compact_bins)
+    return sources
+
+def init_source_worker(scene_state, v_init, receivers, params):
+    init_worker(scene_state, v_init, params)
+    _worker['receivers'] = receivers
+
+def run_source(task):
+    '''Direct sound, ray tracing, intensities and results of a source in a
+    worker process. Returns the source and its SouResults.'''
+    source, seed = task
+    np.random.seed(seed)
+    scene, v_init = _worker['scene'], _worker['v_init']
+    receivers, p = _worker['receivers'], _worker['params']
+    sources = numpy_engine.direct_sound([source], receivers,
+        p['rec_radius_init'], scene, p['c0'], v_init)
+    sources = numpy_engine.raytracer_main(p['ht_length'],
+        p['allow_scattering'], p['transition_order'], p['rec_radius_init'],
+        p['allow_growth'], p['rec_radius_final'], sources, receivers, scene,
+        p['c0'], v_init, p['N_max_ref'], p['N_max_ro'], p['wavefront'],
+        compact_bins=p['compact_bins'])
+    sources = numpy_engine.intensity_main(p['rec_radius_init'], sources,
+        p['c0'], p['m'], np.ascontiguousarray(scene.alpha.T),
+        unit_power=True)
+    sou_results = process_results(p['Dt'], p['ht_length'], p['freq'],
+        sources, receivers)
+    return sources[0], sou_results[0]
+
+def source_costs(sources, receivers, scene, v_init, p, npilot=64):
+    '''
+    Estimated cost of each source, from a pilot trace of about `npilot`
+    of its rays: the ray x plane tests of the traced reflections plus the
+    receivers crossings (processed in the intensity and results stages).
+    '''
+    pilot = v_init[::max(1, v_init.shape[0] // npilot)]
+    costs = []
+    for s in sources:
+        rec_coords, fig8 = numpy_engine.point_all_receivers(s.coord,
+            receivers)
+        planes_hist, _, cols, _ = numpy_engine.trace_source(s.coord,
+            rec_coords, fig8, scene, p['N_max_ref'], p['N_max_ro'], pilot,
+            p['allow_scattering'], p['transition_order'],
+            p['rec_radius_init'], p['allow_growth'], p['rec_radius_final'],
+            p['c0'], nrays_total=v_init.shape[0], **(p['wavefront'] or {}))
+        reflections = np.count_nonzero(
+            planes_hist != numpy_engine.EMPTY_PLANE)
+        costs.append((reflections * scene.nplanes + cols['ray'].size) *
+            v_init.shape[0] / pilot.shape[0])
+    return np.array(costs)
+
+def run_sources(sources, receivers, scene, v_init, params, workers):
+    '''
+    Runs the whole calculation of each source (direct sound to SouResults)
+    in a pool of `workers` processes. The sources are submitted by
+    decreasing estimated cost (see source_costs()), so the longest ones
+    start first; the results come back in the sources' order.
+
+    Returns
+    -------
+    The traced sources and the list of SouResults.
+    '''
+    costs = source_costs(sources, receivers, scene, v_init, params)
+    order = np.argsort(-costs, kind='mergesort')
+    seeds = np.random.randint(2**31 - 1, size=len(sources))
+    log.info("Running {} sources with {} workers, order: {}".format(
+        len(sources), workers, order + 1))
+    with multiprocessing.Pool(min(workers, len(sources)),
+            initializer=init_source_worker, initargs=(share_scene(scene),
+            share_array(v_init), receivers, params)) as pool:
+        pending = [(js, pool.apply_async(run_source,
+            ((sources[js], seeds[js]),))) for js in order]
+        done = dict((js, result.get()) for js, result in pending)
+    sources = [done[js][0] for js in range(len(sources))]
+    return sources, [done[js][1] for js in range(len(sources))]
@@ -0,0 +1,324 @@
+'''
+A compact store of the traced sound paths, to evaluate the intensity and
+results stages again (e.g., for new materials) without tracing, also in a
+later session: PathStore.save() writes a compressed .npz file and
+PathStore.load() reads it back.
+
+The reflection planes of each receiver crossing (its path) are kept in a
+prefix trie: a node per distinct sequence of planes, with its parent (the
+sequence without its last plane) and its last plane. Paths of the same ray,
+and of the rays sharing their first reflections, share the nodes of their
+common prefix, and the crossings only keep their node. The plane sequences
+are decoded (CSR, see SourcePaths.plane_sequences()) on demand.
+
+The store also keeps the sound speed of the tracing, c0: the path length of
+a crossing is its time x c0, so the crossings can be retimed and their air
+absorption recomputed for another air condition (the paths themselves do
+not depend on the air).
+'''
+import numpy as np
+from scipy import sparse
+
+from ra.log import log
+from ra.results import RecResults, SouResults, source_reflectograms, \
+    stack_reflectograms, batch_parameters
+
+class SourcePaths():
+    '''
+    The paths of a source:
+    - coord, power_lin, nrays - the source and its number of rays
+    - time_dir, hits_dir, cos_dir - the direct sound of each receiver
+    - ray, rec, time, rad, cos, weight, node - a column per crossing
+        (sorted by ray and receiver), node being the crossing's path
+    - node_parent, node_plane - the trie, node 0 being the empty path;
+        the nodes of depth d are level_start[d] <= node < level_start[d + 1]
+    '''
+    FIELDS = ('coord', 'power_lin', 'nrays', 'time_dir', 'hits_dir',
+        'cos_dir', 'ray', 'rec', 'time', 'rad', 'cos', 'weight', 'node',
+        'node_parent', 'node_plane', 'level_start')
+
+    def __init__(self, **arrays):
+        for name in self.FIELDS:
+            setattr(self, name, arrays[name])
+
+    @classmethod
+    def from_source(cls, source, nrecs):
+        '''The paths of a traced source (a 'cpp' or 'numpy' backend one)'''
+        names = ('ray', 'rec', 'time', 'rad', 'order', 'cos', 'weight')
+        dtypes = {'ray': np.int32, 'rec': np.int32, 'order': np.int64}
+        crossings = getattr(source, 'crossings', None)
+        if crossings is not None:
+            # 'numpy' backend: the columns of its crossing table
+            table = dict(crossings.columns, time=crossings.times(),
+                cos=crossings.cosines())
+            by_ray = np.lexsort((table['rec'], table['ray']))
+            cols = {name: table[name][by_ray].astype(dtypes.get(name,
+                np.float32)) for name in names}
+            nrays = source.planes_hist.shape[0]
+        else:
+            cols = {name: [] for name in names}
+            for jray, ray in enumerate(source.rays):
+                for jrec in range(nrecs):
+                    rec_ref = ray.recs[jrec]
+                    ncross = len(rec_ref.time_cross)
+                    cols['ray'].append(np.full(ncross, jray, dtype=np.int32))
+                    cols['rec'].append(np.full(ncross, jrec, dtype=np.int32))
+                    cols['time'].append(rec_ref.time_cross)
+                    cols['rad'].append(rec_ref.rad_cross)
+                    cols['order'].append(rec_ref.ref_order)
+                    cols['cos'].append(rec_ref.cos_cross)
+                    cols['weight'].append(getattr(rec_ref, 'weight',
+                        np.ones(ncross)))
+            cols = {name: np.concatenate([np.zeros(0)] + values).astype(
+                dtypes.get(name, np.float32)) for name, values in cols.items()}
+            nrays = len(source.rays)
+        # depth of the trie needed by each ray (its largest crossing order)
+        depth = np.zeros(nrays, dtype=np.int64)
+        np.maximum.at(depth, cols['ray'], cols['order'])
+        max_depth = int(depth.max()) if nrays else 0
+        if crossings is not None:
+            planes_hist = source.planes_hist[:, :max_depth].astype(np.int64)
+        else:
+            planes_hist = np.array([ray.planes_hist[:max_depth]
+                for ray in source.rays], dtype=np.int64).reshape(nrays,
+                max_depth)
+        ray_nodes = np.zeros((nrays, max_depth + 1), dtype=np.int64)
+        node_parent, node_plane, level_start = [np.zeros(1, np.int64)], \
+            [np.zeros(1, np.int64)], [0, 1]
+        for d in range(1, max_depth + 1):
+            active = np.nonzero(depth >= d)[0]
+            key = ray_nodes[active, d - 1] * 65536 + planes_hist[active, d - 1]
+            unique, inverse = np.unique(key, return_inverse=True)
+            ray_nodes[active, d] = level_start[-1] + inverse
+            node_parent.append(unique // 65536)
+            node_plane.append(unique % 65536)
+            level_start.append(level_start[-1] + unique.size)
+        return cls(coord=np.asarray(source.coord, dtype=np.float32),
+            power_lin=np.asarray(source.power_lin, dtype=np.float32),
+            nrays=np.int64(nrays),
+            time_dir=np.array([r.time_dir for r in source.reccrossdir],
+                dtype=np.float32),
+            hits_dir=np.array([r.hits_dir for r in source.reccrossdir],
+                dtype=np.int64),
+            cos_dir=np.array([r.cos_dir for r in source.reccrossdir],
+                dtype=np.float32),
+            ray=cols['ray'], rec=cols['rec'], time=cols['time'],
+            rad=cols['rad'], cos=cols['cos'], weight=cols['weight'],
+            node=ray_nodes[cols['ray'], cols['order']].astype(np.int32),
+            node_parent=np.concatenate(node_parent).astype(np.int32),
+            node_plane=np.concatenate(node_plane).astype(np.uint16),
+            level_start=np.array(level_start, dtype=np.int64))
+
+    @property
+    def order(self):
+        '''The reflection order of each crossing'''
+        return np.searchsorted(self.level_start, self.node, side='right') - 1
+
+    def plane_sequences(self, nodes=None):
+        '''
+        The planes of the paths (of every crossing by default) in CSR
+        format: the planes of path i are planes[indptr[i]:indptr[i + 1]].
+        '''
+        if nodes is None:
+            nodes = self.node
+        nodes = np.asarray(nodes, dtype=np.int64)
+        depth = np.searchsorted(self.level_start, nodes, side='right') - 1
+        indptr = np.concatenate(([0], np.cumsum(depth)))
+        planes = np.zeros(indptr[-1], dtype=np.uint16)
+        # walk up the trie, filling the sequences from their end
+        pos = indptr[1:] - 1
+        while True:
+            walking = np.nonzero(nodes > 0)[0]
+            if walking.size == 0:
+                break
+            planes[pos[walking]] = self.node_plane[nodes[walking]]
+            pos[walking] -= 1
+            nodes[walking] = self.node_parent[nodes[walking]]
+        return indptr, planes
+
+    def log_reflection(self, log_vp):
+        '''
+        The sum of log(1 - alpha) over the planes of each trie node's path
+        (Nbands x Nnodes), given log_vp (Nbands x Nplanes). Plane codes past
+        the planes (no plane) add nothing.
+        '''
+        log_node = np.zeros((log_vp.shape[0], self.node_parent.size),
+            dtype=np.float32)
+        for d in range(1, self.level_start.size - 1):
+            nodes = slice(self.level_start[d], self.level_start[d + 1])
+            plane = self.node_plane[nodes].astype(np.int64)
+            valid = plane < log_vp.shape[1]
+            log_node[:, nodes] = log_node[:, self.node_parent[nodes]] + \
+                np.where(valid[None], log_vp[:, np.where(valid, plane, 0)], 0)
+        return log_node
+
+    def hit_counts(self, nplanes):
+        '''
+        The number of hits of each plane along each crossing's path, a
+        sparse (Ncrossings x Nplanes) matrix: hit_counts @ log(1 - alpha)
+        is the log of the crossings' reflection losses. Plane codes past
+        the planes (no plane) are left out, so a plane with alpha = 1 only
+        adds log(0) to the paths that hit it.
+        '''
+        indptr, planes = self.plane_sequences()
+        valid = planes < nplanes
+        indptr = np.concatenate(([0], np.cumsum(valid)))[indptr]
+        return sparse.csr_matrix((np.ones(indptr[-1], dtype=np.float32),
+            planes[valid], indptr), shape=(self.node.size, nplanes))
+
+    def retimed(self, c0_ratio):
+        '''The direct sound and crossings' times with the sound speed
+        divided by c0_ratio (the same paths, at another air condition)'''
+        if c0_ratio == 1:
+            return self.time_dir, self.time
+        return (self.time_dir * c0_ratio).astype(np.float32), \
+            (self.time * c0_ratio).astype(np.float32)
+
+    def intensities(self, rec_radius_init, c0, m_s, log_cross, time_dir,
+        time):
+        '''
+        The direct sound intensities (Nbands x Nrec) and the crossings'
+        intensities (Nbands x Ncrossings) of a 1 W source, as
+        numpy_engine.intensity_main() with unit_power, given the log of the
+        crossings' reflection losses (Nbands x Ncrossings, see
+        log_reflection() and hit_counts()) and the times at the sound
+        speed c0 (see retimed())
+        '''
+        power_ray = np.ones_like(self.power_lin) / self.nrays
+        i_dir = (power_ray[:, None] * (1 / (np.pi * rec_radius_init**2)) *
+            np.exp(-m_s[:, None] * time_dir * c0)).astype(np.float32)
+        i_dir[:, self.hits_dir == 0] = 0
+        vp_cp = np.exp(log_cross)
+        i_cross = (vp_cp * np.exp(-m_s[:, None] * time * c0) *
+            power_ray[:, None] * self.weight /
+            (np.pi * self.rad**2)).astype(np.float32)
+        return i_dir, i_cross
+
+class PathStore():
+    '''
+    The paths (SourcePaths) of every source of a simulation, the number
+    of receivers and the sound speed of the tracing. See the module's
+    docstring.
+    '''
+    def __init__(self, sources, nrecs, c0):
+        self.sources = sources
+        self.nrecs = nrecs
+        self.c0 = c0
+
+    @classmethod
+    def from_sources(cls, sources, nrecs, c0):
+        '''The paths of the sources traced at the sound speed c0'''
+        if any(getattr(s, 'stream_histogram', None) is not None
+            for s in sources):
+            raise ValueError("The streamed sources keep no paths, trace " +
+                "them with the streaming mode off.")
+        return cls([SourcePaths.from_source(s, nrecs) for s in sources],
+            nrecs, c0)
+
+    def save(self, path):
+        '''Writes the store to a compressed .npz file'''
+        arrays = {'nrecs': np.int64(self.nrecs), 'c0': np.float64(self.c0)}
+        for js, s in enumerate(self.sources):
+            arrays.update({'s{}_{}'.format(js, name): getattr(s, name)
+                for name in SourcePaths.FIELDS})
+        np.savez_compressed(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        '''Reads a store written by save()'''
+        with np.load(path) as data:
+            nsources = sum(name.endswith('_node') for name in data.files)
+            sources = [SourcePaths(**{name: data['s{}_{}'.format(js, name)]
+                for name in SourcePaths.FIELDS}) for js in range(nsources)]
+            return cls(sources, int(data['nrecs']), float(data['c0']))
+
+    def process_results(self, Dt, ht_length, freq, rec_radius_init, c0, m_s,
+        alpha_s):
+        '''
+        The intensity and results stages (as backend.intensity() and
+        results.process_results()) for the sound speed c0, the air
+        absorption m_s and the absorption coefficients alpha_s (Nbands x
+        Nplanes).
+        '''
+        log.info("processing results of the stored paths...")
+        with np.errstate(divide='ignore'):
+            log_vp = np.log(1 - np.asarray(alpha_s, dtype=np.float32))
+        return [self.source_results(s, Dt, ht_length, freq, rec_radius_init,
+            c0, m_s, s.log_reflection(log_vp)[:, s.node])
+            for s in self.sources]
+
+    def sweep_materials(self, Dt, ht_length, freq, rec_radius_init, c0, m_s,
+        alpha_list, parameters):
+        '''
+        The parameters of every absorption variant, a (Nvariants x Npairs x
+        Nparameters x Nbands) array (pairs sorted by source, then receiver).
+        The reflection losses of all the variants are one matrix product per
+        source: the crossings' plane hit counts (Ncrossings x Nplanes) times
+        log(1 - alpha) of the variants side by side (Nplanes x Nvariants
+        Nbands).
+        The parameters of all the receivers of a source and variant are
+        computed at once (see results.batch_parameters), NaN where they
+        cannot be calculated.
+        alpha_list - the variants' absorption coefficients (Nplanes x
+            Nbands each)
+        parameters - the RecResults parameters' names
+        '''
+        alphas = np.array(alpha_list, dtype=np.float32)
+        nvariants, nplanes, nbands = alphas.shape
+        with np.errstate(divide='ignore'):
+            log_vp = np.log(1 - alphas).transpose(1, 0, 2).reshape(nplanes,
+                nvariants * nbands)
+        cube = np.zeros((nvariants, len(self.sources) * self.nrecs,
+            len(parameters), nbands), dtype=np.float32)
+        time_bins = np.arange(0.0, 1.2 * ht_length, Dt)
+        for js, s in enumerate(self.sources):
+            log.info("Sweeping {} materials for source: {}".format(nvariants,
+                js + 1))
+            log_cross = np.asarray(s.hit_counts(nplanes).dot(log_vp)).T
+            for jv in range(nvariants):
+                reflectograms = self.source_reflectograms(s, time_bins,
+                    rec_radius_init, c0, m_s,
+                    log_cross[jv * nbands:(jv + 1) * nbands])
+                # the parameters of all the receivers at once
+                reflectogram, reflecto_cos2, reflecto_cosabs = [
+                    stack_reflectograms([r[kind] for r in reflectograms])
+                    for kind in range(3)]
+                pars = batch_parameters(time_bins, reflectogram,
+                    reflecto_cos2=reflecto_cos2,
+                    reflecto_cosabs=reflecto_cosabs)
+                cube[jv, js * self.nrecs:(js + 1) * self.nrecs] = np.stack(
+                    [pars[par] for par in parameters], axis=1)
+        return cube
+
+    def source_results(self, s, Dt, ht_length, freq, rec_radius_init, c0, m_s,
+        log_cross):
+        '''The SouResults of the SourcePaths s, given the log of its
+        crossings' reflection losses (Nbands x Ncrossings)'''
+        time_bins = np.arange(0.0, 1.2 * ht_length, Dt)
+        rec = [RecResults.from_reflectograms(*reflectograms, time_bins, freq,
+            s.power_lin) for reflectograms in self.source_reflectograms(s,
+            time_bins, rec_radius_init, c0, m_s, log_cross)]
+        return SouResults(rec, time_bins, freq)
+
+    def source_reflectograms(self, s, time_bins, rec_radius_init, c0, m_s,
+        log_cross):
+        '''The (reflectogram, reflecto_cos2, reflecto_cosabs) of every
+        receiver of the SourcePaths s, see results.source_reflectograms'''
+        m_s = np.asarray(m_s, dtype=np.float32)
+        time_dir, time = s.retimed(self.c0 / c0)
+        i_dir, i_cross = s.intensities(rec_radius_init, c0, m_s, log_cross,
+            time_dir, time)
+        # crossings of each receiver, in ray order
+        order = np.argsort(s.rec, kind='mergesort')
+        bounds = np.searchsorted(s.rec[order], np.arange(self.nrecs + 1))
+        crossings = []
+        for jrec in range(self.nrecs):
+            sel = order[bounds[jrec]:bounds[jrec + 1]]
+            crossings.append((
+                np.concatenate((np.float32([time_dir[jrec]]),
+                    time[sel])).astype(np.float32),
+                np.concatenate((i_dir[:, jrec:jrec + 1], i_cross[:, sel]),
+                    axis=1),
+                np.concatenate((np.float32([s.cos_dir[jrec]]),
+                    s.cos[sel])).astype(np.float32)))
+        return source_reflectograms(time_bins, crossings)
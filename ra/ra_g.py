@@ -10,6 +10,7 @@ from tqdm import tqdm
 
 from ra.log import log
 from ra import rtrace as rt
+from ra.bvh import BVH, BVH_MIN_PLANES
 from ra.source import (
     # CircleSource, ConicSource,
     IsotropicSource,
@@ -54,6 +55,12 @@ class Simulation():
         self.room = self.setup_room(self.config)
         self.bbox = self.setup_bounding_box(self.config, scale=100)
         self.n_escaped_rays = 0
+        # the same planes packed in arrays for the vectorized tracer
+        self.room_packed = self.pack_planes(self.room)
+        self.bbox_packed = self.pack_planes(self.bbox)
+        self.room_bvh = None
+        if len(self.room) > BVH_MIN_PLANES:
+            self.room_bvh = BVH(*self.room_packed)
 
         # self.setup_rays() returns a list of 2D matrices, one matrix per
         # source and each matrix with shape (nverts, niters)
@@ -116,6 +123,13 @@ class Simulation():
                     planes.append(plane)
         return planes
 
+    def pack_planes(self, planes):
+        '''Returns the vertices (padded, see `rtrace.pack_polygons()`) and
+        normals of `planes` as two arrays with shapes (P, V, 3) and (P, 3)'''
+        vertices = rt.pack_polygons([plane.vertices for plane in planes])
+        normals = np.array([plane.normal for plane in planes], np.float32)
+        return vertices, normals
+
     def setup_rays(self, config, sources):
         # niters = int(np.ceil(np.log(pth/pin) / np.log(1 - alpha)))
         niters = 100
@@ -128,12 +142,20 @@ class Simulation():
         ret_ri = np.array([np.inf, np.inf, np.inf], np.float32)
 
         # test ray against room planes
-        for plane in self.room:
-            t, ri, hit = rt.ray_x_polygon(r0, rd, plane.vertices, plane.normal)
-            if hit and t < ret_t:
-                ret_t = t
-                ret_plane = plane
-                ret_ri = ri
+        if self.room_bvh is not None:
+            ids, _, ris = self.room_bvh.nearest(r0[None], rd[None])
+            if ids[0] >= 0:
+                ret_plane = self.room[ids[0]]
+                ret_ri = ris[0]
+        else:
+            for plane in self.room:
+                t, ri, hit = rt.ray_x_polygon(
+                    r0, rd, plane.vertices, plane.normal
+                )
+                if hit and t < ret_t:
+                    ret_t = t
+                    ret_plane = plane
+                    ret_ri = ri
         # if there was no intersection, this ray escaped and we need to test it
         # against the bounding box
         if ret_plane is None:
@@ -151,6 +173,68 @@ class Simulation():
                     ret_ri = ri
         return (ret_plane, ret_ri)
 
+    def rays_x_planes(self, r0, rd):
+        '''Vectorized version of `ray_x_planes()`: every ray in `r0`/`rd`
+        (arrays with shape (R, 3)) is tested against every room plane at once
+        and the rays that escape the room against the bounding box.
+
+        Returns
+        -------
+        A 3-tuple with the normals of the planes hit, the intersection points
+        and a boolean array set to True where the plane hit belongs to the
+        bounding box (or where the ray hits nothing at all, in which case the
+        normal and the intersection point are `inf`).
+        '''
+        normals = np.full(r0.shape, np.inf, dtype=np.float32)
+        if self.room_bvh is not None:
+            ids, _, ris = self.room_bvh.nearest(r0, rd)
+        else:
+            ids, _, ris = rt.nearest_polygons(r0, rd, *self.room_packed)
+        escaped = ids < 0
+        self.n_escaped_rays += np.count_nonzero(escaped)
+        normals[~escaped] = self.room_packed[1][ids[~escaped]]
+        if np.any(escaped):
+            bbox_ids, _, bbox_ris = rt.nearest_polygons(
+                r0[escaped], rd[escaped], *self.bbox_packed
+            )
+            bbox_normals = np.full(bbox_ris.shape, np.inf, dtype=np.float32)
+            bbox_normals[bbox_ids >= 0] = \
+                self.bbox_packed[1][bbox_ids[bbox_ids >= 0]]
+            normals[escaped] = bbox_normals
+            ris[escaped] = bbox_ris
+        return normals, ris, escaped
+
+    def start_vectorized(self):
+        '''Bounce-synchronous alternative to `start()`: instead of walking
+        one ray and one reflection at a time, every live ray of a source is
+        advanced by one reflection order per step with whole-array operations.
+        The rays positions, directions and lengths are the same as the ones
+        computed by `start()`.
+        '''
+        for src_rays in self.rays:
+            log.info(src_rays.nrays)
+            live = np.arange(src_rays.nrays)
+            for rayit in tqdm(range(src_rays.niters)):
+                if live.size == 0:
+                    break
+                rd = src_rays.rds[live, rayit]
+                normals, rhit, stops = self.rays_x_planes(
+                    r0=src_rays.ris[live, rayit], rd=rd
+                )
+                if rayit + 1 == src_rays.niters:
+                    # as in `start()`, the last iteration only counts the
+                    # escaped rays
+                    break
+                src_rays.ris[live, rayit+1] = rhit
+                # rays hitting the bounding box are not traced any further
+                src_rays.length[live[stops]] = rayit + 2
+                with np.errstate(invalid='ignore'):
+                    rr = -2*np.sum(rd*normals, axis=1)[:, None]*normals + rd
+                src_rays.rds[live, rayit+1] = np.where(
+                    np.isfinite(normals), rr, 0
+                )
+                live = live[~stops]
+
     def start(self):
         # loop through every single ray
         for src_rays in self.rays:
@@ -1,28 +1,47 @@
 import numpy as np
-import ra_cpp
+from ra.cpp_extension import ra_cpp
+
+# planes_hist code of a reflection order not reached yet
+EMPTY_PLANE = 65535
+
+def ray_blocks(nrays, N_max_ref, N_max_ro):
+    '''
+    Allocate the history of all the rays at once, in two contiguous
+    blocks (a ray is a row of each block):
+    1: planes_hist - the history of planes indexes found during
+            the ray travell in the room (Nrays x N_max_ref, uint16),
+            EMPTY_PLANE for the reflection orders not reached
+    2: refpts_hist - the history of reflection points found during
+            the ray travell in the room (Nrays x N_max_ro x 3 - floats)
+    The blocks are only the initial histories: each ray object copies
+    its rows (see ray_initializer), so they are not written by the tracing.
+    '''
+    planes_hist = np.full((nrays, N_max_ref), EMPTY_PLANE, dtype=np.uint16)
+    refpts_hist = np.zeros((nrays, N_max_ro, 3), dtype=np.float32)
+    return planes_hist, refpts_hist
 
 def ray_initializer(rays_dir, N_max_ref, trans_order, reccross):
-        '''
-        Initialize a std::vector of ray objects. Each ray object has
-        the following properties:
-        1: planes_hist - the history of planes indexes found during
-                the ray travell in the room (1 x N_max_ref)
-        2: refpts_hist - the history of reflection points found during
-                the ray travell in the room (N_max_ref x 3 - floats)
-        This will allocate memory on the stack in order to computhe
-        each ray history in the room
-        3: reccross - a std::vector of RecCross objects. Each RecCross object
-                has the following properties: time_cross, rad_cross and
-                ref_order. This data will be passed on to the sources
-                objectes estabilishing the relation source-ray-receiver.
-                time_cross, rad_cross and ref_order are allocated on the
-                heap, since we don't know when each receiver will be crossed.
-        '''
-        rays = [] # An array of empty ray objects
-        for jray in np.arange(rays_dir.Nrays):
-                planes = np.zeros(N_max_ref, dtype=np.uint16)+65535 #npint16
-                reflection_points = np.zeros((trans_order+2, 3), dtype=np.float32)  # <-- instead of trans_order+2 use `N_max_ref`
-                ################### cpp ray class #################
-                rays.append(ra_cpp.Raycpp(planes,
-                        reflection_points, reccross)) # Append the ray object
-        return rays
\ No newline at end of file
+    '''
+    Initialize a std::vector of ray objects. Each ray object has
+    the following properties:
+    1: planes_hist - the history of planes indexes found during
+            the ray travell in the room (1 x N_max_ref)
+    2: refpts_hist - the history of reflection points found during
+            the ray travell in the room (N_max_ro x 3 - floats, with
+            N_max_ro = trans_order + 2)
+    The histories of all rays are allocated at once (see ray_blocks)
+    and the ray objects are built from the blocks' rows in a single
+    c++ call (ra_cpp._rays_from_blocks), a faster constructor than one
+    ra_cpp.Raycpp per python call. Each ray keeps its own copy of its rows.
+    3: reccross - a std::vector of RecCross objects. Each RecCross object
+            has the following properties: time_cross, rad_cross and
+            ref_order. This data will be passed on to the sources
+            objectes estabilishing the relation source-ray-receiver.
+            time_cross, rad_cross and ref_order are allocated on the
+            heap, since we don't know when each receiver will be crossed.
+    '''
+    N_max_ro = trans_order + 2
+    planes_hist, refpts_hist = ray_blocks(rays_dir.Nrays, N_max_ref,
+        N_max_ro)
+    return ra_cpp._rays_from_blocks(planes_hist,
+        refpts_hist.reshape(-1, 3), N_max_ro, reccross)
@@ -57,6 +57,55 @@ class RayInitialDirections():
         self.Nrays = Nrays
         return self.vinit, self.Nrays
 
+    def sobol_rays(self, Nrays, scramble = True):
+        '''
+        This method defines ray directions from the first Nrays points of
+        the 2D Sobol sequence, mapped to the unit sphere by an equal area
+        map (z = 1 - 2u, azimuth = 2 pi v). The number of rays returned is
+        the same as the number of rays provided by the user. With scramble
+        = True the points get a random linear matrix scramble and digital
+        shift (a new randomized QMC replica at each call)
+        '''
+        points = sobol_2d(Nrays)
+        if scramble:
+            points = scramble_lms(points)
+        self.vinit = sphere_from_square(points * 2.0**-32)
+        self.Nrays = Nrays
+        return self.vinit, self.Nrays
+
+    def fibonacci_rays(self, Nrays, rotate = True):
+        '''
+        This method defines ray directions on a Fibonacci (golden angle)
+        lattice on the unit sphere: Nrays points of equal spacing in z
+        and azimuth steps of the golden angle. The number of rays returned
+        is the same as the number of rays provided by the user. With rotate
+        = True the lattice gets a random rotation (a new randomized QMC
+        replica at each call)
+        '''
+        u = (np.arange(Nrays) + 0.5) / Nrays
+        v = np.arange(Nrays) * (2 / (1 + np.sqrt(5))) % 1.0
+        self.vinit = sphere_from_square(np.stack((u, v), axis = 1))
+        if rotate:
+            self.vinit = random_rotation(self.vinit)
+        self.Nrays = Nrays
+        return self.vinit, self.Nrays
+
+    def equal_area_rays(self, Nrays, rotate = True):
+        '''
+        This method defines ray directions at the centers of a partition
+        of the unit sphere in Nrays regions of equal area (the recursive
+        zonal equal area partition: two polar caps and collars of regions,
+        in iso-latitude rings as in HEALPix). The number of rays returned
+        is the same as the number of rays provided by the user. With rotate
+        = True the partition gets a random rotation (a new randomized QMC
+        replica at each call)
+        '''
+        self.vinit = equal_area_points(Nrays)
+        if rotate:
+            self.vinit = random_rotation(self.vinit)
+        self.Nrays = Nrays
+        return self.vinit, self.Nrays
+
     def isotropic_rays(self, Nrays = 12, depth=1):
         '''
         This method defines ray directions calculated according to the
@@ -225,4 +274,100 @@ class RayInitialDirections():
         ax.set_xlabel('X axis')
         ax.set_ylabel('Y axis')
         ax.set_zlabel('Z axis')
-        plt.show()
\ No newline at end of file
+        plt.show()
+
+def sobol_2d(Nrays):
+    '''
+    The first Nrays points of the 2D Sobol sequence as 32 bit integers
+    (Nrays x 2): the van der Corput sequence and the Sobol dimension of the
+    primitive polynomial x + 1.
+    '''
+    v = np.zeros((32, 2), dtype=np.uint64)
+    v[0] = 1 << 31
+    for k in range(1, 32):
+        v[k, 0] = v[k - 1, 0] >> 1
+        v[k, 1] = v[k - 1, 1] ^ (v[k - 1, 1] >> 1)
+    n = np.arange(Nrays, dtype=np.uint64)
+    points = np.zeros((Nrays, 2), dtype=np.uint64)
+    for k in range(int(Nrays).bit_length()):
+        bit = (n >> np.uint64(k)) & np.uint64(1)
+        points ^= bit[:, None] * v[k]
+    return points
+
+def scramble_lms(points):
+    '''
+    Random linear matrix scramble and digital shift of 32 bit points
+    (N x dim): each output bit is the parity of the point's bits masked by
+    a random lower triangular row (more significant bits), then a random
+    bit pattern is xored. Each scrambled point is uniform in [0, 2^32).
+    '''
+    scrambled = np.zeros_like(points)
+    for jd in range(points.shape[1]):
+        for i in range(32):
+            bits = np.random.randint(2, size=i)
+            mask = (1 << (31 - i)) + sum(int(b) << (31 - j)
+                for j, b in enumerate(bits))
+            x = points[:, jd] & np.uint64(mask)
+            for shift in (16, 8, 4, 2, 1):
+                x ^= x >> np.uint64(shift)
+            scrambled[:, jd] |= (x & np.uint64(1)) << np.uint64(31 - i)
+        scrambled[:, jd] ^= np.uint64(np.random.randint(2**32,
+            dtype=np.int64))
+    return scrambled
+
+def sphere_from_square(uv):
+    '''Equal area map of points in the unit square (N x 2) to unit
+    vectors (N x 3)'''
+    z = 1.0 - 2.0 * uv[:, 0]
+    azimuth = 2.0 * np.pi * uv[:, 1]
+    r = np.sqrt(np.maximum(1.0 - z**2, 0.0))
+    vinit = np.stack((r * np.cos(azimuth), r * np.sin(azimuth), z), axis=1)
+    return vinit.astype(np.float32)
+
+def equal_area_points(Nrays):
+    '''
+    Centers of the recursive zonal equal area partition of the unit sphere
+    in Nrays regions (N x 3): caps of one region at the poles and collars
+    whose number of regions follows the ideal collar areas (rounded with
+    the carried rounding error).
+    '''
+    if Nrays == 1:
+        return np.array([[0.0, 0.0, 1.0]], dtype=np.float32)
+    area = 4 * np.pi / Nrays
+    theta_cap = np.arccos(1 - 2.0 / Nrays)
+    ncollars = max(1, int(round((np.pi - 2 * theta_cap) / np.sqrt(area))))
+    if Nrays == 2:
+        ncollars = 0
+    delta = (np.pi - 2 * theta_cap) / max(ncollars, 1)
+    # regions in each collar
+    theta = theta_cap + delta * np.arange(ncollars + 1)
+    ideal = 2 * np.pi * (np.cos(theta[:-1]) - np.cos(theta[1:])) / area
+    nregions = np.zeros(ncollars, dtype=np.int64)
+    carry = 0.0
+    for jc, y in enumerate(ideal):
+        nregions[jc] = int(round(y + carry))
+        carry += y - nregions[jc]
+    # collars' boundaries enclosing their regions' area, centers at the
+    # middle (in area) of each collar
+    cum = 1 + np.concatenate(([0], np.cumsum(nregions)))
+    z_bounds = 1 - 2.0 * cum / Nrays
+    points = [[0.0, 0.0, 1.0]]
+    for jc, n in enumerate(nregions):
+        if n == 0:
+            continue
+        z = 0.5 * (z_bounds[jc] + z_bounds[jc + 1])
+        # offset the collars' azimuths to avoid aligned regions
+        azimuth = 2 * np.pi * ((np.arange(n) + 0.5) / n +
+            jc * (2 / (1 + np.sqrt(5))))
+        r = np.sqrt(1 - z**2)
+        points.extend(np.stack((r * np.cos(azimuth), r * np.sin(azimuth),
+            np.full(n, z)), axis=1))
+    points.append([0.0, 0.0, -1.0])
+    return np.array(points, dtype=np.float32)
+
+def random_rotation(vinit):
+    '''The unit vectors (N x 3) rotated by a uniform random rotation
+    (a normalized Gaussian quaternion)'''
+    q = qua.from_float_array(np.random.randn(4)).normalized()
+    rotmat = qua.as_rotation_matrix(q)
+    return vinit.dot(rotmat.T).astype(np.float32)
@@ -0,0 +1,146 @@
+import numpy as np
+
+# simulations with more receivers than this test the ray segments against the
+# receivers of a uniform grid instead of against every receiver
+RECGRID_MIN_RECEIVERS = 16
+
+class ReceiverGrid():
+    '''
+    A uniform grid over the receivers' spheres (at their largest radius),
+    built once per source and used to find, for many ray segments at once,
+    the few receivers they can cross. Each receiver is listed in every cell
+    touched by its sphere, grown by half the sampling step of the segments
+    (see candidates()), and the lists are stored in flat arrays:
+    - origin, cell_size, shape - the grid (cells cover the receivers' box)
+    - step - the distance between the sample points along the segments
+    - cell_start - the range of `cell_recs` holding each cell's receivers
+        (shape Ncells + 1)
+    - cell_recs - the receivers' indexes sorted by cell
+    '''
+    def __init__(self, rec_coords, max_radius, cell_size=None):
+        '''
+        Parameters
+        ----------
+        rec_coords: a numpy.ndarray with shape (Nrec, 3) representing the
+            receivers' centers.
+        max_radius: a scalar, the largest receiver radius.
+        cell_size: the edge of the cubic cells. The default gives about
+            eight cells per receiver, never less than the receivers'
+            diameter.
+        '''
+        self.rec_coords = np.asarray(rec_coords, dtype=np.float64)
+        self.max_radius = float(max_radius)
+        if cell_size is None:
+            extent = np.ptp(self.rec_coords, axis=0) + 2 * self.max_radius
+            cell_size = np.prod(extent)**(1 / 3) / (8 * self.nrecs)**(1 / 3)
+        self.cell_size = max(float(cell_size), 2 * self.max_radius)
+        self.step = self.cell_size / 2
+        # spheres grown by half a step: every point of a crossed sphere's
+        # chord is less than half a step away from a sample point
+        reach = self.max_radius + self.step / 2
+        self.origin = self.rec_coords.min(axis=0) - reach
+        self.shape = np.maximum(np.ceil((self.rec_coords.max(axis=0) +
+            reach - self.origin) / self.cell_size), 1).astype(np.int64)
+        self.box_max = self.origin + self.shape * self.cell_size
+        lo = np.maximum(self.cell_coords(self.rec_coords - reach), 0)
+        hi = np.minimum(self.cell_coords(self.rec_coords + reach),
+            self.shape - 1)
+        counts = np.prod(hi - lo + 1, axis=1)
+        rec = np.repeat(np.arange(self.nrecs), counts)
+        k = np.arange(rec.size) - np.repeat(np.cumsum(counts) - counts,
+            counts)
+        span = (hi - lo + 1)[rec]
+        ijk = lo[rec] + np.stack([k // (span[:, 1] * span[:, 2]),
+            k // span[:, 2] % span[:, 1], k % span[:, 2]], axis=1)
+        cells = self.cell_index(ijk)
+        order = np.argsort(cells, kind='mergesort')
+        self.cell_recs = rec[order]
+        self.cell_start = np.searchsorted(cells[order],
+            np.arange(np.prod(self.shape) + 1))
+
+    @property
+    def nrecs(self):
+        return len(self.rec_coords)
+
+    def cell_coords(self, points):
+        return np.floor((points - self.origin) /
+            self.cell_size).astype(np.int64)
+
+    def cell_index(self, ijk):
+        return (ijk[..., 0] * self.shape[1] + ijk[..., 1]) * \
+            self.shape[2] + ijk[..., 2]
+
+    def clip_segments(self, r0, rd, length):
+        '''Parametric range [t0, t1] of each segment inside the grid's box
+        (t1 < t0 if the segment misses the box)'''
+        with np.errstate(divide='ignore', invalid='ignore'):
+            inv_rd = 1 / rd
+            t1 = (self.origin - r0) * inv_rd
+            t2 = (self.box_max - r0) * inv_rd
+        t_near = np.maximum(np.max(np.fmin(t1, t2), axis=1), 0)
+        t_far = np.minimum(np.min(np.fmax(t1, t2), axis=1), length)
+        return t_near, t_far
+
+    def candidates(self, r0, rd, length):
+        '''
+        The receivers that may be crossed by the segments r0 + t rd,
+        0 <= t <= length (`length` may be inf). Points along each segment,
+        `step` apart, are taken and the receivers listed in their cells are
+        collected: since each receiver is listed in the cells within
+        max_radius + step / 2 of its center, every receiver sphere touching
+        the segment is found.
+
+        Returns
+        -------
+        The segments' and receivers' indexes of the unique candidate pairs,
+        both with shape (Npairs,), sorted by segment.
+        '''
+        t0, t1 = self.clip_segments(r0, rd, length)
+        inside = np.nonzero(t1 >= t0)[0]
+        nsteps = np.floor((t1[inside] - t0[inside]) /
+            self.step).astype(np.int64) + 2
+        seg = np.repeat(inside, nsteps)
+        k = np.arange(seg.size) - np.repeat(np.cumsum(nsteps) - nsteps,
+            nsteps)
+        t = np.minimum(t0[seg] + k * self.step, t1[seg])
+        ijk = np.clip(self.cell_coords(r0[seg] + rd[seg] * t[:, None]), 0,
+            self.shape - 1)
+        cell = self.cell_index(ijk)
+        # unique (segment, cell) pairs of non empty cells
+        count = self.cell_start[cell + 1] - self.cell_start[cell]
+        ncells = np.prod(self.shape)
+        key = np.unique(seg[count > 0] * ncells + cell[count > 0])
+        seg, cell = key // ncells, key % ncells
+        count = self.cell_start[cell + 1] - self.cell_start[cell]
+        # expand the cells into their receivers
+        first = np.repeat(self.cell_start[cell] - np.cumsum(count) + count,
+            count)
+        rec = self.cell_recs[first + np.arange(first.size)]
+        seg = np.repeat(seg, count)
+        key = np.unique(seg * self.nrecs + rec)
+        return key // self.nrecs, key % self.nrecs
+
+class ReceiverMap():
+    '''
+    A regular grid of receivers for parameter maps (e.g., over an audience
+    area), see Simulation.set_receiver_grid(). The receivers are the points
+    origin + (i, j, k) * spacing, 0 <= (i, j, k) < shape, in C order; use
+    shape = (nx, ny, 1) for a horizontal plane.
+    '''
+    def __init__(self, origin, spacing, shape):
+        self.origin = np.array(origin, dtype=np.float32)
+        self.spacing = np.array(np.broadcast_to(np.float32(spacing), (3,)))
+        self.shape = tuple(int(n) for n in shape)
+        if len(self.shape) != 3 or min(self.shape) < 1:
+            raise ValueError("The receiver grid shape must have 3 positive " +
+                "sizes, got {}.".format(shape))
+
+    @property
+    def ncells(self):
+        return int(np.prod(self.shape))
+
+    @property
+    def coords(self):
+        '''The receivers' positions (Ncells x 3)'''
+        ijk = np.indices(self.shape).reshape(3, -1).T
+        return (self.origin + ijk * self.spacing).astype(np.float32)
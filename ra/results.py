@@ -4,7 +4,7 @@ import itertools
 import time
 
 from ra.log import log
-import ra_cpp
+from ra.cpp_extension import ra_cpp
 
 
 def process_results(Dt, ht_length, freq, sources, receivers):
@@ -13,69 +13,352 @@ def process_results(Dt, ht_length, freq, sources, receivers):
     reflectogram, decay and acoustical parameters. Each receiver
     will be appended to each source to store the results of
     each source-receiver (vs. time or vs. frequency) pair.
+    The reflectograms of all the receivers of a source are binned together
+    (see source_reflectograms and compact_reflectograms), or were binned
+    while tracing (streaming mode, the source's stream_histogram).
     '''
     log.info("processing results...")
     time_bins = np.arange(0.0, 1.2 * ht_length, Dt)
     sou = []
     for s in sources:
+        stream = getattr(s, 'stream_histogram', None)
+        table = getattr(s, 'crossings', None)
+        if stream is not None:
+            source_reflecto = stream.reflectograms()
+        elif table is not None and table.compact:
+            source_reflecto = compact_reflectograms(time_bins, s)
+        else:
+            crossings = [concatenate_crossings(s, jrec)
+                for jrec in range(len(receivers))]
+            source_reflecto = source_reflectograms(time_bins, crossings)
         rec = [] #SRPairRec()
-        for jrec, r in enumerate(receivers):
-            rec.append(RecResults(s, jrec, time_bins, freq))
+        for reflectograms in source_reflecto:
+            rec.append(RecResults.from_reflectograms(*reflectograms,
+                time_bins, freq, s.power_lin))
         sou.append(SouResults(rec, time_bins, freq))
     return sou
 
-class RecResults(object):
+def concatenate_crossings(source, jrec):
     '''
-    This class process all the relevant receiver data, such as:
-    reflectogram, decay and acoustical parameters. Each receiver
-    will be appended to each source to store the results of
-    each source-receiver (vs. time or vs. frequency) pair.
+    The arrival times, intensities (Nbands x N) and cosines of the direct
+    sound and reflections of a source at receiver jrec
     '''
-    def __init__(self, source, jrec, time_bins, freq):
-        start_time = time.time()
-        # Time concatenation
-        # time_cat = np.array(ra_cpp._time_cat(
-        #     source.rays, source.reccrossdir[jrec].time_dir, jrec), dtype = np.float32)
+    if ra_cpp is not None and isinstance(source, ra_cpp.Sourcecpp):
         time_cat = np.array(ra_cpp._time_cat(
             source.rays, source.reccrossdir[jrec].time_dir, jrec,
             source.reccrossdir[jrec].size_of_time), dtype = np.float32)
-
-        # log.info("time cat size: {}.".format(len(time_cat)))
-        # log.info("size_of_tme: {}.".format(source.reccrossdir[jrec].size_of_time))
-        # sort time vector
-        # id_sorted_time = np.argsort(time_cat)
-        # time_sorted = time_cat[id_sorted_time]
-        # concatenate sound intensities
-        # start_time = time.time()
         intensity_cat = np.array(ra_cpp._intensity_cat(
             source.rays, source.reccrossdir[jrec].i_dir,
             jrec, time_cat.size), dtype = np.float32)
-        
         # Cossine concatenation
         cos_cat = np.array(ra_cpp._cos_cat(
             source.rays, source.reccrossdir[jrec].cos_dir, jrec,
             source.reccrossdir[jrec].size_of_time), dtype = np.float32)
-        # log.info(" {} seconds to concatenate intensity (c++).".format(time.time() - start_time))
-        # sort intensity
-        # intensity_sorted = intensity_cat[:, id_sorted_time]
-        # reflectogram
-        self.reflectogram = reflectogram_hist(time_bins, time_cat, intensity_cat)
-        # self.reflectogram = reflectogram_hist(time_bins, time_sorted, intensity_sorted)
-        self.decay = decay_curve(self.reflectogram)
+    elif getattr(source, 'crossings', None) is not None:
+        # numpy backend: the receiver's slice of the crossing table
+        cols, intensity = source.crossings.receiver(jrec)
+        rec_dir = source.reccrossdir[jrec]
+        time_cat = np.concatenate((np.float32([rec_dir.time_dir]),
+            cols['time'])).astype(np.float32)
+        i_dir = np.array(rec_dir.i_dir, dtype = np.float32).reshape(-1, 1)
+        intensity_cat = np.concatenate((i_dir, np.reshape(intensity,
+            (len(i_dir), -1))), axis = 1).astype(np.float32)
+        cos_cat = np.concatenate((np.float32([rec_dir.cos_dir]),
+            cols['cos'])).astype(np.float32)
+    else:
+        # python sources (numpy backend)
+        time_cat = concatenate_tarray(jrec, source.rays,
+            source.reccrossdir[jrec].time_dir)
+        intensity_cat = concatenate_iarray(jrec, source.rays,
+            source.reccrossdir[jrec].i_dir)
+        cos_cat = concatenate_cosarray(jrec, source.rays,
+            source.reccrossdir[jrec].cos_dir)
+    return time_cat, intensity_cat, cos_cat
+
+def time_bin_index(time_bins, time):
+    '''
+    np.digitize(time, time_bins) for the uniform time_bins of the results
+    (np.arange from 0): floor division by Dt, corrected by one bin where
+    the rounding of the division and of np.arange disagree.
+    '''
+    nbins = time_bins.size
+    if nbins < 2:
+        return np.digitize(time, time_bins)
+    time = np.asarray(time, dtype = np.float64)
+    with np.errstate(invalid = 'ignore'):
+        bins = np.clip(np.floor(time / time_bins[1]) + 1, 0,
+            nbins).astype(np.int64)
+    bins[(bins > 0) & (time_bins[np.maximum(bins - 1, 0)] > time)] -= 1
+    bins[(bins < nbins) & (time_bins[np.minimum(bins, nbins - 1)] <=
+        time)] += 1
+    return bins
+
+def source_reflectograms(time_bins, crossings):
+    '''
+    The reflectograms of all the receivers of a source at once, equal to
+    the ones of reflectogram_hist: the bins of every arrival are computed
+    once (time_bin_index) and, for each band, a bincount over the flattened
+    (receiver, bin) index sums the intensities, the intensities x cos^2
+    (LF) and the intensities x |cos| (LFC) of every receiver.
+    Inputs:
+        time_bins - a time vector from 0 to 1.2*ht_length in Dt steps
+        crossings - a (time_cat, intensity_cat, cos_cat) per receiver, see
+            concatenate_crossings
+    Outputs:
+        a (reflectogram, reflecto_cos2, reflecto_cosabs) per receiver
+    '''
+    nrecs = len(crossings)
+    if nrecs == 0:
+        return []
+    sizes = [time_cat.size for time_cat, _, _ in crossings]
+    rec = np.repeat(np.arange(nrecs), sizes)
+    bins = time_bin_index(time_bins,
+        np.concatenate([time_cat for time_cat, _, _ in crossings]))
+    intensity = np.concatenate([intensity_cat
+        for _, intensity_cat, _ in crossings], axis = 1)
+    cos = np.concatenate([cos_cat for _, _, cos_cat in crossings])
+    return bin_reflectograms(time_bins, nrecs, rec, bins, cos,
+        intensity.shape[0], lambda jf: intensity[jf])
+
+def bin_reflectograms(time_bins, nrecs, rec, bins, cos, nbands,
+    band_intensity):
+    '''
+    The (reflectogram, reflecto_cos2, reflecto_cosabs) of each receiver from
+    the arrivals of a source: their receivers (rec), time bins (bins, see
+    time_bin_index), cosines (cos) and band_intensity(jf), their
+    intensities in band jf (read one band at a time).
+    '''
+    nb = time_bins.size + 1
+    index = rec * nb + bins
+    hist = np.empty((3, nbands, nrecs * nb))
+    cos2, cosabs = cos**2, np.abs(cos)
+    for jf in range(nbands):
+        i_freq = band_intensity(jf)
+        for kind, weights in enumerate((i_freq, np.multiply(i_freq, cos2),
+            np.multiply(i_freq, cosabs))):
+            hist[kind, jf] = np.bincount(index, weights = weights,
+                minlength = nrecs * nb)
+    hist = hist.reshape(3, -1, nrecs, nb)
+    # as reflectogram_hist: the bins up to the last one, which is dropped
+    last = np.zeros(nrecs, dtype = np.int64)
+    np.maximum.at(last, rec, bins)
+    return [tuple(hist[:, :, jrec, :last[jrec]])
+        for jrec in range(nrecs)]
+
+def compact_reflectograms(time_bins, source):
+    '''
+    source_reflectograms of a source with a compact crossing table (see
+    numpy_engine.CrossingTable.compact_to()): its bins are used as they are
+    (the crossings' times are decoded if the time bins changed) and its
+    intensities are decoded one band at a time.
+    '''
+    table = source.crossings
+    cols = table.columns
+    reccrossdir = source.reccrossdir
+    i_dir = np.array([np.reshape(r.i_dir, -1) for r in reccrossdir],
+        dtype = np.float32)
+    if table.time_bins.size == time_bins.size and \
+        np.array_equal(table.time_bins, time_bins):
+        bins = cols['bin'].astype(np.int64)
+    else:
+        bins = time_bin_index(time_bins, table.times())
+    # the direct sound of every receiver first
+    return bin_reflectograms(time_bins, table.nrecs,
+        np.concatenate((np.arange(table.nrecs), cols['rec'])),
+        np.concatenate((time_bin_index(time_bins, np.float32(
+        [r.time_dir for r in reccrossdir])), bins)),
+        np.concatenate((np.float32([r.cos_dir for r in reccrossdir]),
+        table.cosines())), i_dir.shape[1],
+        lambda jf: np.concatenate((i_dir[:, jf], table.band_intensity(jf))))
+
+class RecResults(object):
+    '''
+    This class process all the relevant receiver data, such as:
+    reflectogram, decay and acoustical parameters. Each receiver
+    will be appended to each source to store the results of
+    each source-receiver (vs. time or vs. frequency) pair.
+    The reflectograms and decay are kept for a unit source power
+    (unit_reflectogram, unit_reflecto_cos2, unit_reflecto_cosabs and
+    unit_decay, from the intensities of a 1 W source, see the backends'
+    intensity stage) and scaled by the source power per band, power_lin
+    (with its EQ), when read: see set_power().
+    The unit power reflectograms of the first time resolution are also kept
+    in a ReflectogramPyramid, so set_dt() serves any multiple of it without
+    binning the crossings again.
+    '''
+    def __init__(self, source, jrec, time_bins, freq):
+        start_time = time.time()
+        time_cat, intensity_cat, cos_cat = concatenate_crossings(source, jrec)
+        self.set_power(source.power_lin)
+        self.set_reflectograms(time_bins, time_cat, intensity_cat, cos_cat)
         log.info(" {} seconds to calc reflectogram (c++).".format(time.time() - start_time))
+        self.set_parameters(time_bins, freq)
 
-        # Calculate the direct sound id
-        direct_sound_idarr = np.nonzero(self.reflectogram[0,:])
-        id_dir = direct_sound_idarr[0]
-        # Calculate acoustical parameters
-        self.EDT = edt(time_bins, self.decay, id_dir[0], freq)
-        self.T20 = t20(time_bins, self.decay, id_dir[0], freq)
-        self.T30 = t30(time_bins, self.decay, id_dir[0], freq)
-        self.C80 = c80(time_bins, self.reflectogram, id_dir[0], freq)
-        self.D50 = d50(time_bins, self.reflectogram, id_dir[0], freq)
-        self.Ts = ts(time_bins, self.reflectogram, id_dir[0], freq)
-        self.G = g_db(self.reflectogram, source.power_lin, freq)
-        self.LF, self.LFC = lf_lfc(time_bins, self.reflectogram, id_dir[0], freq, time_cat, intensity_cat, cos_cat)
+    @classmethod
+    def from_reflectograms(cls, reflectogram, reflecto_cos2, reflecto_cosabs,
+        time_bins, freq, power_lin):
+        '''
+        The results of a source-receiver pair from its unit power
+        reflectograms (e.g., the ones accumulated over the batches of a
+        progressive run)
+        '''
+        rec = cls.__new__(cls)
+        rec.set_power(power_lin)
+        rec.set_unit_reflectograms(time_bins, reflectogram, reflecto_cos2,
+            reflecto_cosabs)
+        rec.set_parameters(time_bins, freq)
+        return rec
+
+    def set_power(self, power_lin):
+        '''
+        Set the source power per band (power_lin [W], power_dB plus eq_dB)
+        that scales the unit power reflectograms and decay. The parameters
+        do not depend on it (G is relative to the source power), so a power
+        or EQ change needs no new intensities nor results.
+        '''
+        self.power_lin = np.array(power_lin, dtype = np.float64)
+
+    @property
+    def reflectogram(self):
+        return self.unit_reflectogram * self.power_lin[:, None]
+
+    @property
+    def reflecto_cos2(self):
+        return self.unit_reflecto_cos2 * self.power_lin[:, None]
+
+    @property
+    def reflecto_cosabs(self):
+        return self.unit_reflecto_cosabs * self.power_lin[:, None]
+
+    @property
+    def decay(self):
+        return self.unit_decay * self.power_lin[:, None]
+
+    def set_reflectograms(self, time_bins, time_cat, intensity_cat, cos_cat):
+        '''Unit power reflectograms from the concatenated crossings (with
+        the intensities of a 1 W source)'''
+        self.set_unit_reflectograms(time_bins,
+            # reflectogram
+            reflectogram_hist(time_bins, time_cat, intensity_cat),
+            # bi-directional reflectograms for LF and LFC
+            reflectogram_hist(time_bins, time_cat,
+                np.multiply(intensity_cat, cos_cat**2)),
+            reflectogram_hist(time_bins, time_cat,
+                np.multiply(intensity_cat, np.abs(cos_cat))))
+
+    def set_unit_reflectograms(self, time_bins, reflectogram, reflecto_cos2,
+        reflecto_cosabs):
+        '''Sets the unit power reflectograms and their pyramid'''
+        self.unit_reflectogram = reflectogram
+        self.unit_reflecto_cos2 = reflecto_cos2
+        self.unit_reflecto_cosabs = reflecto_cosabs
+        self.pyramid = ReflectogramPyramid(time_bins[1] - time_bins[0],
+            (reflectogram, reflecto_cos2, reflecto_cosabs))
+
+    def set_dt(self, Dt, time_bins):
+        '''
+        Change the time resolution of the reflectograms to Dt, a multiple of
+        the pyramid's base, and recompute the decay and parameters.
+        time_bins is the new time vector (0 to 1.2 ht_length in Dt steps).
+        '''
+        self.unit_reflectogram, self.unit_reflecto_cos2, \
+            self.unit_reflecto_cosabs = self.pyramid.at(Dt)
+        self.set_parameters(time_bins, self.freq)
+
+    def set_parameters(self, time_bins, freq):
+        '''Decay and acoustical parameters from the unit power
+        reflectograms, computed as the ones of many pairs (see
+        batch_parameters): NaN where a parameter cannot be calculated'''
+        self.freq = freq
+        self.unit_decay = decay_curve(self.unit_reflectogram)
+        pars = batch_parameters(time_bins, self.unit_reflectogram[None],
+            self.unit_decay[None], self.unit_reflecto_cos2[None],
+            self.unit_reflecto_cosabs[None])
+        for par, values in pars.items():
+            setattr(self, par, values[0])
+
+class ReflectogramPyramid(object):
+    '''
+    Reflectograms (Nbands x bins each) at a base time resolution, base_dt,
+    and at 2, 4, 8, ... x base_dt (levels), each level summing the adjacent
+    pairs of bins of the previous one. As in reflectogram_hist, bin k (k >
+    0) holds the arrivals in [(k - 1) Dt, k Dt) and the arrivals after the
+    last whole bin are dropped: a coarse bin is the sum of whole base bins
+    and the reflectograms at a coarse Dt have the bins of the crossings
+    binned at that Dt (np.arange(0, 1.2 ht_length, Dt)).
+    '''
+    def __init__(self, base_dt, reflectograms):
+        self.base_dt = base_dt
+        self.levels = [tuple(reflectograms)]
+        while self.levels[-1][0].shape[-1] > 2:
+            self.levels.append(tuple(coarsen_bins(reflecto, 2)
+                for reflecto in self.levels[-1]))
+
+    def at(self, Dt):
+        '''The reflectograms at Dt (a multiple of base_dt), from the coarsest
+        level that divides it'''
+        factor = int(round(Dt / self.base_dt))
+        if factor < 1 or abs(Dt - factor * self.base_dt) > 1e-6 * Dt:
+            raise ValueError("Dt = {} is not a multiple of the ".format(Dt) +
+                "base time resolution {}.".format(self.base_dt))
+        level = 0
+        while factor % 2 == 0 and level + 1 < len(self.levels):
+            factor //= 2
+            level += 1
+        if factor == 1:
+            return self.levels[level]
+        return tuple(coarsen_bins(reflecto, factor)
+            for reflecto in self.levels[level])
+
+def coarsen_bins(reflectogram, factor):
+    '''Sums groups of factor adjacent bins of a reflectogram (Nbands x
+    bins), keeping bin 0 (the arrivals before t = 0) apart. A trailing
+    partial group is dropped, as the crossings after the last bin of the
+    coarse time vector are.'''
+    ncoarse = (reflectogram.shape[-1] - 1) // factor
+    groups = reflectogram[..., 1:1 + ncoarse * factor]
+    return np.concatenate((reflectogram[..., :1],
+        groups.reshape(reflectogram.shape[:-1] + (ncoarse, factor)).sum(
+        axis = -1)), axis = -1)
+
+def process_map_results(Dt, ht_length, freq, sources, receiver_map):
+    '''
+    Parameter maps of a receiver grid (see Simulation.set_receiver_grid()),
+    one MapResults per source, from the histograms binned while tracing
+    ('numpy' backend).
+    '''
+    log.info("processing receiver grid maps...")
+    time_bins = np.arange(0.0, 1.2 * ht_length, Dt)
+    maps = []
+    for s in sources:
+        histogram = getattr(s, 'map_histogram', None)
+        if histogram is None:
+            log.info("No receiver grid histograms in the source at " +
+                "({}) [m], use the 'numpy' backend.".format(s.coord))
+            maps.append(None)
+            continue
+        maps.append(MapResults(histogram.hist, time_bins, freq,
+            receiver_map.shape))
+    return maps
+
+class MapResults(object):
+    '''
+    Acoustical parameters of every receiver of a receiver grid, for a
+    source: each parameter is an array with the grid's shape plus the
+    frequency bands (e.g., T30[i, j, k, jf]), NaN for the receivers the
+    source's sound never reached. The reflectograms are the per receiver
+    histograms (Ncells x Nbands x Nbins) of the tracing, binned for a unit
+    source power.
+    '''
+    def __init__(self, hist, time_bins, freq, shape):
+        start_time = time.time()
+        params = ('EDT', 'T20', 'T30', 'C80', 'D50', 'Ts', 'G')
+        values = batch_parameters(time_bins, hist)
+        for par in params:
+            setattr(self, par, values[par].reshape(tuple(shape) +
+                (freq.size,)))
+        log.info(" {} seconds to calc the parameter maps.".format(
+            time.time() - start_time))
 
 def reflectogram_hist(time_bins, time_sorted, intensity_sorted):
     '''
@@ -259,22 +542,15 @@ def g_db(reflectogram, Wlin, freq):
         jf=+1
     return G
 
-def lf_lfc(time, reflectogram, id_dir, freq, time_cat, intensity_cat, cos_cat):
+def lf_lfc(time, reflectogram, id_dir, freq, reflecto_cos2, reflecto_cosabs):
     '''
-    This function is used to calculate LF and LFC
+    This function is used to calculate LF and LFC, from the reflectograms
+    of the intensities times cos^2 (LF) and |cos| (LFC) of the crossings
     '''
-    # bi-directional intensityes for LF
-    intensity_cos2 = np.multiply(intensity_cat, cos_cat**2)
-    # log.info(cos_cat**2)
-    reflecto_cos2 = reflectogram_hist(time, time_cat, intensity_cos2)
-    # bi-directional intensityes for LFC
-    intensity_cosabs = np.multiply(intensity_cat, np.abs(cos_cat))
-    reflecto_cosabs = reflectogram_hist(time, time_cat, intensity_cosabs)
 
     ## The next two lines get direct sound without any information from source and receiver
     LF = np.zeros(freq.size, dtype = np.float32)
     LFC = np.zeros(freq.size, dtype = np.float32)
-    jf = 0
     # log.info("time dir: {}".format(time[id_dir]))
     id_0to80 = np.where(time <= 0.080 + time[id_dir])
     # id_0to800 = np.where(time[id_0to80[0]] >= time[id_0to80[0]])
@@ -284,20 +560,142 @@ def lf_lfc(time, reflectogram, id_dir, freq, time_cat, intensity_cat, cos_cat):
     for jref, ref in enumerate(reflectogram):
         np.seterr(divide = 'ignore')
         try:
-            refcos2 = reflecto_cos2[jf,:]
+            refcos2 = reflecto_cos2[jref,:]
             LF[jref] = 100 * np.sum(refcos2[id_5to80[0]]) / np.sum(ref[id_0to80[0]])
-            refcosabs = reflecto_cosabs[jf,:]
+            refcosabs = reflecto_cosabs[jref,:]
             LFC[jref] = 100 * np.sum(refcosabs[id_5to80[0]]) / np.sum(ref[id_0to80[0]])
         except:
-            log.info("I could not calculate LF and LFC for the {}.".format(freq[jf])+
+            log.info("I could not calculate LF and LFC for the {}.".format(freq[jref])+
                 "[Hz] frequency band. Try to use more rays or"+
                 "extend the length of h(t) of the simmulation.")
-        jf=+1
     return LF, LFC
 
+def stack_reflectograms(reflectograms):
+    '''
+    The reflectograms (Nbands x Nbins each, e.g., the ones of
+    source_reflectograms) of many pairs as one Npairs x Nbands x Nbins
+    array, zero padded to the longest one (the padding changes no parameter)
+    '''
+    nbins = max([r.shape[-1] for r in reflectograms] + [0])
+    stack = np.zeros((len(reflectograms), reflectograms[0].shape[0], nbins)
+        if reflectograms else (0, 0, 0))
+    for jpair, r in enumerate(reflectograms):
+        stack[jpair, :, :r.shape[-1]] = r
+    return stack
+
+def batch_parameters(time_bins, reflectogram, decay = None,
+    reflecto_cos2 = None, reflecto_cosabs = None, power_lin = None):
+    '''
+    The acoustical parameters of many source-receiver pairs and bands at
+    once, without a Python loop over pairs or bands. The decay fits of EDT,
+    T20 and T30 are least squares slopes in closed form: the decay is
+    monotonic, so each fit range is a contiguous run of bins, and the sums
+    of the regression are differences of cumulative sums. The energy ratios
+    (C80, D50, Ts, G, LF and LFC) are differences of cumulative sums of the
+    reflectograms at the bins of their time limits.
+    Inputs:
+        time_bins - a time vector from 0 to 1.2*ht_length in Dt steps
+        reflectogram - Npairs x Nbands x Nbins (see stack_reflectograms)
+        decay - its decay curves (computed if None)
+        reflecto_cos2, reflecto_cosabs - the reflectograms of LF and LFC
+            (no LF and LFC if None)
+        power_lin - the source power per band, Nbands or Npairs x Nbands,
+            of G (1 W if None)
+    Outputs:
+        a dictionary of Npairs x Nbands float32 arrays ('EDT', 'T20', 'T30',
+        'C80', 'D50', 'Ts', 'G' and 'LF', 'LFC'), NaN where a parameter
+        cannot be calculated (no direct sound, less than two points in a
+        fit range, a non decaying fit or a zero energy)
+    '''
+    reflectogram = np.asarray(reflectogram, dtype = np.float64)
+    npairs, nbands, nbins = reflectogram.shape
+    if decay is None:
+        decay = np.cumsum(reflectogram[..., ::-1], axis = -1)[..., ::-1]
+    Dt = time_bins[1] - time_bins[0]
+    time = np.arange(nbins) * Dt
+    # direct sound: the first non zero bin of the first band
+    has_dir = np.any(reflectogram[:, 0, :] != 0, axis = -1)
+    id_dir = np.argmax(reflectogram[:, 0, :] != 0, axis = -1)
+    t_dir = time[id_dir]
+
+    def cumulative(values):
+        '''cumulative sums along the bins, with a leading 0'''
+        cum = np.zeros(values.shape[:-1] + (nbins + 1,))
+        np.cumsum(values, axis = -1, out = cum[..., 1:])
+        return cum
+
+    def at(cum, index):
+        '''cum at a bin (Npairs) or a bin per pair and band (Npairs x
+        Nbands)'''
+        index = np.broadcast_to(np.reshape(index, (npairs, -1)),
+            (npairs, nbands))
+        return np.take_along_axis(cum, index[..., None], axis = -1)[..., 0]
+
+    pars = {}
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        # decay fits, bins k in [k0, k1): 0 > dB > -10 (EDT), -5 > dB > -25
+        # (T20) and -5 > dB > -35 (T30), dB relative to the direct sound
+        decdB = 10 * np.log10(decay / at(np.asarray(decay), id_dir)[..., None])
+        y = np.where(np.isfinite(decdB), decdB, 0.0)
+        cum_y = cumulative(y)
+        cum_ky = cumulative(np.arange(nbins) * y)
+        for par, upper, lower in (('EDT', 0.0, -10.0), ('T20', -5.0, -25.0),
+            ('T30', -5.0, -35.0)):
+            k0 = np.sum(decdB >= upper, axis = -1)
+            k1 = np.maximum(np.sum(decdB > lower, axis = -1), k0)
+            n = (k1 - k0).astype(np.float64)
+            # sums of x = k - k0 and of y (dB) over the range
+            sum_x = n * (n - 1) / 2
+            sum_y = at(cum_y, k1) - at(cum_y, k0)
+            sum_xy = at(cum_ky, k1) - at(cum_ky, k0) - k0 * sum_y
+            slope = (n * sum_xy - sum_x * sum_y) / \
+                (n**2 * (n**2 - 1) / 12) / Dt
+            # a flat range (same dB at both ends) has no slope, whatever
+            # the rounding of the sums
+            flat = at(y, np.minimum(k0, nbins - 1)) == \
+                at(y, np.maximum(k1 - 1, 0))
+            pars[par] = np.where((n >= 2) & ~flat & (slope < 0), -60 / slope,
+                np.nan)
+        # energy ratios
+        cum_r = cumulative(reflectogram)
+        total = cum_r[..., -1]
+        id_80 = np.minimum(np.searchsorted(time, t_dir + 0.080,
+            side = 'right'), nbins)
+        id_50 = np.minimum(np.searchsorted(time, t_dir + 0.050,
+            side = 'right'), nbins)
+        early_80 = at(cum_r, id_80)
+        late_80 = total - early_80
+        pars['C80'] = np.where((early_80 > 0) & (late_80 > 0),
+            10 * np.log10(early_80 / late_80), np.nan)
+        pars['D50'] = np.where(total > 0, 100 * at(cum_r, id_50) / total,
+            np.nan)
+        after_dir = total - at(cum_r, id_dir)
+        cum_tr = cumulative(time * reflectogram)
+        pars['Ts'] = np.where(after_dir > 0, 1000 * ((cum_tr[..., -1] -
+            at(cum_tr, id_dir)) / after_dir - t_dir[:, None]), np.nan)
+        if power_lin is None:
+            power_lin = np.ones(nbands)
+        pars['G'] = np.where(total > 0, 10.0 * np.log10(total) -
+            10.0 * np.log10(np.asarray(power_lin) / (4.0 * np.pi * 100.0)),
+            np.nan)
+        # LF and LFC: the energy from 5 to 80 ms (lateral) over 0 to 80 ms
+        if reflecto_cos2 is not None and reflecto_cosabs is not None:
+            id_5 = np.minimum(np.searchsorted(time, t_dir + 0.005,
+                side = 'left'), id_80)
+            for par, lateral in (('LF', reflecto_cos2),
+                ('LFC', reflecto_cosabs)):
+                cum_l = cumulative(np.asarray(lateral, dtype = np.float64))
+                pars[par] = np.where(early_80 > 0, 100 * (at(cum_l, id_80) -
+                    at(cum_l, id_5)) / early_80, np.nan)
+    for par in pars:
+        pars[par][~has_dir] = np.nan
+        pars[par] = pars[par].astype(np.float32)
+    return pars
+
 class SRStats(object):
     '''
     This class is used to perform statistical analysis on the acoustical parameters
+    (the parameters that cannot be calculated, NaN, are left out)
     '''
     def __init__(self, sou, ci = 1.96):
         # calculate number of sources, receivers and freq bands
@@ -335,27 +733,41 @@ class SRStats(object):
                 self.LF[jc, :] = r.LF
                 self.LFC[jc, :] = r.LFC
                 jc += 1
-        self.EDT_mean_f = np.mean(self.EDT, axis = 0)
-        self.EDT_std_f = np.std(self.EDT, axis = 0)
-        self.T20_mean_f = np.mean(self.T20, axis = 0)
-        self.T20_std_f = np.std(self.T20, axis = 0)
-        self.T30_mean_f = np.mean(self.T30, axis = 0)
-        self.T30_std_f = np.std(self.T30, axis = 0)
-        self.C80_mean_f = np.mean(self.C80, axis = 0)
-        self.C80_std_f = np.std(self.C80, axis = 0)
-        self.D50_mean_f = np.mean(self.D50, axis = 0)
-        self.D50_std_f = np.std(self.D50, axis = 0)
-        self.Ts_mean_f = np.mean(self.Ts, axis = 0)
-        self.Ts_std_f = np.std(self.Ts, axis = 0)
-        self.G_mean_f = np.mean(self.G, axis = 0)
-        self.G_std_f = np.std(self.G, axis = 0)
-        self.LF_mean_f = np.mean(self.LF, axis = 0)
-        self.LF_std_f = np.std(self.LF, axis = 0)
-        self.LFC_mean_f = np.mean(self.LFC, axis = 0)
-        self.LFC_std_f = np.std(self.LFC, axis = 0)
+        self.EDT_mean_f = np.nanmean(self.EDT, axis = 0)
+        self.EDT_std_f = np.nanstd(self.EDT, axis = 0)
+        self.T20_mean_f = np.nanmean(self.T20, axis = 0)
+        self.T20_std_f = np.nanstd(self.T20, axis = 0)
+        self.T30_mean_f = np.nanmean(self.T30, axis = 0)
+        self.T30_std_f = np.nanstd(self.T30, axis = 0)
+        self.C80_mean_f = np.nanmean(self.C80, axis = 0)
+        self.C80_std_f = np.nanstd(self.C80, axis = 0)
+        self.D50_mean_f = np.nanmean(self.D50, axis = 0)
+        self.D50_std_f = np.nanstd(self.D50, axis = 0)
+        self.Ts_mean_f = np.nanmean(self.Ts, axis = 0)
+        self.Ts_std_f = np.nanstd(self.Ts, axis = 0)
+        self.G_mean_f = np.nanmean(self.G, axis = 0)
+        self.G_std_f = np.nanstd(self.G, axis = 0)
+        self.LF_mean_f = np.nanmean(self.LF, axis = 0)
+        self.LF_std_f = np.nanstd(self.LF, axis = 0)
+        self.LFC_mean_f = np.nanmean(self.LFC, axis = 0)
+        self.LFC_std_f = np.nanstd(self.LFC, axis = 0)
         # log.info(self.g_mean_f)
         # log.info(self.g_std_f)
 
+    def set_batch_ci(self, nrays, batch_pars):
+        '''
+        Confidence intervals of a progressive ray tracing (batch means):
+        nrays is the final number of rays and batch_pars the parameters of
+        each batch ({'T30': Nbatches x (Ns*Nrec) x Nf, ...}). It sets the
+        half width of the confidence intervals (ci x standard error of the
+        batches' mean) of each parameter and pair, e.g. T30_ci.
+        '''
+        self.nrays = nrays
+        for par, values in batch_pars.items():
+            values = np.asarray(values)
+            setattr(self, par + '_ci', self.ci * np.nanstd(values, axis = 0,
+                ddof = 1) / np.sqrt(values.shape[0]))
+
     def plot_edt_f(self, ht_max = 4.5, color = 'black', plotsr = False):
         fig = plt.figure()
         fig.canvas.set_window_title("EDT vs. freq")
@@ -630,21 +1042,22 @@ class SRStats(object):
     
 ###########################################################
 def concatenate_tarray(jrec, srays, time_dir):
-    time_cat = []
-    time_cat.append(time_dir)
-    for ray in srays:
-        time_cross = ray.recs[jrec].time_cross
-        time_cat.extend(time_cross)
-    return time_cat
+    '''Direct sound and reflections time of arrival at receiver jrec'''
+    return np.concatenate([np.float32([time_dir])] +
+        [ray.recs[jrec].time_cross for ray in srays]).astype(np.float32)
 
 def concatenate_iarray(jrec, srays, i_dir):
-    intensity_cat = []
-    intensity_cat = np.array(i_dir, dtype = np.float32) # np.zeros((8,1), dtype = np.float32)#
-    intensity_cat = intensity_cat.reshape(len(i_dir),1)
-    for ray in srays:
-        i_cross = np.array(ray.recs[jrec].i_cross, dtype = np.float32)
-        intensity_cat = np.hstack((intensity_cat, i_cross))
-    return intensity_cat
+    '''Direct sound and reflections intensities (vs. freq) at receiver
+    jrec'''
+    i_dir = np.array(i_dir, dtype = np.float32).reshape(-1, 1)
+    return np.concatenate([i_dir] +
+        [np.reshape(ray.recs[jrec].i_cross, (len(i_dir), -1))
+        for ray in srays], axis = 1).astype(np.float32)
+
+def concatenate_cosarray(jrec, srays, cos_dir):
+    '''Direct sound and reflections crossing angles at receiver jrec'''
+    return np.concatenate([np.float32([cos_dir])] +
+        [ray.recs[jrec].cos_cross for ray in srays]).astype(np.float32)
 
 class SouResults(object):
     '''
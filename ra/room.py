@@ -7,7 +7,7 @@ import matplotlib.pyplot as plt
 import scipy.io as spio
 
 from ra.log import log
-import ra_cpp
+from ra.cpp_extension import ra_cpp
 
 class GeometryApi():
     def __init__(self, geom_dict):
@@ -40,7 +40,7 @@ class GeometryApi():
             ##############################################################
             centroid = np.float32(triangle_centroid(geom_dict[jp]['vertices']))
             # plane object
-            plane = ra_cpp.Planecpp(geom_dict[jp]['name'],
+            plane = new_plane(geom_dict[jp]['name'],
                 geom_dict[jp]['bbox'],
                 geom_dict[jp]['vertices'],
                 geom_dict[jp]['normal'],
@@ -94,7 +94,7 @@ class GeometryMat():
             ################### cpp plane class #################
             # log.info(jp)
             # log.info(normal_nig)
-            plane = ra_cpp.Planecpp(name, False, vertices, normal,
+            plane = new_plane(name, False, vertices, normal,
                 vert_x, vert_y, normal_nig, area, centroid,
                 alpha_v, s[jp])
             ################### py plane class ################
@@ -234,7 +234,7 @@ class Geometry():
                     centroid = np.float32(triangle_centroid(vertices))
                     alpha_v = np.float32(alpha[jp])
                     ################### cpp plane class #################
-                    plane = ra_cpp.Planecpp(name, False, vertices, normal,
+                    plane = new_plane(name, False, vertices, normal,
                         vert_x, vert_y, normal_nig, area, centroid,
                         alpha_v, s[jp])
                     ################### py plane class ################
@@ -311,6 +311,18 @@ class PyPlane():
         self.alpha = np.array(alpha, np.float32)
         self.s = s
 
+def new_plane(name, bbox, vertices, normal, vert_x, vert_y, nig, area,
+    centroid, alpha, s):
+    '''
+    A c++ plane object (ra_cpp.Planecpp) or, if ra_cpp is not installed,
+    a PyPlane with the same att (for the numpy backend).
+    '''
+    if ra_cpp is None:
+        return PyPlane(name, bbox, vertices, normal, vert_x, vert_y, nig,
+            area, centroid, alpha, s)
+    return ra_cpp.Planecpp(name, bbox, vertices, normal, vert_x, vert_y,
+        nig, area, centroid, alpha, s)
+
 def vert_2d(normal, vertcoord):
     '''
     Function to transform the 3D plane to 2D.
@@ -121,3 +121,146 @@ def ray_x_sphere(r0, rd, sc, sr):
                 ri = r0 + rd*t  # the intersection point
                 return ri, True
     return np.inf, False
+
+
+def pack_polygons(polygons):
+    '''Packs a list of polygons with possibly different number of vertices
+    into a single array, so they can be tested against many rays at once.
+    Polygons with less vertices than the largest one are padded by repeating
+    their last vertex; the repeated vertices produce zero length edges that
+    never count as crossings in `points_in_polygons()`.
+
+    Parameters
+    ----------
+    polygons: a list of numpy.ndarray's with shape (N, 3) representing the
+        polygons' vertices.
+
+    Returns
+    -------
+    A numpy.ndarray with shape (P, V, 3), where P is the number of polygons
+    and V the number of vertices of the largest polygon.
+    '''
+    nverts = max(len(p) for p in polygons)
+    packed = np.zeros((len(polygons), nverts, 3), dtype=np.float32)
+    for jp, poly in enumerate(polygons):
+        poly = np.asarray(poly, dtype=np.float32)
+        packed[jp, :len(poly)] = poly
+        packed[jp, len(poly):] = poly[-1]
+    return packed
+
+
+def points_in_polygons(ri, poly_verts, pn):
+    '''Batched version of `point_in_polygon()`. All the arguments broadcast
+    against each other, so the same call tests one point against many
+    polygons, many points against one polygon or every point against every
+    polygon (e.g. `ri` with shape (R, 1, 3) and `poly_verts` with shape
+    (1, P, V, 3)).
+
+    Parameters
+    ----------
+    ri: a numpy.ndarray with shape (..., 3) representing the points
+        coordinates.
+    poly_verts: a numpy.ndarray with shape (..., V, 3) representing the
+        polygons' vertices (see `pack_polygons()`).
+    pn: a numpy.ndarray with shape (..., 3) representing the polygons' normal
+        vectors.
+
+    Returns
+    -------
+    A boolean numpy.ndarray with the broadcast shape of the inputs, True where
+    the point is inside the polygon.
+    '''
+    # the two coordinates kept after throwing away the largest normal
+    # component, the same projection used by `point_in_polygon()`
+    throw_away = np.argmax(np.abs(pn), axis=-1)[..., None]
+    uv = poly_verts - ri[..., None, :]
+    u = np.where(throw_away == 0, uv[..., 1], uv[..., 0])
+    v = np.where(throw_away == 2, uv[..., 1], uv[..., 2])
+    # next vertex of every edge
+    nu = np.roll(u, -1, axis=-1)
+    nv = np.roll(v, -1, axis=-1)
+    crosses = (v < 0) != (nv < 0)
+    both_right = (u > 0) & (nu > 0)
+    one_right = (u > 0) | (nu > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_cross = u - v * (nu - u) / (nv - v)
+    hit = crosses & (both_right | (one_right & (x_cross > 0)))
+    return np.count_nonzero(hit, axis=-1) % 2 == 1
+
+
+def rays_x_polygons(r0, rd, poly_verts, pn, tol=1e-6):
+    '''Batched version of `ray_x_polygon()`. The arguments broadcast against
+    each other in the same way as in `points_in_polygons()`, so passing rays
+    with shape (R, 1, 3) and polygons with shape (1, P, V, 3) returns the full
+    ray x polygon distance matrix.
+
+    Parameters
+    ----------
+    r0: a numpy.ndarray with shape (..., 3) representing the rays' origins
+    rd: a numpy.ndarray with shape (..., 3) representing the rays' directions
+    poly_verts: a numpy.ndarray with shape (..., V, 3) representing the
+        polygons' vertices (see `pack_polygons()`).
+    pn: a numpy.ndarray with shape (..., 3) representing the polygons' normal
+        vectors.
+    tol: check function `ray_x_plane()` parameters.
+
+    Returns
+    -------
+    A 3-tuple with the distances from the rays' origins to the intersection
+    points (`inf` where there is no hit), the intersection points and a
+    boolean array set to True where the ray intersects the polygon.
+    '''
+    vd = np.sum(pn * rd, axis=-1)
+    v0 = np.sum(pn * (poly_verts[..., 0, :] - r0), axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = v0 / vd
+    # same rejections as `ray_x_plane()`: parallel rays and intersections
+    # too close to (or behind) the ray origin
+    t = np.where((np.abs(vd) < tol) | ~(t >= 1e-3), np.inf, t)
+    is_plane_hit = np.isfinite(t)
+    with np.errstate(invalid='ignore'):
+        ri = r0 + rd * np.where(is_plane_hit, t, 0)[..., None]
+    is_inside = is_plane_hit & points_in_polygons(ri, poly_verts, pn)
+    return np.where(is_inside, t, np.inf), ri, is_inside
+
+
+def nearest_polygons(r0, rd, poly_verts, pn, chunk_size=4096, tol=1e-6):
+    '''Finds, for every ray, the nearest polygon it intersects by building the
+    full ray x polygon distance matrix (in chunks of `chunk_size` rays to
+    bound the memory) and taking its argmin.
+
+    Parameters
+    ----------
+    r0: a numpy.ndarray with shape (R, 3) representing the rays' origins
+    rd: a numpy.ndarray with shape (R, 3) representing the rays' directions
+    poly_verts: a numpy.ndarray with shape (P, V, 3) representing the
+        polygons' vertices (see `pack_polygons()`).
+    pn: a numpy.ndarray with shape (P, 3) representing the polygons' normal
+        vectors.
+    chunk_size: an integer, the maximum number of rays tested at once.
+    tol: check function `ray_x_plane()` parameters.
+
+    Returns
+    -------
+    A 3-tuple with the index of the nearest polygon (-1 if the ray misses
+    every polygon), the distance to it and the intersection point, with shapes
+    (R,), (R,) and (R, 3).
+    '''
+    nrays = r0.shape[0]
+    ids = np.full(nrays, -1, dtype=np.int64)
+    ts = np.full(nrays, np.inf, dtype=np.float32)
+    ris = np.full((nrays, 3), np.inf, dtype=np.float32)
+    for start in range(0, nrays, chunk_size):
+        sl = slice(start, start + chunk_size)
+        t, ri, hit = rays_x_polygons(
+            r0[sl, None], rd[sl, None], poly_verts[None], pn[None], tol
+        )
+        # ties are resolved in favour of the first polygon, as in the loop
+        # implementation that only replaces a hit by a strictly closer one
+        nearest = np.argmin(t, axis=1)
+        rows = np.arange(nearest.size)
+        is_hit = hit[rows, nearest]
+        ids[sl] = np.where(is_hit, nearest, -1)
+        ts[sl] = t[rows, nearest]
+        ris[sl] = np.where(is_hit[:, None], ri[rows, nearest], np.inf)
+    return ids, ts, ris
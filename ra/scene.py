@@ -0,0 +1,290 @@
+import hashlib
+
+import numpy as np
+
+from ra.bvh import BVH, BVH_MIN_PLANES
+import ra.rtrace as rt
+
+class CompiledScene():
+    '''
+    A structure-of-arrays representation of the room geometry, built once
+    from `GeometryApi`, `GeometryMat` or `Geometry` and consumed by the
+    direct sound, ray tracing and intensity stages. It has the following
+    att (P planes, V vertices of the largest plane, B frequency bands):
+    - vertices - packed vertices, see `rtrace.pack_polygons()` (P x V x 3)
+    - nverts - number of vertices of each plane (P)
+    - normals - planes' normal vectors (P x 3)
+    - offsets - planes' offsets, n . x = offset for any point x of the plane,
+        taken from the third vertex as in `Planecpp.refpoint3d` (P)
+    - nig - 2D normal components index, as in `room.vert_2d()` (P x 2)
+    - is_convex - True for convex planes (P)
+    - edges - edge equations (a, b, c) of the convex planes in the 2D
+        projection: a point (u, v) is inside if a*u + b*v + c >= 0 for every
+        edge; padding edges are always satisfied (P x V x 3)
+    - fans - edge equations of the triangle fan of the non-convex planes: a
+        point is inside if it is inside an odd number of fan triangles
+        (P x F x 3 x 3, with F = 0 when all planes are convex)
+    - alpha - absorption coefficients (P x B)
+    - s - scattering coefficients (P)
+    - area - planes' areas (P)
+    - volume, total_area - of the whole room
+
+    The arrays are read only and the scene is hashable, so the same compiled
+    scene can be reused across sources, reruns and worker processes.
+    '''
+    _fields = ('vertices', 'nverts', 'normals', 'offsets', 'nig',
+        'is_convex', 'edges', 'fans', 'alpha', 's', 'area')
+
+    def __init__(self, vertices, nverts, normals, nig, alpha, s, area,
+        volume, total_area):
+        vertices = np.asarray(vertices, dtype=np.float32)
+        normals = np.asarray(normals, dtype=np.float32)
+        nverts = np.asarray(nverts, dtype=np.int64)
+        nig = np.asarray(nig, dtype=np.int64)
+        third = vertices[np.arange(len(vertices)), np.minimum(nverts - 1, 2)]
+        offsets = np.sum(normals * third, axis=1)
+        # 2D projection of the vertices
+        rows = np.arange(len(vertices))[:, None, None]
+        cols = np.arange(vertices.shape[1])[None, :, None]
+        verts_2d = vertices[rows, cols, nig[:, None, :]]
+        is_convex = np.array([polygon_is_convex(verts_2d[jp, :nv])
+            for jp, nv in enumerate(nverts)], dtype=bool)
+        edges = polygon_edges(verts_2d, nverts)
+        fans = fan_edges(verts_2d, nverts, ~is_convex)
+        self.__dict__.update(dict(vertices=vertices, nverts=nverts,
+            normals=normals, offsets=offsets.astype(np.float32), nig=nig,
+            is_convex=is_convex, edges=edges, fans=fans,
+            alpha=np.asarray(alpha, dtype=np.float32),
+            s=np.asarray(s, dtype=np.float32),
+            area=np.asarray(area, dtype=np.float64),
+            volume=float(volume), total_area=float(total_area)))
+        self._freeze()
+
+    @classmethod
+    def from_geometry(cls, geometry):
+        '''Compiles the planes of a `GeometryApi`, `GeometryMat` or
+        `Geometry` object'''
+        planes = geometry.planes
+        vertices = rt.pack_polygons([plane.vertices for plane in planes])
+        return cls(vertices,
+            [len(plane.vertices) for plane in planes],
+            [plane.normal for plane in planes],
+            [plane.nig for plane in planes],
+            [plane.alpha for plane in planes],
+            [plane.s for plane in planes],
+            [plane.area for plane in planes],
+            geometry.volume, geometry.total_area)
+
+    def with_materials(self, alpha, s):
+        '''
+        The scene with the absorption (P x B) and scattering (P) coefficients
+        alpha and s, e.g. the ones of the geometry's planes after a material
+        change, sharing the planes' arrays and bounding volume hierarchy
+        (the scene itself if the coefficients did not change)
+        '''
+        alpha = np.asarray(alpha, dtype=np.float32)
+        s = np.asarray(s, dtype=np.float32)
+        if np.array_equal(alpha, self.alpha) and np.array_equal(s, self.s):
+            return self
+        scene = CompiledScene.__new__(CompiledScene)
+        scene.__dict__.update(self.__getstate__(), alpha=alpha, s=s)
+        scene._freeze(self.bvh)
+        return scene
+
+    def _freeze(self, bvh=None):
+        for name in self._fields:
+            getattr(self, name).flags.writeable = False
+        self.__dict__['digest'] = self._digest()
+        # nearest plane queries (derived data, not part of the digest)
+        if bvh is None and self.nplanes > BVH_MIN_PLANES:
+            bvh = BVH(self.vertices, self.normals)
+        self.__dict__['bvh'] = bvh
+
+    def _digest(self):
+        sha = hashlib.sha1()
+        for name in self._fields:
+            array = np.ascontiguousarray(getattr(self, name))
+            sha.update(name.encode())
+            sha.update(str(array.shape).encode())
+            sha.update(array.tobytes())
+        sha.update(np.float64([self.volume, self.total_area]).tobytes())
+        return sha.hexdigest()
+
+    def __setattr__(self, name, value):
+        raise AttributeError('CompiledScene is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('CompiledScene is immutable')
+
+    def __hash__(self):
+        return hash(self.digest)
+
+    def __eq__(self, other):
+        return isinstance(other, CompiledScene) and \
+            self.digest == other.digest
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['bvh'], state['digest']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._freeze()
+
+    @property
+    def nplanes(self):
+        return len(self.normals)
+
+    @property
+    def nbands(self):
+        return self.alpha.shape[1]
+
+    def points_in_planes(self, ri, planes):
+        '''
+        Point in polygon test of the points `ri` (shape (..., 3)) against the
+        planes with indexes `planes` (same shape as `ri[..., 0]`), using the
+        precomputed edge equations (convex planes) or triangle fans.
+        '''
+        uv = np.take_along_axis(ri, self.nig[planes], axis=-1)
+        u, v = uv[..., 0, None], uv[..., 1, None]
+        edges = self.edges[planes]
+        inside = np.all(edges[..., 0] * u + edges[..., 1] * v +
+            edges[..., 2] >= 0, axis=-1)
+        if self.fans.shape[1] > 0:
+            fans = self.fans[planes]
+            in_tri = np.all(fans[..., 0] * u[..., None] +
+                fans[..., 1] * v[..., None] + fans[..., 2] >= 0, axis=-1)
+            in_fan = np.count_nonzero(in_tri, axis=-1) % 2 == 1
+            inside = np.where(self.is_convex[planes], inside, in_fan)
+        return inside
+
+    def rays_x_planes(self, r0, rd, planes, exclude=None):
+        '''
+        Intersection of the rays `r0`/`rd` (shapes (n, 3)) with the planes
+        `planes` (shape (n, L)), with the same rules as the ray tracer
+        (`Raycpp.plane_finder`): the plane must be ahead of the ray, at least
+        1e-6 m away and different from the plane the ray leaves (`exclude`,
+        shape (n,), -1 for none).
+
+        Returns
+        -------
+        A 3-tuple with the distances (inf where there is no hit), the
+        intersection points and the hit flags, with shapes (n, L), (n, L, 3)
+        and (n, L).
+        '''
+        normals = self.normals[planes]
+        r0 = r0[:, None]
+        rd = rd[:, None]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = (self.offsets[planes] - np.sum(normals * r0, axis=-1)) / \
+                np.sum(normals * rd, axis=-1)
+        hit = np.isfinite(t) & (t >= 1e-6)
+        if exclude is not None:
+            hit &= planes != exclude[:, None]
+        t = np.where(hit, t, np.inf)
+        with np.errstate(invalid='ignore'):
+            ri = r0 + rd * np.where(hit, t, 0)[..., None]
+        hit &= self.points_in_planes(ri, planes)
+        return np.where(hit, t, np.inf), ri, hit
+
+    def nearest(self, r0, rd, exclude=None, chunk_size=4096):
+        '''
+        Finds the nearest plane hit by each ray (ties are resolved in favour
+        of the first plane, as in the tracer), with the bounding volume
+        hierarchy for large scenes or a chunked linear scan otherwise.
+
+        Parameters
+        ----------
+        r0: a numpy.ndarray with shape (R, 3) representing the rays' origins
+        rd: a numpy.ndarray with shape (R, 3) representing the rays'
+            directions (unit vectors)
+        exclude: an optional numpy.ndarray with shape (R,) with the plane
+            each ray is leaving (-1 for none).
+        chunk_size: an integer, the maximum number of rays tested at once by
+            the linear scan.
+
+        Returns
+        -------
+        A 3-tuple with the index of the nearest plane (-1 if the ray misses
+        every plane), the distance to it (inf for a miss) and the
+        intersection point, with shapes (R,), (R,) and (R, 3).
+        '''
+        r0 = np.asarray(r0, dtype=np.float32)
+        rd = np.asarray(rd, dtype=np.float32)
+        if self.bvh is not None:
+            test = lambda rays, planes: self.rays_x_planes(r0[rays],
+                rd[rays], planes,
+                None if exclude is None else exclude[rays])
+            return self.bvh.nearest(r0, rd, test=test)
+        nrays = r0.shape[0]
+        ids = np.full(nrays, -1, dtype=np.int64)
+        ts = np.full(nrays, np.inf, dtype=np.float32)
+        ris = np.full((nrays, 3), np.inf, dtype=np.float32)
+        all_planes = np.arange(self.nplanes)
+        for start in range(0, nrays, chunk_size):
+            sl = slice(start, start + chunk_size)
+            n = r0[sl].shape[0]
+            t, ri, hit = self.rays_x_planes(r0[sl], rd[sl],
+                np.broadcast_to(all_planes, (n, self.nplanes)),
+                None if exclude is None else exclude[sl])
+            nearest = np.argmin(t, axis=1)
+            rows = np.arange(n)
+            is_hit = hit[rows, nearest]
+            ids[sl] = np.where(is_hit, nearest, -1)
+            ts[sl] = t[rows, nearest]
+            ris[sl] = np.where(is_hit[:, None], ri[rows, nearest], np.inf)
+        return ids, ts, ris
+
+def polygon_is_convex(verts_2d):
+    '''True if the 2D polygon turns always to the same side'''
+    edge = np.roll(verts_2d, -1, axis=0) - verts_2d
+    cross = edge[:, 0] * np.roll(edge[:, 1], -1) - \
+        edge[:, 1] * np.roll(edge[:, 0], -1)
+    cross = cross[np.abs(cross) > 1e-12 * np.max(np.abs(verts_2d))**2]
+    return bool(np.all(cross > 0) or np.all(cross < 0))
+
+def polygon_edges(verts_2d, nverts):
+    '''
+    Edge equations (a, b, c) of each 2D polygon, oriented so that the
+    interior has a*u + b*v + c >= 0. The padded vertices give the neutral
+    edge (0, 0, 1).
+    '''
+    nplanes, nv = verts_2d.shape[:2]
+    edges = np.zeros((nplanes, nv, 3), dtype=np.float32)
+    edges[..., 2] = 1
+    for jp in range(nplanes):
+        poly = verts_2d[jp, :nverts[jp]].astype(np.float64)
+        edges[jp, :nverts[jp]] = line_equations(poly, np.roll(poly, -1,
+            axis=0), signed_area(poly))
+    return edges
+
+def fan_edges(verts_2d, nverts, planes_mask):
+    '''
+    Edge equations of the triangle fans (v0, vi, vi+1) of the planes in
+    `planes_mask`, shape (P, F, 3, 3). Unused fan triangles never contain a
+    point (edge (0, 0, -1)).
+    '''
+    nfans = max([nverts[jp] - 2 for jp in np.nonzero(planes_mask)[0]] + [0])
+    fans = np.zeros((len(verts_2d), nfans, 3, 3), dtype=np.float32)
+    fans[..., 2] = -1
+    for jp in np.nonzero(planes_mask)[0]:
+        poly = verts_2d[jp, :nverts[jp]].astype(np.float64)
+        for jt in range(nverts[jp] - 2):
+            tri = poly[[0, jt + 1, jt + 2]]
+            fans[jp, jt] = line_equations(tri, np.roll(tri, -1, axis=0),
+                signed_area(tri))
+    return fans
+
+def line_equations(p0, p1, orientation):
+    '''(a, b, c) of the lines through p0 and p1, positive on the left side
+    (on the right side for a negative orientation)'''
+    a = -(p1[:, 1] - p0[:, 1])
+    b = p1[:, 0] - p0[:, 0]
+    c = -(a * p0[:, 0] + b * p0[:, 1])
+    sign = 1.0 if orientation >= 0 else -1.0
+    return sign * np.stack((a, b, c), axis=1)
+
+def signed_area(poly):
+    return 0.5 * np.sum(poly[:, 0] * np.roll(poly[:, 1], -1) -
+        np.roll(poly[:, 0], -1) * poly[:, 1])
@@ -1,21 +1,28 @@
 import numpy as np
 import matplotlib.pyplot as plt
 import math
+import time
 import xlrd, xlwt
 from xlwt import Workbook 
 import csv
+from ra.log import log
 from ra.rayinidir import RayInitialDirections
 from ra.receivers import setup_receivers
+from ra.receiver_grid import ReceiverMap
+from ra.checkpoint import Checkpoint
+from ra.path_store import PathStore
+from ra.memory_plan import MemoryPlan, history_bytes
 from ra.sources import setup_sources
 from ra.controlsair import AlgControls, AirProperties
 from ra.room import Geometry, GeometryMat
 from ra.absorption_database import load_matdata_from_mat, get_alpha_s
 from ra.statistics import StatisticalMat
-from ra.ray_initializer import ray_initializer
-from ra.results import process_results, SRStats
-import ra_cpp
+from ra.results import process_results, process_map_results, SRStats, \
+    SouResults, RecResults
+from ra.backends import get_backend, default_backend
 # from ra.room import vert_2d, triangle_area, triangle_centroid
 from ra.room import GeometryApi
+from ra.scene import CompiledScene
 from ra.rayinidir import RayInitialDirections
 
 class Simulation():
@@ -28,6 +35,141 @@ class Simulation():
             'C80': '[dB]', 'D50': '[%]', 'Ts': '[ms]',
             'G': '[dB]', 'LF': '[%]', 'LFC': '[%]'}
         # self.geometry = {}
+        self.set_backend(default_backend())
+        self.wavefront = None
+        self.receiver_map = None
+        self.streaming = None
+        self.compact = False
+        self.max_memory = None
+        self.memory_plan = None
+        self.progressive = None
+        self.checkpoint = None
+        self.path_store = None
+
+    def set_backend(self, name):
+        '''
+        Choose the calculation backend of direct sound, ray tracing and
+        intensities. It must be called before set_receivers and set_sources,
+        since receivers and sources are backend objects.
+        Parameters:
+        ----------
+            name: 'cpp' (ra_cpp module, the default when installed) or
+            'numpy' (pure NumPy engine, see ra.numpy_engine)
+        '''
+        self.backend = get_backend(name)
+
+    def set_wavefront(self, on = True, energy_floor_dB = -70.0, roulette = 0.0):
+        '''
+        Turn on (or off) the wavefront mode of the 'numpy' backend ray
+        tracing. Besides the rays escaping the room, the tracer stops (and
+        removes from the next reflection orders) the rays:
+            - that travelled longer than the reflectograms' length
+            (1.2 x ht_length), which can not add to the results anymore;
+            - whose energy (a per band vector with the reflection and air
+            losses) is below energy_floor_dB in all bands, relative to their
+            initial energy (None to keep them).
+        With roulette = p > 0 the rays below the energy floor play Russian
+        roulette: they survive with probability p, with their energy
+        weighted by 1/p, so the sound intensities stay unbiased (use, e.g.,
+        energy_floor_dB = -40 and roulette = 0.1).
+        The number of rays alive at each reflection order is logged and
+        kept in each source (alive_per_order).
+        '''
+        if on:
+            self.wavefront = {'energy_floor_dB': energy_floor_dB,
+                'roulette': roulette}
+        else:
+            self.wavefront = None
+
+    def set_streaming(self, on = True, chunk_rays = 10000):
+        '''
+        Turn on (or off) the streaming mode of the 'numpy' backend ray
+        tracing. Every receiver crossing is binned, as it happens, into the
+        reflectograms of its source-receiver pair (per band, and the cos^2
+        and |cos| weighted ones of LF and LFC), instead of being kept per
+        ray and receiver until the results. The rays are traced in chunks of
+        chunk_rays, so the memory (8 bytes x 3 x receivers x bands x time
+        bins per source, plus a chunk of rays) does not grow with the number
+        of rays. The results are the ones of a run that keeps the crossings.
+        The sources keep no rays nor crossings: new materials or air (e.g.,
+        run_intensitycalc, sweep_materials, update_air and save_paths) need
+        a new ray tracing.
+        '''
+        if on:
+            self.streaming = {'chunk_rays': chunk_rays}
+        else:
+            self.streaming = None
+
+    def set_compact(self, on = True):
+        '''
+        Turn on (or off) the compact storage of the 'numpy' backend
+        crossings, encoded as they are traced. Each crossing keeps, instead
+        of its time, cosine and float32 intensities, the uint32 time bin of
+        the results (Dt and ht_length as when the rays are traced), an int8
+        cosine (steps of 1/127) and log quantized uint16 intensities (a
+        relative error below 1e-3), with int32 ray and receiver indexes:
+        about 40% less memory with 6 bands. The reflectograms are binned
+        from the stored bins; the air absorption and a new Dt or ht_length
+        use the bins' centres as the crossing times.
+        '''
+        self.compact = bool(on)
+
+    def set_max_memory(self, max_memory = None):
+        '''
+        Set a memory budget for the ray tracing runs ('numpy' backend). Before
+        each run a MemoryPlan (see ra.memory_plan) predicts its peak memory
+        from the number of rays, N_max_ref, receivers, sources, bands and the
+        receivers' expected crossings (mean free path and receivers' radii)
+        and, if it does not fit, the run keeps its crossings compact (see
+        set_compact) or else streams the rays in the largest chunks that fit
+        (see set_streaming), the chunks' crossings binned into the same
+        reflectograms. The plan of the last run is kept in memory_plan.
+        Parameters:
+        -----------
+            max_memory: the budget in bytes (None for no budget)
+        '''
+        self.max_memory = max_memory
+
+    def memory_estimate(self,):
+        '''
+        The MemoryPlan (see ra.memory_plan) of a run with the current rays,
+        receivers, sources and memory budget. Its peak is the predicted peak
+        memory [bytes] and parts its breakdown.
+        '''
+        return MemoryPlan(self, self.max_memory)
+
+    def set_progressive(self, on = True, batch_rays = 1000, tolerances = None,
+        time_budget = None, max_rays = 100000, min_batches = 3):
+        '''
+        Turn on (or off) the progressive mode of run_raytracing. The rays are
+        traced in batches of batch_rays (new directions of set_raydir's
+        method and fresh sources at each batch, the receiver growth of a
+        batch_rays simulation) and the reflectograms of every
+        source-receiver pair are accumulated batch by batch. The tracing
+        stops, after at least min_batches:
+            - when the confidence intervals (batch means) of the
+            parameters in tolerances, of every pair and band, are within
+            their tolerance: a dictionary of absolute tolerances for the
+            [dB] parameters and relative ones for the others (default:
+            {'T30': 0.02, 'EDT': 0.02, 'C80': 0.5}). A decay fit that
+            fails in some batches keeps the interval wide, leave its
+            parameter out (or rely on the time and ray budgets);
+            - when the next batch would end after time_budget [s] (None for
+            no time limit);
+            - when the next batch would pass max_rays.
+        The parameters (sr_results and stats) are the ones of the
+        accumulated reflectograms. stats.nrays holds the number of rays
+        traced and stats.T30_ci, stats.EDT_ci, ... the half width of the
+        confidence intervals (stats.ci x standard error) per pair and band.
+        '''
+        if on:
+            if tolerances is None:
+                tolerances = {'T30': 0.02, 'EDT': 0.02, 'C80': 0.5}
+            self.progressive = {'batch_rays': batch_rays,
+                'tolerances': tolerances, 'time_budget': time_budget,
+                'max_rays': max_rays, 'min_batches': min_batches}
+        else:
+            self.progressive = None
 
     def set_configs(self, config):
         '''
@@ -116,15 +258,66 @@ class Simulation():
         -----------
             geom_dict: list of dicts with the following parameters: 'name',
             'vertices', 'normal', alpha, s.
+        The planes are also compiled once into a CompiledScene (packed
+        arrays), shared by the direct sound, ray tracing and intensity stages.
         '''
         self.geometry = GeometryApi(geom_dict)
+        self.scene = CompiledScene.from_geometry(self.geometry)
 
-    def set_raydir(self,):
+    def set_raydir(self, method = 'random'):
+        '''
+        Set up the initial ray directions (n_rays of them).
+        Parameters:
+        -----------
+            method: 'random' (i.i.d. random directions), 'sobol' (scrambled
+            Sobol points), 'fibonacci' (randomly rotated Fibonacci lattice)
+            or 'equal_area' (randomly rotated equal area partition). The
+            last three are low discrepancy sets whose randomization gives
+            independent replicas, see run_replicas.
+        '''
         self.rays_v = RayInitialDirections()
         # FIXME - here there is some deoendence on user interface
         # (will it be allowed to change the type of sound source?)
         # if so, we must increment this in the near future
-        self.rays_v.random_rays(self.Nrays)
+        generators = {'random': self.rays_v.random_rays,
+            'sobol': self.rays_v.sobol_rays,
+            'fibonacci': self.rays_v.fibonacci_rays,
+            'equal_area': self.rays_v.equal_area_rays}
+        if method not in generators:
+            raise ValueError("Unknown ray directions method '{}'. ".format(
+                method) + "Valid methods are: {}".format(', '.join(generators)))
+        self.raydir_method = method
+        generators[method](self.Nrays)
+
+    def set_checkpoint(self, path, every_rays = 1000, resume = False):
+        '''
+        Checkpoint the ray tracing ('numpy' backend) to compressed .npz
+        files: the rays of each source are traced in chunks of every_rays,
+        each chunk is saved once and the run state (cursor, numpy's random
+        state and a digest of the configuration) after each chunk. With
+        resume = True a run continues from the checkpoint (if it exists),
+        with its ray directions, and its results are the ones of an
+        uninterrupted run with the same every_rays. The chunks draw the
+        random numbers in another order, so, for the same seed, they are not
+        the results of a run without checkpoints (see ra.checkpoint). The
+        checkpoint is deleted once the ray tracing is complete. Call it
+        after set_raydir.
+        Parameters:
+        -----------
+            path: the checkpoint file (None to turn checkpoints off)
+            every_rays: rays of a source traced between checkpoints
+            resume: continue from the checkpoint file (the ray tracing
+            raises a ValueError if it is of another configuration)
+        '''
+        if path is None:
+            self.checkpoint = None
+            return
+        self.checkpoint = Checkpoint(path, every_rays, resume)
+        if self.checkpoint.v_init is not None:
+            if self.checkpoint.v_init.shape != self.rays_v.vinit.shape:
+                raise ValueError("The checkpoint {} has {} rays, not {}.".format(
+                    path, self.checkpoint.v_init.shape[0], self.rays_v.Nrays))
+            self.rays_v.vinit = self.checkpoint.v_init
 
     def set_receivers(self, recs):
         '''
@@ -165,21 +358,45 @@ class Simulation():
             # print(orientation)
             ################### cpp receiver class #################
             self.receivers.append(
-                ra_cpp.Receivercpp(r['coord'], r['orientation'])) # FIXME orientation is returning zeros from c++Append the receiver object
+                self.backend.Receiver(r['coord'], r['orientation'])) # FIXME orientation is returning zeros from c++Append the receiver object
             self.reccross.append(
-                ra_cpp.RecCrosscpp([], [], [], [])) # Append the reccross object
+                self.backend.RecCross([], [], [], [])) # Append the reccross object
             self.reccrossdir.append(
-                ra_cpp.RecCrossDircpp(0, 0.0, 0, 0.0))
+                self.backend.RecCrossDir(0, 0.0, 0, 0.0))
+
+    def set_receiver_grid(self, origin, spacing, shape):
+        '''
+        Set up a regular grid of receivers for parameter maps (e.g., T30,
+        C80 and D50 over an audience area), traced together with the
+        receivers of set_receivers ('numpy' backend). The grid receivers keep
+        no crossings: their energies are binned while tracing into per
+        receiver and per band histograms (memory: 8 bytes x receivers x
+        bands x time bins per source). After run_raytracing, map_results
+        holds a MapResults per source, with each parameter as an array with
+        the grid's shape plus the frequency bands.
+        Parameters:
+        -----------
+            origin: the position of the first receiver (x, y, z) [m]
+            spacing: the distance between receivers [m], a scalar or one per
+            axis
+            shape: the number of receivers along each axis (nx, ny, nz), use
+            nz = 1 for a horizontal plane
+        '''
+        self.receiver_map = ReceiverMap(origin, spacing, shape)
 
     def set_memory_init(self,):
         '''
         Initialize memory allocation from python side, so c++ can calculate
         '''
         # Estimate max reflection order
-        N_max_ref = math.ceil(1.5 * self.c0 * self.ht_length * \
+        self.N_max_ref = math.ceil(1.5 * self.c0 * self.ht_length * \
             (self.geometry.total_area / (4 * self.geometry.volume)))
+        log.info("Rays histories: {:.1f} MB per source".format(
+            history_bytes(self.rays_v.Nrays, self.N_max_ref,
+            self.transition_order + 2) / 1e6))
         # Allocate according to max reflection order
-        self.rays = ray_initializer(self.rays_v, N_max_ref, self.transition_order, self.reccross)
+        self.rays = self.backend.init_rays(self.rays_v, self.N_max_ref,
+            self.transition_order, self.reccross)
 
     def set_sources(self, srcs):
         '''
@@ -215,6 +432,7 @@ class Simulation():
             cos_dir - the crossing angle of direct sound
         This way there is a dependence source-receiver for direct sound
         '''
+        self.srcs = srcs # to set up fresh sources for run_replicas
         self.sources = [] # An array of empty souce objects
         for s in srcs:
             coord = np.array(s['coord'], dtype=np.float32)
@@ -224,9 +442,55 @@ class Simulation():
             power_lin = (10.0**-12) * 10**((power_dB + eq_dB) / 10.0)
             delay = s['delay'] / 1000
             ################### cpp source class #################
-            self.sources.append(ra_cpp.Sourcecpp(coord, orientation,
+            self.sources.append(self.backend.Source(coord, orientation,
                 power_dB, eq_dB, power_lin, delay, self.rays, self.reccrossdir)) # Append the source object
 
+    def set_dt(self, Dt):
+        '''
+        Change the time resolution of the results (reflectograms, decays and
+        parameters) after run_raytracing, without binning the crossings
+        again: each source-receiver pair keeps its reflectograms at the
+        resolution of the run (the base, dt of set_configs) and a pyramid of
+        coarser ones, see ra.results.ReflectogramPyramid. Run with a fine dt
+        to be able to choose the resolution afterwards.
+        Parameters:
+        ----------
+            Dt: the new time resolution [s], a multiple of the base
+        '''
+        time_bins = np.arange(0.0, 1.2 * self.ht_length, Dt)
+        for sou in self.sr_results:
+            for rec in sou.rec:
+                rec.set_dt(Dt, time_bins)
+            sou.time = time_bins
+        self.Dt = Dt
+        self.stats = SRStats(self.sr_results)
+
+    def set_source_power(self, source_num, power_dB = None, eq_dB = None):
+        '''
+        Change the sound power and/or the equalization of a source after
+        run_raytracing. The results keep unit power reflectograms, so this
+        only rescales them (and the decays) per band; the parameters do not
+        depend on the source power.
+        Parameters:
+        ----------
+            source_num: index of the source
+            power_dB: sound power in dB per band (None to keep it)
+            eq_dB: sound power equalization in dB per band (None to keep it)
+        '''
+        s = self.sources[source_num]
+        if power_dB is not None:
+            s.power_dB = np.array(power_dB, dtype=np.float32)
+        if eq_dB is not None:
+            s.eq_dB = np.array(eq_dB, dtype=np.float32)
+        s.power_lin = (10.0**-12) * 10**((s.power_dB + s.eq_dB) / 10.0)
+        self.srcs[source_num] = dict(self.srcs[source_num],
+            power_dB = s.power_dB, eq_dB = s.eq_dB)
+        for rec in self.sr_results[source_num].rec:
+            rec.set_power(s.power_lin)
+        if self.path_store is not None:
+            self.path_store.sources[source_num].power_lin = \
+                np.asarray(s.power_lin, dtype=np.float32)
+
     def run_statistical_reverberation(self,):
         '''
         Method runs statistical theory for preliminary analysis of reverberation time.
@@ -243,7 +507,7 @@ class Simulation():
         # self.statistical_revtime.t60_fitzroy()
         # self.statistical_revtime.t60_milsette()
 
-    def run_raytracing(self,):
+    def run_raytracing(self, workers = 1, source_workers = 1):
         '''
         Every time we run a ray tracing calculation there are a few things that need to happen so
         we complete the calculations:
@@ -254,31 +518,192 @@ class Simulation():
         4 - Reflectogram, decay and acoustical parameters are computed
         Parts 3 and 4 must be computed if a user chages the absorption of some material in the scene.
         If only the absorption is changed there can be a function to do only these steps.
+        Parameters:
+        -----------
+            workers: number of processes sharing the ray tracing of each
+            source (the rays are split in workers shards; 'numpy' backend)
+            source_workers: number of processes running parts 1 to 4 of
+            different sources at the same time ('numpy' backend)
+        In the progressive mode (see set_progressive) parts 1 to 4 run for
+        each batch of rays.
         '''
-        ############### 1 - direct sound ############################
-        self.sources = ra_cpp._direct_sound(self.sources, self.receivers,
-            self.rec_radius_init, self.geometry.planes,
-            self.c0, self.rays_v.vinit)
-
-        ############### 2 - ray tracing ##############
-        self.sources = ra_cpp._raytracer_main(self.ht_length,
-            self.allow_scattering, self.transition_order,
-            self.rec_radius_init, self.alow_growth, self.rec_radius_final,
-            self.sources, self.receivers, self.geometry.planes, self.c0,
-            self.rays_v.vinit)
-
-        ######## 3 - Calculate intensities ###################
-        res_stat = StatisticalMat(self.geometry, self.freq, self.c0, self.m)
-        self.sources = ra_cpp._intensity_main(self.rec_radius_init,
-            self.sources, self.c0, self.m, res_stat.alphas_mtx)
+        self.backend.check_modes(self)
+        self.path_store = None
+        if self.progressive is not None:
+            self.run_progressive(workers, source_workers)
+        else:
+            self.run_stages(workers, source_workers)
 
-        ########### 4 - Process reflectograms and acoustical parameters #####################
-        self.sr_results = process_results(self.Dt, self.ht_length,
-            self.freq, self.sources, self.receivers)
+        if self.receiver_map is not None:
+            self.map_results = process_map_results(self.Dt, self.ht_length,
+                self.freq, self.sources, self.receiver_map)
 
         # FIXME not sure if this should be part of this method or have a separated one
         # Statistics - my initial sensation - comes hand in hand
         self.stats = SRStats(self.sr_results)
+        if self.progressive is not None:
+            self.stats.set_batch_ci(self.nrays_traced, self.batch_pars)
+
+    def run_stages(self, workers = 1, source_workers = 1):
+        '''
+        Parts 1 to 4 of run_raytracing (direct sound, ray tracing,
+        intensities and results) for the current rays and sources, in the
+        modes of their memory plan (see set_max_memory)
+        '''
+        self.memory_plan = self.memory_estimate()
+        log.info(str(self.memory_plan))
+        # the plan's modes for this run only
+        compact, streaming = self.compact, self.streaming
+        if self.max_memory is not None:
+            self.memory_plan.apply(self)
+        try:
+            self.run_stages_planned(workers, source_workers)
+        finally:
+            self.compact, self.streaming = compact, streaming
+
+    def run_stages_planned(self, workers = 1, source_workers = 1):
+        '''run_stages with the compact and streaming modes of the memory
+        plan'''
+        if source_workers > 1:
+            ############### 1 to 4 - one source per process ##############
+            self.sources, self.sr_results = self.backend.run_sources(self,
+                source_workers)
+        else:
+            ############### 1 - direct sound ############################
+            self.sources = self.backend.direct_sound(self)
+
+            ############### 2 - ray tracing ##############
+            self.sources = self.backend.raytracer(self, workers)
+
+            ######## 3 - Calculate intensities ###################
+            self.sources = self.backend.intensity(self)
+
+            ########### 4 - Process reflectograms and acoustical parameters #####################
+            self.sr_results = process_results(self.Dt, self.ht_length,
+                self.freq, self.sources, self.receivers)
+
+    def run_progressive(self, workers = 1, source_workers = 1):
+        '''
+        Progressive ray tracing (see set_progressive): traces batches of
+        rays until the batch means confidence intervals are within the
+        tolerances or the time or ray budget runs out, accumulating the
+        reflectograms (and the receiver grid histograms) of every batch.
+        '''
+        p = self.progressive
+        checkpoint = self.checkpoint
+        if checkpoint is not None:
+            log.info("The progressive mode does not write checkpoints.")
+            self.checkpoint = None
+        time_bins = np.arange(0.0, 1.2 * self.ht_length, self.Dt)
+        nrays_config = self.Nrays
+        self.Nrays = p['batch_rays']
+        self.nrays_traced = 0
+        self.batch_pars = {par: [] for par in self.par_dict}
+        reflectograms = None
+        map_hists = None
+        batch_times = []
+        start_time = time.time()
+        while True:
+            batch_start = time.time()
+            self.set_raydir(self.raydir_method)
+            self.set_memory_init()
+            self.set_sources(self.srcs)
+            self.run_stages(workers, source_workers)
+            # sums of the batches' reflectograms weighted by their rays
+            nrays = self.rays_v.Nrays
+            self.nrays_traced += nrays
+            batch = [[[nrays * pad_bins(reflecto, time_bins.size)
+                for reflecto in (r.unit_reflectogram, r.unit_reflecto_cos2,
+                r.unit_reflecto_cosabs)] for r in sou.rec]
+                for sou in self.sr_results]
+            if reflectograms is None:
+                reflectograms = batch
+            else:
+                reflectograms = [[[a + b for a, b in zip(rec_a, rec_b)]
+                    for rec_a, rec_b in zip(sou_a, sou_b)]
+                    for sou_a, sou_b in zip(reflectograms, batch)]
+            if self.receiver_map is not None:
+                hists = [nrays * s.map_histogram.hist for s in self.sources]
+                map_hists = hists if map_hists is None else \
+                    [a + b for a, b in zip(map_hists, hists)]
+            batch_stats = SRStats(self.sr_results)
+            for par in self.par_dict:
+                self.batch_pars[par].append(getattr(batch_stats, par))
+            batch_times.append(time.time() - batch_start)
+            elapsed = time.time() - start_time
+            log.info("Progressive ray tracing: {} rays in {} batches, "
+                "{:.1f} s".format(self.nrays_traced, len(batch_times),
+                elapsed))
+            if len(batch_times) >= p['min_batches'] and \
+                self.batches_converged(batch_stats.ci):
+                log.info("The confidence intervals are within the tolerances.")
+                break
+            if p['max_rays'] is not None and \
+                self.nrays_traced + nrays > p['max_rays']:
+                log.info("The next batch would pass max_rays.")
+                break
+            if p['time_budget'] is not None and \
+                elapsed + np.mean(batch_times) > p['time_budget']:
+                log.info("The next batch would pass the time budget.")
+                break
+        self.Nrays = nrays_config
+        self.checkpoint = checkpoint
+        # results of the accumulated (unit power) reflectograms
+        self.sr_results = [SouResults([RecResults.from_reflectograms(
+            *[reflecto / self.nrays_traced for reflecto in rec], time_bins,
+            self.freq, s.power_lin) for rec in sou], time_bins, self.freq)
+            for s, sou in zip(self.sources, reflectograms)]
+        if map_hists is not None:
+            for s, hist in zip(self.sources, map_hists):
+                s.map_histogram.hist = hist / self.nrays_traced
+
+    def batches_converged(self, ci = 1.96):
+        '''True if the batch means confidence intervals of every pair and
+        band are within the progressive mode tolerances'''
+        for par, tol in self.progressive['tolerances'].items():
+            values = np.array(self.batch_pars[par])
+            half_width = ci * np.nanstd(values, axis = 0, ddof = 1) / \
+                np.sqrt(values.shape[0])
+            if self.par_dict[par] != '[dB]':
+                tol = tol * np.abs(np.nanmean(values, axis = 0))
+            with np.errstate(invalid = 'ignore'):
+                if not np.all(half_width < tol):
+                    return False
+        return True
+
+    def run_replicas(self, nreplicas, workers = 1, source_workers = 1):
+        '''
+        Randomized quasi-Monte Carlo error estimate: runs the ray tracing
+        nreplicas times, each with a new randomization of the ray directions
+        of set_raydir (a new scramble of the Sobol points or a new random
+        rotation of the Fibonacci lattice and of the equal area partition)
+        and fresh sources. The replicas are independent and unbiased, so
+        their spread gives the error of their mean. It sets:
+            replicas - the parameters of each replica ({'T30': Nreplicas x
+            Npairs x Nfreq, ...}, pairs in SRStats order)
+            replicas_mean - the mean over the replicas (Npairs x Nfreq)
+            replicas_stderr - the standard error of the mean (std / sqrt(
+            nreplicas), Npairs x Nfreq)
+        sr_results and stats keep the results of the last replica.
+        Parameters:
+        -----------
+            nreplicas: number of replicas (at least 2 for an error estimate)
+            workers, source_workers: as in run_raytracing
+        '''
+        self.replicas = {par: [] for par in self.par_dict}
+        for jr in range(nreplicas):
+            self.set_raydir(self.raydir_method)
+            self.set_sources(self.srcs)
+            self.run_raytracing(workers, source_workers)
+            for par in self.par_dict:
+                self.replicas[par].append(getattr(self.stats, par))
+        self.replicas = {par: np.array(values)
+            for par, values in self.replicas.items()}
+        self.replicas_mean = {par: np.mean(values, axis = 0)
+            for par, values in self.replicas.items()}
+        self.replicas_stderr = {par: np.std(values, axis = 0, ddof = 1) /
+            np.sqrt(nreplicas) if nreplicas > 1 else np.full_like(values[0],
+            np.nan) for par, values in self.replicas.items()}
 
     def run_intensitycalc(self,):
         '''
@@ -287,20 +712,102 @@ class Simulation():
         4 - Reflectogram, decay and acoustical parameters are computed
         Parts 3 and 4 must be computed if a user chages the absorption of some material in the scene.
         If only the absorption is changed there can be a function to do only these steps.
+        The absorption is the one of the planes of the geometry (e.g., after
+        changing the alpha of sim.geometry.planes[jp]).
         '''
-        ######## 3 - Calculate intensities ###################
-        res_stat = StatisticalMat(self.geometry, self.freq, self.c0, self.m)
-        self.sources = ra_cpp._intensity_main(self.rec_radius_init,
-            self.sources, self.c0, self.m, res_stat.alphas_mtx)
+        self.scene = self.scene.with_materials(
+            [plane.alpha for plane in self.geometry.planes],
+            [plane.s for plane in self.geometry.planes])
+        if self.path_store is not None:
+            ######## 3 and 4 - from the stored paths (see load_paths) ########
+            self.sr_results = self.path_store.process_results(self.Dt,
+                self.ht_length, self.freq, self.rec_radius_init, self.c0,
+                self.m, self.scene.alpha.T)
+        else:
+            ######## 3 - Calculate intensities ###################
+            self.sources = self.backend.intensity(self)
 
-        ########### 4 - Process reflectograms and acoustical parameters #####################
-        self.sr_results = process_results(self.Dt, self.ht_length,
-            self.freq, self.sources, self.receivers)
+            ########### 4 - Process reflectograms and acoustical parameters #####################
+            self.sr_results = process_results(self.Dt, self.ht_length,
+                self.freq, self.sources, self.receivers)
 
         # FIXME not sure if this should be part of this method or have a separated one
         # Statistics - my initial sensation - comes hand in hand
         self.stats = SRStats(self.sr_results)
 
+    def sweep_materials(self, alpha_list, parameters = None):
+        '''
+        Evaluate many absorption assignments at once, without tracing (the
+        traced paths, or the ones of load_paths). The reflection losses of
+        all the variants come from one matrix product of the crossings'
+        plane hit counts with log(1 - alpha), see
+        ra.path_store.PathStore.sweep_materials.
+        Parameters:
+        -----------
+            alpha_list: list of absorption coefficient matrices (Nplanes x
+            Nbands each, the planes in set_geometry's order)
+            parameters: list of parameter names (default: the ones of
+            par_dict, in its order)
+        Returns:
+        --------
+            A (Nvariants x Npairs x Nparameters x Nbands) array, the pairs
+            sorted by source and then receiver (as in stats)
+        '''
+        if parameters is None:
+            parameters = list(self.par_dict)
+        if self.path_store is None:
+            self.path_store = PathStore.from_sources(self.sources,
+                len(self.receivers), self.c0)
+        return self.path_store.sweep_materials(self.Dt, self.ht_length,
+            self.freq, self.rec_radius_init, self.c0, self.m, alpha_list,
+            parameters)
+
+    def update_air(self, air_properties):
+        '''
+        Change the air properties (see set_air) of a traced simulation
+        without tracing again: the ray paths do not depend on the air, so
+        the crossings (the traced paths, or the ones of load_paths) are
+        retimed with the new sound speed and their air absorption is
+        recomputed on their path lengths. The reflectograms and parameters
+        are then recomputed (as run_intensitycalc).
+        Parameters:
+        ----------
+            air_properties: dictionary of air properties (see set_air)
+        '''
+        if self.path_store is None:
+            self.path_store = PathStore.from_sources(self.sources,
+                len(self.receivers), self.c0)
+        self.set_air(air_properties)
+        self.run_intensitycalc()
+
+    def save_paths(self, path):
+        '''
+        Save the traced paths (after run_raytracing) to a compressed .npz
+        file, see ra.path_store. The crossings keep their time, receiver
+        radius, cosine and weight and their planes sequence is stored once
+        per distinct prefix (a trie), instead of the padded planes history
+        of every ray.
+        Parameters:
+        -----------
+            path: the file to write
+        '''
+        self.path_store = PathStore.from_sources(self.sources,
+            len(self.receivers), self.c0)
+        self.path_store.save(path)
+
+    def load_paths(self, path):
+        '''
+        Load the paths saved by save_paths (e.g., in a later session), so
+        that run_intensitycalc evaluates the intensities and results of the
+        current materials (set_geometry) and air (set_air) without tracing.
+        The configurations (set_configs) must be the ones of the traced
+        simulation.
+        Parameters:
+        -----------
+            path: the file written by save_paths
+        '''
+        self.path_store = PathStore.load(path)
+
     def plot_par_sr(self, parameter, source_num = 0, rec_num = 0, show = True, save = False, fformat = 'png', bars = False):
         '''
         This method is used to plot the results of a parameter vs. frequency.
@@ -580,4 +1087,10 @@ def write_row(sheet, line_array, row = 0, start_col = 1):
     for column, value in enumerate(line_array, start_col):
         sheet.write(row, column, str(value))
 
-
+def pad_bins(reflectogram, nbins):
+    '''A reflectogram (Nfreq x bins) padded with zeros (or cut) to nbins
+    time bins'''
+    padded = np.zeros((reflectogram.shape[0], nbins))
+    ncopy = min(nbins, reflectogram.shape[1])
+    padded[:, :ncopy] = reflectogram[:, :ncopy]
+    return padded
@@ -1,6 +1,6 @@
 import numpy as np
 import toml
-import ra_cpp
+from ra.cpp_extension import ra_cpp
 
 def setup_sources(sources_cfg, rays, reccrossdir):
     '''
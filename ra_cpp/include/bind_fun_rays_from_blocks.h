@@ -0,0 +1,16 @@
+#ifndef BIND_FUN_RAYS_FROM_BLOCKS_H
+#define BIND_FUN_RAYS_FROM_BLOCKS_H
+
+#include <iostream>
+
+#include "pybind11/complex.h"
+#include "pybind11/eigen.h"
+#include "pybind11/numpy.h"
+#include "pybind11/pybind11.h"
+#include "rays_from_blocks.h"
+
+namespace py = pybind11;
+
+void bind_rays_from_blocks(py::module &m);
+
+#endif /* BIND_FUN_RAYS_FROM_BLOCKS_H */
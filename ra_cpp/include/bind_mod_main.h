@@ -22,6 +22,7 @@
 #include "bind_fun_t_cat.h"
 #include "bind_fun_i_cat.h"
 #include "bind_fun_cos_cat.h"
+#include "bind_fun_rays_from_blocks.h"
 
 
 namespace py = pybind11;
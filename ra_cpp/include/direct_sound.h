@@ -15,6 +15,7 @@
 #include <vector>
 #include "geometry.h"
 #include "ray.h"
+#include "plane_bvh.h"
 #include "source.h"
 #include "visibilitytest.h"
 #include "point_all_recs.h"
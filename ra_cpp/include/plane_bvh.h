@@ -0,0 +1,49 @@
+#ifndef PLANE_BVH_H
+#define PLANE_BVH_H
+
+#include <iostream>
+#include <vector>
+#include "pybind11/pybind11.h"
+#include "pybind11/eigen.h"
+#include "geometry.h"
+
+// rooms with more planes than this are traced with a bounding volume
+// hierarchy instead of testing every ray against every plane (as ra/bvh.py)
+#define BVH_MIN_PLANES 64
+// planes per leaf of the hierarchy
+#define BVH_LEAF_SIZE 4
+
+/* The class PlaneBVH is a bounding volume hierarchy over the planes'
+bounding boxes (padded against the float rounding of the reflection
+points), built once per tracing call. Its plane_finder() gives the same
+plane, reflection point and distance as Raycpp::plane_finder(): the nodes
+farther than the nearest hit found so far are skipped and the remaining
+planes get the same tests, the ties going to the lowest plane index.
+The hierarchy is only built (active) for more than BVH_MIN_PLANES planes.*/
+class PlaneBVH
+{
+public:
+    PlaneBVH(std::vector<Planecpp> &planes);
+    ~PlaneBVH() {}
+
+    void plane_finder(std::vector<Planecpp> &planes,
+        Eigen::RowVector3f &ray_origin,
+        Eigen::Ref<Eigen::RowVector3f> v_in,
+        uint16_t &plane_detected,
+        double &dist);
+
+    bool active;
+private:
+    int build(int start, int count);
+    double box_entry(int node, const Eigen::RowVector3d &origin,
+        const Eigen::RowVector3d &dir) const;
+    // one entry per node: its box, children (-1 for a leaf) and range of
+    // order (the planes indexes sorted by leaf)
+    std::vector<Eigen::RowVector3d> box_min, box_max;
+    std::vector<int> left, right, start, count;
+    std::vector<int> order;
+    // the planes' boxes and centroids
+    std::vector<Eigen::RowVector3d> plane_min, plane_max, plane_center;
+};
+
+#endif /* PLANE_BVH_H */
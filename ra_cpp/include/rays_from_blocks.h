@@ -0,0 +1,29 @@
+#ifndef RAYS_FROM_BLOCKS_H
+#define RAYS_FROM_BLOCKS_H
+
+#include <iostream>
+
+#include "pybind11/complex.h"
+#include "pybind11/eigen.h"
+#include <vector>
+#include "pybind11/numpy.h"
+#include "pybind11/stl.h"
+#include "pybind11/pybind11.h"
+#include "ray.h"
+
+namespace py = pybind11;
+// contiguous (row major) blocks of the rays histories
+typedef Eigen::Array<uint16_t, Eigen::Dynamic, Eigen::Dynamic,
+    Eigen::RowMajor> PlanesBlock;
+typedef Eigen::Matrix<float, Eigen::Dynamic, 3, Eigen::RowMajor> RefptsBlock;
+/* Builds all the rays at once from a planes history block
+(Nrays x N_max_ref) and a reflection points block (Nrays*N_max_ro x 3),
+instead of one Raycpp per python call. The blocks are read in place
+(Eigen::Ref) and each Raycpp copies its rows: a faster constructor, the
+rays do not write to the blocks.*/
+std::vector<Raycpp> rays_from_blocks(
+    const Eigen::Ref<const PlanesBlock> &planes_hist,
+    const Eigen::Ref<const RefptsBlock> &refpts_hist,
+    int n_ro, std::vector<RecCrosscpp> &reccross);
+
+#endif /* RAYS_FROM_BLOCKS_H */
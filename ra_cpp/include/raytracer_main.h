@@ -15,6 +15,7 @@
 #include <vector>
 #include "geometry.h"
 #include "ray.h"
+#include "plane_bvh.h"
 #include "source.h"
 #include "receiver.h"
 #include "rayreflection.h"
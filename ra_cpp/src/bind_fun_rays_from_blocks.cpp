@@ -0,0 +1,12 @@
+#include "bind_fun_rays_from_blocks.h"
+
+void bind_rays_from_blocks(py::module &m)
+{
+    m.def("_rays_from_blocks", rays_from_blocks,
+    "Build the rays from contiguous planes and reflection points blocks",
+    py::arg("planes_hist").noconvert(),
+    py::arg("refpts_hist").noconvert(),
+    py::arg("n_ro"),
+    py::arg("reccross")
+    );
+}
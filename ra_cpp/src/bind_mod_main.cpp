@@ -23,6 +23,7 @@ PYBIND11_MODULE(ra_cpp, m)
     bind_t_cat(m);
     bind_i_cat(m);
     bind_cos_cat(m);
+    bind_rays_from_blocks(m);
 
 #ifdef VERSION_INFO
     m.attr("__version__") = VERSION_INFO;
@@ -7,6 +7,7 @@ std::vector<Sourcecpp> direct_sound(
     double rec_radius,
     std::vector<Planecpp> &planes,
     double c0, Eigen::MatrixXf &v_init){
+    PlaneBVH bvh(planes); // only active for large rooms
     // loop through sources
     for(auto&& s: sources){
         // calculate the direct sound time of arrival for each receiver
@@ -26,8 +27,12 @@ std::vector<Sourcecpp> direct_sound(
             Eigen::RowVector3f ray_origin = s.coord;
             uint16_t plane_detected = 65534;
             double dist_plane = 0.0;
-            s.rays[0].plane_finder(planes, ray_origin, v_dir,
-                plane_detected, dist_plane);
+            if (bvh.active)
+                bvh.plane_finder(planes, ray_origin, v_dir,
+                    plane_detected, dist_plane);
+            else
+                s.rays[0].plane_finder(planes, ray_origin, v_dir,
+                    plane_detected, dist_plane);
             // affect time_dir only if distance to plane is bigger
             if (dist_dir < dist_plane){
                 // increase size_of
@@ -0,0 +1,143 @@
+#include "plane_bvh.h"
+
+#include <algorithm>
+#include <limits>
+
+PlaneBVH::PlaneBVH(std::vector<Planecpp> &planes){
+    active = planes.size() > BVH_MIN_PLANES;
+    if (!active)
+        return;
+    int n_planes = planes.size();
+    Eigen::RowVector3d scene_min = Eigen::RowVector3d::Constant(
+        std::numeric_limits<double>::infinity());
+    Eigen::RowVector3d scene_max = -scene_min;
+    for(auto&& pl: planes){
+        Eigen::MatrixXd vert = pl.vertices.cast<double>();
+        plane_min.push_back(vert.colwise().minCoeff());
+        plane_max.push_back(vert.colwise().maxCoeff());
+        plane_center.push_back(0.5 * (plane_min.back() + plane_max.back()));
+        scene_min = scene_min.cwiseMin(plane_min.back());
+        scene_max = scene_max.cwiseMax(plane_max.back());
+    }
+    // the reflection points are float: pad the boxes by their rounding
+    double pad = 1e-4 * (1.0 + (scene_max - scene_min).norm());
+    for (int jp = 0; jp < n_planes; jp++){
+        plane_min[jp].array() -= pad;
+        plane_max[jp].array() += pad;
+        order.push_back(jp);
+    }
+    build(0, n_planes);
+}
+
+int PlaneBVH::build(int first, int n){
+    // the node's box holds the boxes of its planes
+    int node = box_min.size();
+    Eigen::RowVector3d bmin = plane_min[order[first]];
+    Eigen::RowVector3d bmax = plane_max[order[first]];
+    Eigen::RowVector3d cmin = plane_center[order[first]];
+    Eigen::RowVector3d cmax = cmin;
+    for (int j = first + 1; j < first + n; j++){
+        bmin = bmin.cwiseMin(plane_min[order[j]]);
+        bmax = bmax.cwiseMax(plane_max[order[j]]);
+        cmin = cmin.cwiseMin(plane_center[order[j]]);
+        cmax = cmax.cwiseMax(plane_center[order[j]]);
+    }
+    box_min.push_back(bmin);
+    box_max.push_back(bmax);
+    left.push_back(-1);
+    right.push_back(-1);
+    start.push_back(first);
+    count.push_back(n);
+    if (n <= BVH_LEAF_SIZE)
+        return node;
+    // split at the median of the centers along the longest axis
+    int axis;
+    (cmax - cmin).maxCoeff(&axis);
+    int half = n / 2;
+    std::nth_element(order.begin() + first, order.begin() + first + half,
+        order.begin() + first + n, [&](int a, int b){
+            return plane_center[a](axis) < plane_center[b](axis);});
+    int l_node = build(first, half);
+    int r_node = build(first + half, n - half);
+    left[node] = l_node;
+    right[node] = r_node;
+    return node;
+}
+
+double PlaneBVH::box_entry(int node, const Eigen::RowVector3d &origin,
+    const Eigen::RowVector3d &dir) const{
+    // slab test: the distance at which the ray enters the node's box
+    // (infinity if it misses the box or the box is behind it)
+    double t_in = 0.0;
+    double t_out = std::numeric_limits<double>::infinity();
+    for (int ax = 0; ax < 3; ax++){
+        if (std::abs(dir(ax)) < 1e-12){
+            if (origin(ax) < box_min[node](ax) ||
+                origin(ax) > box_max[node](ax))
+                return std::numeric_limits<double>::infinity();
+            continue;
+        }
+        double t1 = (box_min[node](ax) - origin(ax)) / dir(ax);
+        double t2 = (box_max[node](ax) - origin(ax)) / dir(ax);
+        t_in = std::max(t_in, std::min(t1, t2));
+        t_out = std::min(t_out, std::max(t1, t2));
+        if (t_in > t_out)
+            return std::numeric_limits<double>::infinity();
+    }
+    return t_in;
+}
+
+void PlaneBVH::plane_finder(std::vector<Planecpp> &planes,
+    Eigen::RowVector3f &ray_origin,
+    Eigen::Ref<Eigen::RowVector3f> v_in,
+    uint16_t &plane_detected,
+    double &dist){
+        Eigen::RowVector3d origin = ray_origin.cast<double>();
+        Eigen::RowVector3d dir = v_in.cast<double>().normalized();
+        double best_dist = std::numeric_limits<double>::infinity();
+        int best_plane = -1;
+        Eigen::RowVector3f best_pt;
+        std::vector<int> stack(1, 0);
+        while (!stack.empty()){
+                int node = stack.back();
+                stack.pop_back();
+                // a node farther than the nearest hit holds no nearer hit
+                if (box_entry(node, origin, dir) > best_dist)
+                        continue;
+                if (left[node] != -1){
+                        stack.push_back(right[node]);
+                        stack.push_back(left[node]);
+                        continue;
+                }
+                for (int j = start[node]; j < start[node] + count[node]; j++){
+                        int pc = order[j];
+                        // the same tests as Raycpp::plane_finder()
+                        if(pc == plane_detected)
+                                continue;
+                        Eigen::RowVector3f ref_pt;
+                        ref_pt = planes[pc].refpoint3d(ray_origin, v_in);
+                        double d = (ref_pt - ray_origin).norm();
+                        if(d < 0.000001 || ref_pt == ray_origin)
+                                continue;
+                        if (planes[pc].test_single_plane(ray_origin, v_in,
+                                ref_pt) == 0)
+                                continue;
+                        if (d < best_dist || (d == best_dist &&
+                                pc < best_plane)){
+                                best_dist = d;
+                                best_plane = pc;
+                                best_pt = ref_pt;
+                        }
+                }
+        }
+        if (best_plane == -1){
+                ray_origin << 2.3, 2.3,2.3;
+                plane_detected = 65533;
+                dist = 10000000.0;
+        }
+        else {
+                ray_origin = best_pt;
+                plane_detected = best_plane;
+                dist = best_dist;
+        }
+}
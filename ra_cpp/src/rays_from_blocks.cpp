@@ -0,0 +1,19 @@
+#include "rays_from_blocks.h"
+
+std::vector<Raycpp> rays_from_blocks(
+    const Eigen::Ref<const PlanesBlock> &planes_hist,
+    const Eigen::Ref<const RefptsBlock> &refpts_hist,
+    int n_ro, std::vector<RecCrosscpp> &reccross){
+    int n_rays = planes_hist.rows();
+    if (refpts_hist.rows() != n_rays * n_ro){
+        throw std::invalid_argument(
+            "refpts_hist must have Nrays x N_max_ro rows");
+    }
+    std::vector<Raycpp> rays;
+    rays.reserve(n_rays);
+    for (int jray = 0; jray < n_rays; jray++){
+        rays.emplace_back(planes_hist.row(jray),
+            refpts_hist.middleRows(jray * n_ro, n_ro), reccross);
+    }
+    return rays;
+}
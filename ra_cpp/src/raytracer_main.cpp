@@ -18,6 +18,7 @@ std::vector<Sourcecpp> raytracer_main(
     int N_max_ref = sources[0].rays[0].planes_hist.size(); // max ref_order
     int N_max_ro = sources[0].rays[0].refpts_hist.rows(); // max number of ref points saved
     int sc = 0; // source counter
+    PlaneBVH bvh(planes); // only active for large rooms
     for(auto&& s: sources){
         // std::cout << "test" << s.rays[0].planes_hist << std::endl;
         std::cout << "Tracing rays for source: " << sc + 1 << " at: (" << s.coord << ") [m]" << std::endl;
@@ -42,7 +43,12 @@ std::vector<Sourcecpp> raytracer_main(
             bool pop_condition = false;
             while(ref_order < N_max_ref){ //  (cum_dist / c0) <= ht_length && 
                 // find the intercepted plane
-                v.plane_finder(planes, r_origin, v_dir, plane_detected, dist);
+                if (bvh.active)
+                    bvh.plane_finder(planes, r_origin, v_dir, plane_detected,
+                        dist);
+                else
+                    v.plane_finder(planes, r_origin, v_dir, plane_detected,
+                        dist);
                 // fill the plane in appropriate place
                 v.planes_hist[ref_order] = plane_detected;
                 // fill the reflection points up to transition order + 2
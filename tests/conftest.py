@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+from ra.simulation_api import Simulation
+
+FREQ = [250.0, 1000.0, 4000.0]
+AIR = {'Temperature': 20.0, 'hr': 50.0, 'p_atm': 101325.0}
+# a 8 x 6 x 4 m shoebox: (name, vertices, normal) of its walls
+ROOM = [
+    ('floor', [[0, 0, 0], [8, 0, 0], [8, 6, 0], [0, 6, 0]], [0, 0, 1]),
+    ('ceiling', [[0, 0, 4], [0, 6, 4], [8, 6, 4], [8, 0, 4]], [0, 0, -1]),
+    ('wall x0', [[0, 0, 0], [0, 6, 0], [0, 6, 4], [0, 0, 4]], [1, 0, 0]),
+    ('wall x8', [[8, 0, 0], [8, 0, 4], [8, 6, 4], [8, 6, 0]], [-1, 0, 0]),
+    ('wall y0', [[0, 0, 0], [0, 0, 4], [8, 0, 4], [8, 0, 0]], [0, 1, 0]),
+    ('wall y6', [[0, 6, 0], [8, 6, 0], [8, 6, 4], [0, 6, 4]], [0, -1, 0]),
+]
+ALPHA = [0.1, 0.2, 0.3]
+SOURCES = [{'coord': [2.0, 3.0, 1.5], 'orientation': [1.0, 0.0, 0.0],
+    'power_dB': [80.0] * len(FREQ), 'eq_dB': [0.0] * len(FREQ),
+    'delay': 0.0}]
+RECEIVERS = [{'coord': [6.0, 2.0, 1.2], 'orientation': [0.0, 1.0, 0.0]},
+    {'coord': [5.0, 4.5, 2.0], 'orientation': [0.0, 1.0, 0.0]}]
+PARAMETERS = ('EDT', 'T20', 'T30', 'C80', 'D50', 'Ts', 'G', 'LF', 'LFC')
+
+
+def geometry(alpha=ALPHA, s=0.1, divisions=1):
+    '''the geometry dictionaries of the shoebox (set_geometry), alpha
+    being the walls' absorption (Nbands, or Nplanes x Nbands), with each
+    wall split in divisions x divisions planes'''
+    alpha = np.broadcast_to(np.float32(alpha), (len(ROOM), len(FREQ)))
+    geom_dict = []
+    for (name, vertices, normal), plane_alpha in zip(ROOM, alpha):
+        vertices = np.array(vertices, dtype=np.float32)
+        edges = (vertices[[1, 3]] - vertices[0]) / divisions
+        for j1 in range(divisions):
+            for j2 in range(divisions):
+                corner = vertices[0] + j1 * edges[0] + j2 * edges[1]
+                geom_dict.append({'name': name, 'bbox': False,
+                    'vertices': corner + np.float32([[0, 0], [1, 0], [1, 1],
+                    [0, 1]]) @ edges, 'normal': np.float32(normal),
+                    'area': float(np.linalg.norm(np.cross(*edges))),
+                    'alpha': plane_alpha, 's': s})
+    return geom_dict
+
+
+def make_simulation(nrays=300, seed=0, dt=0.001, air=AIR, alpha=ALPHA,
+    scattering=0.1, backend='numpy', geom_dict=None):
+    '''a Simulation of the shoebox (or of geom_dict), ready to run (without
+    scattering, the rays do not depend on the random numbers drawn while
+    tracing)'''
+    sim = Simulation()
+    sim.set_backend(backend)
+    sim.set_configs({'freq': FREQ, 'n_rays': nrays, 'ht_length': 1.0,
+        'dt': dt, 'allow_scattering': 1, 'transition_order': 1,
+        'rec_radius_init': 0.3, 'allow_growth': 1, 'rec_radius_final': 1.0})
+    sim.set_air(air)
+    sim.set_geometry(geometry(alpha, scattering) if geom_dict is None else
+        geom_dict)
+    np.random.seed(seed)
+    sim.set_raydir()
+    sim.set_receivers(RECEIVERS)
+    sim.set_memory_init()
+    sim.set_sources(SOURCES)
+    return sim
+
+
+def parameters(sim):
+    '''every parameter of every source-receiver pair (Npairs x Nbands)'''
+    pairs = [rec for sou in sim.sr_results for rec in sou.rec]
+    return {par: np.array([getattr(rec, par) for rec in pairs],
+        dtype=np.float64) for par in PARAMETERS}
+
+
+def assert_same_parameters(pars, ref, rtol=1e-5, atol=1e-6):
+    for par in PARAMETERS:
+        np.testing.assert_allclose(pars[par], ref[par], rtol=rtol,
+            atol=atol, equal_nan=True, err_msg=par)
+
+
+@pytest.fixture
+def simulation():
+    return make_simulation
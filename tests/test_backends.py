@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+from conftest import FREQ, SOURCES, geometry, parameters, \
+    assert_same_parameters
+from ra import backends
+from ra.bvh import BVH_MIN_PLANES
+from ra.cpp_extension import ra_cpp
+from ra.simulation_api import Simulation
+
+
+def test_cpp_extension_is_the_compiled_module():
+    # the ra_cpp/ source directory must not pass for the extension
+    assert ra_cpp is None or hasattr(ra_cpp, 'Sourcecpp')
+
+
+def test_default_backend_builds_a_simulation():
+    sim = Simulation()
+    assert sim.backend.name == backends.default_backend()
+    if ra_cpp is None:
+        assert sim.backend.name == 'numpy'
+
+
+@pytest.mark.parametrize('chunk_rays', [64, 1000])
+def test_streaming_matches_a_plain_run(simulation, chunk_rays):
+    sim = simulation(scattering=0.0)
+    sim.run_raytracing()
+    streamed = simulation(scattering=0.0)
+    streamed.set_streaming(True, chunk_rays)
+    streamed.run_raytracing()
+    assert_same_parameters(parameters(streamed), parameters(sim))
+
+
+@pytest.mark.skipif(ra_cpp is None, reason='needs the ra_cpp module')
+@pytest.mark.parametrize('mode', [
+    lambda sim: sim.set_wavefront(True, roulette=0.1),
+    lambda sim: sim.set_receiver_grid([1.0, 1.0, 1.0], 1.0, (2, 2, 2)),
+    lambda sim: sim.set_streaming(True),
+    lambda sim: sim.set_compact(True),
+    lambda sim: sim.set_max_memory(2 ** 30)])
+def test_cpp_backend_refuses_the_numpy_modes(simulation, mode):
+    sim = simulation(backend='cpp')
+    mode(sim)
+    with pytest.raises(ValueError, match="'cpp' backend does not support"):
+        sim.run_raytracing()
+
+
+def planes_history(sim):
+    '''the planes history of every ray of every source'''
+    if sim.backend.name == 'numpy':
+        return [s.planes_hist for s in sim.sources]
+    return [np.array([ray.planes_hist for ray in s.rays])
+        for s in sim.sources]
+
+
+@pytest.mark.parametrize('backend', [
+    'numpy', pytest.param('cpp', marks=pytest.mark.skipif(ra_cpp is None,
+    reason='needs the ra_cpp module'))])
+def test_bvh_traces_the_planes_of_the_linear_scan(simulation, backend):
+    # 54 planes (linear scan) and the same room with planes outside it,
+    # which no ray reaches, past BVH_MIN_PLANES: both tracers then query
+    # their bounding volume hierarchy
+    room = geometry(s=0.0, divisions=3)
+    outside = []
+    for jp in range(BVH_MIN_PLANES + 1 - len(room)):
+        corner = np.float32([20.0 + 2 * jp, 0.0, 0.0])
+        outside.append({'name': 'outside', 'bbox': False,
+            'vertices': corner + np.float32([[0, 0, 0], [1, 0, 0],
+            [1, 1, 0], [0, 1, 0]]), 'normal': np.float32([0, 0, 1]),
+            'area': 1.0, 'alpha': np.float32([0.1] * len(FREQ)), 's': 0.0})
+    linear = simulation(backend=backend, geom_dict=room)
+    linear.allow_scattering = 0
+    linear.run_raytracing()
+    bvh = simulation(backend=backend, geom_dict=room + outside)
+    bvh.allow_scattering = 0
+    # the reflection orders of the room (the convex hull volume grew)
+    bvh.geometry.volume = linear.geometry.volume
+    bvh.geometry.total_area = linear.geometry.total_area
+    bvh.set_memory_init()
+    bvh.set_sources(SOURCES)
+    bvh.run_raytracing()
+    assert linear.scene.bvh is None and bvh.scene.bvh is not None
+    for hist, ref in zip(planes_history(bvh), planes_history(linear)):
+        np.testing.assert_array_equal(hist, ref)
+    assert_same_parameters(parameters(bvh), parameters(linear))
@@ -0,0 +1,27 @@
+import numpy as np
+
+from conftest import geometry
+import ra.rtrace as rt
+from ra.bvh import BVH, BVH_MIN_PLANES
+
+
+def test_nearest_is_the_linear_scan():
+    room = geometry(divisions=4)
+    assert len(room) > BVH_MIN_PLANES
+    poly_verts = rt.pack_polygons([plane['vertices'] for plane in room])
+    normals = np.array([plane['normal'] for plane in room], np.float32)
+    rng = np.random.RandomState(0)
+    r0 = rng.uniform([0.1, 0.1, 0.1], [7.9, 5.9, 3.9],
+        (2000, 3)).astype(np.float32)
+    rd = rng.randn(2000, 3)
+    # 600 rays parallel to the axes (and to most of the planes)
+    rd[:600] = np.repeat(np.vstack((np.eye(3), -np.eye(3))), 100, axis=0)
+    # and a hundred of them on the planes' shared edges (ties)
+    r0[:100, [0, 2]] = [2.0, 1.0]
+    rd = (rd / np.linalg.norm(rd, axis=1)[:, None]).astype(np.float32)
+    ids, ts, ris = rt.nearest_polygons(r0, rd, poly_verts, normals)
+    bvh_ids, bvh_ts, bvh_ris = BVH(poly_verts, normals).nearest(r0, rd)
+    assert np.all(ids >= 0)
+    np.testing.assert_array_equal(bvh_ids, ids)
+    np.testing.assert_array_equal(bvh_ts, ts)
+    np.testing.assert_array_equal(bvh_ris, ris)
@@ -0,0 +1,51 @@
+import os
+
+import pytest
+
+from conftest import RECEIVERS, parameters, assert_same_parameters
+from ra.checkpoint import Checkpoint
+
+
+def interrupted_run(sim, path, every_rays, chunks, monkeypatch):
+    '''runs sim with checkpoints, interrupted after its first chunks'''
+    sim.set_checkpoint(path, every_rays)
+    save = Checkpoint.save
+    def save_and_stop(checkpoint, *args):
+        save(checkpoint, *args)
+        if len(checkpoint.chunks) == chunks:
+            raise KeyboardInterrupt
+    with monkeypatch.context() as patch:
+        patch.setattr(Checkpoint, 'save', save_and_stop)
+        with pytest.raises(KeyboardInterrupt):
+            sim.run_raytracing()
+
+
+def test_resume_matches_an_uninterrupted_run(simulation, tmp_path,
+    monkeypatch):
+    path = str(tmp_path / 'checkpoint.npz')
+    sim = simulation()
+    sim.set_checkpoint(path, every_rays=100)
+    sim.run_raytracing()
+    assert os.listdir(str(tmp_path)) == []
+    interrupted_run(simulation(), path, 100, 1, monkeypatch)
+    assert os.path.exists(path)
+    resumed = simulation(seed=1)
+    resumed.set_checkpoint(path, every_rays=100, resume=True)
+    resumed.run_raytracing()
+    assert os.listdir(str(tmp_path)) == []
+    assert_same_parameters(parameters(resumed), parameters(sim))
+
+
+def test_resume_refuses_another_configuration(simulation, tmp_path,
+    monkeypatch):
+    path = str(tmp_path / 'checkpoint.npz')
+    interrupted_run(simulation(), path, 100, 1, monkeypatch)
+    moved = simulation()
+    moved.set_receivers([dict(rec, coord=[4.0, 3.0, 1.2])
+        for rec in RECEIVERS])
+    moved.set_memory_init()
+    moved.set_checkpoint(path, every_rays=100, resume=True)
+    with pytest.raises(ValueError, match='another configuration'):
+        moved.run_raytracing()
+    with pytest.raises(ValueError, match='has 300 rays'):
+        simulation(nrays=400).set_checkpoint(path, resume=True)
@@ -0,0 +1,32 @@
+import pytest
+
+from ra.memory_plan import MemoryPlan, MIN_CHUNK_RAYS
+
+
+def test_fit_moves_from_full_to_compact_to_stream(simulation):
+    sim = simulation(nrays=2000)
+    plan = MemoryPlan(sim)
+    full = plan.peak_of(plan.parts_of('full', plan.nrays))
+    compact = plan.peak_of(plan.parts_of('compact', plan.nrays))
+    stream = plan.peak_of(plan.parts_of('stream', 500))
+    assert plan.mode == 'full' and plan.peak == full
+    assert full > compact > stream
+    for max_memory, mode, chunk_rays in ((full, 'full', 2000),
+        (full - 1, 'compact', 2000), (compact, 'compact', 2000),
+        (compact - 1, 'stream', None), (stream, 'stream', 500)):
+        plan = MemoryPlan(sim, max_memory)
+        assert plan.mode == mode
+        assert plan.peak <= max_memory
+        if chunk_rays is not None:
+            assert plan.chunk_rays == chunk_rays
+        else:
+            assert MIN_CHUNK_RAYS <= plan.chunk_rays <= 2000
+
+
+def test_fit_raises_below_the_smallest_chunk(simulation):
+    sim = simulation(nrays=2000)
+    plan = MemoryPlan(sim)
+    smallest = plan.peak_of(plan.parts_of('stream', MIN_CHUNK_RAYS))
+    assert MemoryPlan(sim, smallest).chunk_rays == MIN_CHUNK_RAYS
+    with pytest.raises(ValueError, match='cannot hold'):
+        MemoryPlan(sim, smallest - 1)
@@ -0,0 +1,12 @@
+import pytest
+
+from conftest import parameters, assert_same_parameters
+
+
+@pytest.mark.parametrize('workers, source_workers', [(2, 1), (1, 2)])
+def test_workers_match_a_plain_run(simulation, workers, source_workers):
+    sim = simulation(scattering=0.0)
+    sim.run_raytracing()
+    split = simulation(scattering=0.0)
+    split.run_raytracing(workers=workers, source_workers=source_workers)
+    assert_same_parameters(parameters(split), parameters(sim))
@@ -0,0 +1,32 @@
+import numpy as np
+
+from conftest import ALPHA, ROOM, parameters, PARAMETERS
+from ra.path_store import SourcePaths
+
+
+def test_hit_counts_leave_out_the_padded_planes():
+    # node 1: plane 0, node 2: plane 0 then no plane (an escaped ray)
+    arrays = {name: np.zeros(0) for name in SourcePaths.FIELDS}
+    arrays.update(node=np.array([1, 2]), node_parent=np.array([0, 0, 1]),
+        node_plane=np.array([0, 0, 65533], dtype=np.uint16),
+        level_start=np.array([0, 1, 2, 3]))
+    hits = SourcePaths(**arrays).hit_counts(2)
+    np.testing.assert_array_equal(hits.toarray(), [[1, 0], [1, 0]])
+    assert np.all(hits.data != 0)
+    with np.errstate(divide='ignore'):
+        log_vp = np.log(1 - np.array([[0.5], [1.0]], dtype=np.float32))
+    assert np.all(np.isfinite(hits.dot(log_vp)))
+
+
+def test_sweep_at_the_current_alpha_is_run_intensitycalc(simulation):
+    sim = simulation()
+    sim.run_raytracing()
+    # the traced intensities, before sweep_materials stores the paths
+    sim.run_intensitycalc()
+    pars = parameters(sim)
+    alpha = np.tile(np.float32(ALPHA), (len(ROOM), 1))
+    cube = sim.sweep_materials([alpha, 0.5 * alpha],
+        parameters=list(PARAMETERS))
+    for jp, par in enumerate(PARAMETERS):
+        np.testing.assert_allclose(cube[0, :, jp], pars[par], rtol=1e-5,
+            atol=1e-6, equal_nan=True, err_msg=par)
@@ -0,0 +1,40 @@
+import os
+
+import numpy as np
+import pytest
+import toml
+
+from ra.bvh import BVH_MIN_PLANES
+from ra.ra_g import Simulation, Rays
+
+ROOMS = os.path.join(os.path.dirname(__file__), '..', 'data', 'rooms',
+    'simple')
+
+
+@pytest.mark.parametrize('room, niters', [('simple.dae', 100),
+    ('ico.dae', 8)])
+def test_start_vectorized_traces_the_rays_of_start(tmp_path, room, niters):
+    cfgfile = str(tmp_path / 'ra_g.toml')
+    with open(cfgfile, 'w') as f:
+        f.write(toml.dumps({'sources': [{'position': [0.0, 0.0, 0.5]}],
+            'receivers': [{'position': [1.0, 1.0, 0.5]}],
+            'geometry': {'room': os.path.join(ROOMS, room),
+            'bbox': os.path.join(ROOMS, 'bbox.dae')}}))
+    sims = []
+    for start in ('start', 'start_vectorized'):
+        sim = Simulation(cfgfile)
+        sim.rays = [Rays(s.ris, s.rds, niters) for s in sim.sources]
+        getattr(sim, start)()
+        sims.append(sim)
+    loop, vectorized = sims
+    # ico.dae is traced with its bounding volume hierarchy
+    assert (loop.room_bvh is not None) == (len(loop.room) > BVH_MIN_PLANES)
+    assert vectorized.n_escaped_rays == loop.n_escaped_rays
+    for rays, ref in zip(vectorized.rays, loop.rays):
+        np.testing.assert_array_equal(rays.length, ref.length)
+        for jray, length in enumerate(ref.length):
+            # float32 round off (np.sum against np.dot) in the reflections
+            np.testing.assert_allclose(rays.ris[jray, :length],
+                ref.ris[jray, :length], atol=1e-4)
+            np.testing.assert_allclose(rays.rds[jray, :length],
+                ref.rds[jray, :length], atol=1e-4)
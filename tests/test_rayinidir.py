@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+
+from ra.rayinidir import RayInitialDirections
+
+
+@pytest.mark.parametrize('method', ['random_rays', 'sobol_rays',
+    'fibonacci_rays', 'equal_area_rays'])
+@pytest.mark.parametrize('nrays', [1, 2, 3, 7, 100, 1001, 50000])
+def test_directions_are_nrays_unit_vectors(method, nrays):
+    np.random.seed(0)
+    rays = RayInitialDirections()
+    vinit, Nrays = getattr(rays, method)(nrays)
+    assert Nrays == nrays
+    assert vinit.shape == (nrays, 3)
+    assert np.all(np.isfinite(vinit))
+    np.testing.assert_allclose(np.linalg.norm(vinit, axis=1), 1.0,
+        atol=1e-6)
+
+
+@pytest.mark.parametrize('method', ['fibonacci_rays', 'equal_area_rays'])
+def test_unrotated_directions_cover_the_sphere(method):
+    vinit, _ = getattr(RayInitialDirections(), method)(1000, rotate=False)
+    # the mean direction of an even cover of the sphere is ~0
+    assert np.linalg.norm(vinit.mean(axis=0)) < 1e-2
@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+from ra.receiver_grid import ReceiverGrid
+
+
+# the default cells and the smallest ones (the receivers' diameter)
+@pytest.mark.parametrize('cell_size', [None, 0.0])
+def test_candidates_hold_every_crossed_receiver(cell_size):
+    rng = np.random.RandomState(0)
+    rec_coords = rng.uniform([0, 0, 0], [8, 6, 4], (40, 3))
+    radius = 0.5
+    grid = ReceiverGrid(rec_coords, radius, cell_size)
+    r0 = rng.uniform([-2, -2, -2], [10, 8, 6], (3000, 3))
+    rd = rng.randn(3000, 3)
+    # rays parallel to the axes, from points on the receivers' planes
+    rd[:600] = np.repeat(np.vstack((np.eye(3), -np.eye(3))), 100, axis=0)
+    r0[:600:2, 2] = rec_coords[np.arange(300) % 40, 2]
+    rd /= np.linalg.norm(rd, axis=1)[:, None]
+    length = rng.uniform(0.0, 6.0, 3000)
+    length[::3] = np.inf
+    # brute force: the distance from each center to each segment
+    t = np.clip(np.einsum('srk,sk->sr', rec_coords[None] - r0[:, None], rd),
+        0, length[:, None])
+    dist = np.linalg.norm(r0[:, None] + t[..., None] * rd[:, None] -
+        rec_coords[None], axis=2)
+    crossed = set(zip(*np.nonzero(dist <= radius)))
+    seg, rec = grid.candidates(r0, rd, length)
+    assert np.all(np.diff(seg) >= 0)
+    assert len(set(zip(seg, rec))) == seg.size
+    assert len(crossed) > 100
+    assert crossed <= set(zip(seg, rec))
@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+
+from conftest import parameters, assert_same_parameters
+from ra.results import coarsen_bins, lf_lfc, batch_parameters, \
+    stack_reflectograms, time_bin_index, source_reflectograms, \
+    reflectogram_hist
+
+
+def test_coarsen_bins_drops_the_partial_group():
+    reflectogram = np.arange(8.0).reshape(1, 8)
+    np.testing.assert_array_equal(coarsen_bins(reflectogram, 3),
+        [[0.0, 6.0, 15.0]])
+
+
+@pytest.mark.parametrize('factor', [2, 3, 4, 6])
+def test_set_dt_matches_a_run_at_the_new_dt(simulation, factor):
+    sim = simulation(dt=0.001)
+    sim.run_raytracing()
+    sim.set_dt(factor * 0.001)
+    fresh = simulation(dt=factor * 0.001)
+    fresh.run_raytracing()
+    for sou, ref in zip(sim.sr_results, fresh.sr_results):
+        np.testing.assert_array_equal(sou.time, ref.time)
+        for rec, rec_ref in zip(sou.rec, ref.rec):
+            assert rec.reflectogram.shape == rec_ref.reflectogram.shape
+            np.testing.assert_allclose(rec.reflectogram,
+                rec_ref.reflectogram, rtol=1e-6)
+    assert_same_parameters(parameters(sim), parameters(fresh))
+
+
+def edge_times(time_bins, size, seed):
+    '''random arrival times (float32), a third of them on the bins' edges
+    (exact or rounded to float32) and a few past the last bin'''
+    rng = np.random.RandomState(seed)
+    times = rng.uniform(0.0, 1.05 * time_bins[-1], size)
+    edges = rng.randint(0, time_bins.size, size // 3)
+    times[:edges.size] = time_bins[edges]
+    return times.astype(np.float32)
+
+
+@pytest.mark.parametrize('dt', [0.001, 0.003, 1 / 3000])
+def test_time_bin_index_is_digitize(dt):
+    time_bins = np.arange(0.0, 1.2, dt)
+    for times in (time_bins, np.float32(time_bins),
+        edge_times(time_bins, 3000, 0)):
+        np.testing.assert_array_equal(time_bin_index(time_bins, times),
+            np.digitize(times, time_bins))
+
+
+def test_source_reflectograms_match_the_legacy_ones():
+    time_bins = np.arange(0.0, 0.3, 0.001)
+    freq = np.array([250.0, 1000.0, 4000.0])
+    rng = np.random.RandomState(1)
+    crossings = []
+    for jrec, size in enumerate([500, 1, 2000]):
+        time_cat = edge_times(time_bins, size, jrec)
+        intensity_cat = rng.uniform(0.0, 1.0,
+            (freq.size, size)).astype(np.float32)
+        cos_cat = rng.uniform(-1.0, 1.0, size).astype(np.float32)
+        crossings.append((time_cat, intensity_cat, cos_cat))
+    reflectograms = source_reflectograms(time_bins, crossings)
+    for (time_cat, intensity_cat, cos_cat), reflecto in zip(crossings,
+        reflectograms):
+        # as the RecResults of the baseline, one receiver at a time
+        legacy = [reflectogram_hist(time_bins, time_cat, intensity)
+            for intensity in (intensity_cat, np.multiply(intensity_cat,
+            cos_cat**2), np.multiply(intensity_cat, np.abs(cos_cat)))]
+        for binned, ref in zip(reflecto, legacy):
+            np.testing.assert_array_equal(binned, ref)
+        id_dir = np.argmax(legacy[0][0] > 0)
+        # the single arrival receiver has no LF nor LFC (0 / 0)
+        with np.errstate(invalid='ignore'):
+            pars = [lf_lfc(time_bins, r[0], id_dir, freq, *r[1:])
+                for r in (reflecto, legacy)]
+        for binned, ref in zip(*pars):
+            np.testing.assert_array_equal(binned, ref)
+
+
+def test_lf_lfc_per_band():
+    time_bins = np.arange(0.0, 0.2, 0.001)
+    reflectogram = np.zeros((2, time_bins.size))
+    reflectogram[:, 10:120] = [[1.0], [2.0]]
+    lateral = reflectogram * [[0.5], [0.25]]
+    LF, LFC = lf_lfc(time_bins, reflectogram, 10, np.array([500., 1000.]),
+        lateral, lateral)
+    pars = batch_parameters(time_bins, reflectogram[None],
+        reflecto_cos2=lateral[None], reflecto_cosabs=lateral[None])
+    assert LF[0] != LF[1]
+    np.testing.assert_allclose(LF, pars['LF'][0], rtol=1e-6)
+    np.testing.assert_allclose(LFC, pars['LFC'][0], rtol=1e-6)
+
+
+def test_rec_results_are_the_batch_parameters(simulation):
+    sim = simulation()
+    sim.run_raytracing()
+    recs = [rec for sou in sim.sr_results for rec in sou.rec]
+    pars = batch_parameters(sim.sr_results[0].time, stack_reflectograms(
+        [rec.unit_reflectogram for rec in recs]), reflecto_cos2=
+        stack_reflectograms([rec.unit_reflecto_cos2 for rec in recs]),
+        reflecto_cosabs=stack_reflectograms([rec.unit_reflecto_cosabs
+        for rec in recs]))
+    assert_same_parameters(parameters(sim), pars)
@@ -0,0 +1,41 @@
+import numpy as np
+
+from conftest import ALPHA, ROOM, SOURCES, parameters, \
+    assert_same_parameters
+
+
+def test_run_intensitycalc_uses_the_planes_alpha(simulation):
+    sim = simulation()
+    sim.run_raytracing()
+    alpha = np.tile(np.float32(ALPHA), (len(ROOM), 1))
+    alpha[0] = [0.5, 0.6, 0.7]
+    sim.geometry.planes[0].alpha = alpha[0]
+    sim.run_intensitycalc()
+    np.testing.assert_array_equal(sim.scene.alpha, alpha)
+    fresh = simulation(alpha=alpha)
+    fresh.run_raytracing()
+    assert_same_parameters(parameters(sim), parameters(fresh))
+
+
+def test_update_air_matches_a_run_at_the_new_air(simulation):
+    air = {'Temperature': 10.0, 'hr': 70.0, 'p_atm': 101325.0}
+    sim = simulation()
+    sim.run_raytracing()
+    sim.update_air(air)
+    fresh = simulation(air=air)
+    # the same reflections as the traced paths (N_max_ref depends on c0)
+    fresh.N_max_ref = sim.N_max_ref
+    fresh.run_raytracing()
+    assert_same_parameters(parameters(sim), parameters(fresh))
+
+
+def test_a_silent_band_keeps_its_parameters(simulation):
+    sim = simulation()
+    sim.run_raytracing()
+    silent = simulation()
+    silent.set_sources([dict(SOURCES[0], power_dB=[-np.inf, 80.0, 80.0])])
+    silent.run_raytracing()
+    assert_same_parameters(parameters(silent), parameters(sim))
+    for rec in silent.sr_results[0].rec:
+        assert np.all(rec.reflectogram[0] == 0)
+        assert np.all(np.isfinite(rec.reflectogram))